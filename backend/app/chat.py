@@ -8,7 +8,7 @@ from typing import List, Optional, Dict, Any
 
 from pydantic import BaseModel, Field
 
-from backend.app.routes_profile import load_profile as _load_user_profile
+from backend.app.routes_profile import profile_block as _user_profile_block
 
 # ==== ENV / defaults ====
 PORT = int(os.getenv("PORT", "8000"))
@@ -120,26 +120,11 @@ def _profile_block_from_request(headers: Dict[str, str]) -> str:
     except Exception:
         user_id = "dev"
     try:
-        prof = _load_user_profile(user_id)
+        # профиль и готовый блок — из кэша routes_profile (инвалидация по save/mtime)
+        return _user_profile_block(user_id)
     except Exception:
         return ""
 
-    prefs = getattr(prof, "preferences", {}) or {}
-    facts = getattr(prof, "facts", {}) or {}
-    goals = getattr(prof, "goals", []) or []
-
-    parts = []
-    if getattr(prof, "name", None):
-        parts.append(f"name={prof.name}")
-    if prefs:
-        parts.append("prefs=" + ",".join([f"{k}:{v}" for k, v in list(prefs.items())[:5]]))
-    if facts:
-        parts.append("facts=" + ",".join([f"{k}:{v}" for k, v in list(facts.items())[:6]]))
-    if goals:
-        parts.append("goals=" + "; ".join([getattr(g, 'title', getattr(g, 'id', '')) for g in goals][:3]))
-
-    return "USER_PROFILE: " + " | ".join(parts) if parts else ""
-
 
 def build_messages(system: Optional[str], memory_blocks: List[str], user_text: str, headers: Dict[str, str], style_prompt: Optional[str]) -> List[dict]:
     # Merge profile block
@@ -1,3 +1,3 @@
 # backend/app/ingest/__init__.py
 # makes backend.app.ingest a package
-__all__ = ["readers"]
+__all__ = ["readers", "fetch", "commit", "urls", "pdf", "sidecar"]
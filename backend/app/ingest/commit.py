@@ -0,0 +1,263 @@
+# backend/app/ingest/commit.py — фоновый commit-all: параллельный SHA-256 + прогресс (SSE)
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+INBOX_DIR = Path("data/ingest/inbox")
+STORE_DIR = Path("data/ingest/store")
+
+# hashlib отпускает GIL на больших буферах — потоки реально хэшируют параллельно
+HASH_WORKERS = int(os.getenv("AIR4_INGEST_HASH_WORKERS", str(min(8, (os.cpu_count() or 2)))))
+HASH_CHUNK = 1024 * 1024
+
+# сколько завершённых задач держим в памяти для /ingest/jobs
+_MAX_FINISHED_JOBS = 20
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _sha256_file(path: Path, cancel: threading.Event) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK), b""):
+            if cancel.is_set():
+                raise JobCancelled()
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_index(index_path: Path) -> Dict[str, Any]:
+    try:
+        return json.loads(index_path.read_text()) if index_path.exists() else {}
+    except Exception:
+        return {}
+
+
+class CommitJob:
+    """
+    Одна задача commit-all. Хэширование и перенос идут в пуле потоков,
+    события прогресса копятся в self.events и раздаются подписчикам (SSE).
+    """
+
+    def __init__(self, inbox: Path = INBOX_DIR, store: Path = STORE_DIR):
+        self.id = uuid.uuid4().hex[:12]
+        self.inbox = inbox
+        self.store = store
+        self.status = "queued"  # queued | running | done | cancelled | error
+        self.created_at = int(time.time())
+        self.finished_at: Optional[int] = None
+        self.total = 0
+        self.processed = 0
+        self.moved: List[Dict[str, str]] = []
+        self.duplicates: List[str] = []
+        self.errors: List[Dict[str, str]] = []
+        self.events: List[Dict[str, Any]] = []
+
+        self._cancel = threading.Event()
+        self._place_lock = threading.Lock()  # перенос + индекс — строго по одному
+        self._idx: Dict[str, Any] = {}
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- публичное ----
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "cancelled", "error")
+
+    def cancel(self) -> bool:
+        if self.finished:
+            return False
+        self._cancel.set()
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": self.total,
+            "processed": self.processed,
+            "moved": self.moved,
+            "duplicates": self.duplicates,
+            "errors": self.errors,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "store": str(self.store.resolve()),
+        }
+
+    async def stream(self, start: int = 0) -> AsyncIterator[Dict[str, Any]]:
+        """События с позиции start; завершается после финального события."""
+        pos = max(0, start)
+        while True:
+            while pos < len(self.events):
+                ev = self.events[pos]
+                pos += 1
+                yield ev
+            if self.finished:
+                return
+            await self._changed_event().wait()
+
+    # ---- внутреннее ----
+    def _changed_event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _emit(self, kind: str, **data: Any) -> None:
+        ev = {"seq": len(self.events), "event": kind, "processed": self.processed, "total": self.total}
+        ev.update(data)
+        self.events.append(ev)
+        # будим всех ожидающих и заводим новое событие
+        old = self._changed_event()
+        self._changed = asyncio.Event()
+        old.set()
+
+    def _commit_one(self, f: Path) -> Dict[str, Any]:
+        """Выполняется в потоке пула: хэш по потоку + перенос в store."""
+        if self._cancel.is_set():
+            raise JobCancelled()
+        digest = _sha256_file(f, self._cancel)
+        ext = "".join(f.suffixes) or ""
+        target = self.store / f"{digest}{ext}"
+
+        with self._place_lock:
+            if self._cancel.is_set():
+                raise JobCancelled()
+            if target.exists():
+                try:
+                    f.unlink()
+                except Exception:
+                    pass
+                meta = self._idx.get(digest) or {"size": target.stat().st_size, "names": []}
+                if f.name not in meta["names"]:
+                    meta["names"].append(f.name)
+                meta["size"] = meta.get("size") or target.stat().st_size
+                self._idx[digest] = meta
+                return {"file": f.name, "digest": digest, "dedup": True}
+
+            f.replace(target)
+            size = target.stat().st_size
+            meta = self._idx.get(digest) or {"size": size, "names": []}
+            if f.name not in meta["names"]:
+                meta["names"].append(f.name)
+            meta["size"] = size
+            self._idx[digest] = meta
+            return {"file": f.name, "to": target.name, "digest": digest, "dedup": False}
+
+    async def run(self) -> None:
+        # всё тело под try: упавший mkdir/iterdir не должен оставить задачу вечно "running"
+        loop = asyncio.get_running_loop()
+        index_path = self.store / "index.json"
+        loaded = False  # индекс не прочитан — и писать его нельзя (затёрли бы пустым)
+        try:
+            self.status = "running"
+            self.inbox.mkdir(parents=True, exist_ok=True)
+            self.store.mkdir(parents=True, exist_ok=True)
+
+            files = await asyncio.to_thread(
+                lambda: sorted(f for f in self.inbox.iterdir() if f.is_file() and f.name != "urls.txt")
+            )
+            self._idx = await asyncio.to_thread(_load_index, index_path)
+            loaded = True
+            self.total = len(files)
+            self._emit("start")
+
+            pool = ThreadPoolExecutor(max_workers=max(1, HASH_WORKERS), thread_name_prefix="ingest-hash")
+
+            async def _one(f: Path):
+                try:
+                    return f, await loop.run_in_executor(pool, self._commit_one, f), None
+                except JobCancelled:
+                    return f, None, None
+                except Exception as e:
+                    return f, None, e
+
+            try:
+                for coro in asyncio.as_completed([_one(f) for f in files]):
+                    f, res, err = await coro
+                    if res is None and err is None:
+                        continue  # отменено до/во время хэширования — файл остаётся в inbox
+                    self.processed += 1
+                    if err is not None:
+                        self.errors.append({"file": f.name, "err": str(err)})
+                        self._emit("file_error", file=f.name, err=str(err))
+                        continue
+                    if res["dedup"]:
+                        self.duplicates.append(res["file"])
+                    else:
+                        self.moved.append({"from": res["file"], "to": res["to"]})
+                    self._emit("file", **res)
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+        except asyncio.CancelledError:
+            self._cancel.set()
+            raise
+        except Exception as e:
+            self.errors.append({"job": str(e)})
+            self.status = "error"
+        finally:
+            # индекс пишем один раз в конце (и при отмене — уже перенесённые файлы должны в нём быть)
+            if loaded:
+                try:
+                    data = json.dumps(self._idx, ensure_ascii=False, indent=2)
+                    await asyncio.to_thread(index_path.write_text, data)
+                except Exception as e:
+                    self.errors.append({"index_write_error": str(e)})
+
+            if self.status != "error":
+                self.status = "cancelled" if self._cancel.is_set() else "done"
+            self.finished_at = int(time.time())
+            self._emit("end", status=self.status, moved=len(self.moved), duplicates=len(self.duplicates), errors=len(self.errors))
+
+
+# ---------------- registry ----------------
+
+_JOBS: Dict[str, CommitJob] = {}
+
+
+def _prune_jobs() -> None:
+    done = sorted((j for j in _JOBS.values() if j.finished), key=lambda j: j.finished_at or 0)
+    while len(done) > _MAX_FINISHED_JOBS:
+        _JOBS.pop(done.pop(0).id, None)
+
+
+def active_job() -> Optional[CommitJob]:
+    # задача, чей asyncio-task уже завершился, не активна, даже если статус не успел смениться
+    return next((j for j in _JOBS.values()
+                 if not j.finished and not (j._task is not None and j._task.done())), None)
+
+
+def start_commit_all() -> CommitJob:
+    """Запускает commit-all в фоне (или возвращает уже идущую задачу)."""
+    cur = active_job()
+    if cur is not None:
+        return cur
+    _prune_jobs()
+    job = CommitJob()
+    _JOBS[job.id] = job
+    job._task = asyncio.get_running_loop().create_task(job.run())
+    return job
+
+
+def get_job(job_id: str) -> Optional[CommitJob]:
+    return _JOBS.get(job_id)
+
+
+def list_jobs() -> List[Dict[str, Any]]:
+    return [j.snapshot() for j in sorted(_JOBS.values(), key=lambda j: j.created_at, reverse=True)]
+
+
+async def sse_events(job: CommitJob, start: int = 0) -> AsyncIterator[str]:
+    """Формат text/event-stream: event: <kind>\\ndata: <json>\\n\\n"""
+    async for ev in job.stream(start):
+        yield f"id: {ev['seq']}\nevent: {ev['event']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
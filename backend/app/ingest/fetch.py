@@ -0,0 +1,66 @@
+# backend/app/ingest/fetch.py — URL/PDF → текст (раньше app/ingest.py, который затенялся пакетом ingest/)
+from __future__ import annotations
+import io, os, re, hashlib
+from typing import Tuple
+import httpx
+
+from backend.app.tools.download import aget_capped
+
+MAX_CHARS = 50_000
+# HTML/текст режем по байтам (разметка раздувает их в разы против MAX_CHARS), PDF нужен целиком — свой потолок
+MAX_HTML_BYTES = int(os.getenv("AIR4_INGEST_FETCH_MAX_BYTES", str(4 * 1024 * 1024)))
+MAX_PDF_BYTES = int(os.getenv("AIR4_INGEST_FETCH_MAX_PDF_BYTES", str(64 * 1024 * 1024)))
+
+def _clean(text: str) -> str:
+    text = re.sub(r"\s+", " ", text).strip()
+    return text[:MAX_CHARS]
+
+async def fetch_url_text(url: str) -> Tuple[str, str]:
+    """
+    Качаем потоком: тип по первым байтам; бинарь — обрыв сразу, HTML/текст — до MAX_HTML_BYTES,
+    PDF — до MAX_PDF_BYTES (обрезанный PDF не разобрать — тогда ошибка, а не мусор).
+    """
+    async with httpx.AsyncClient(timeout=httpx.Timeout(15, read=30), follow_redirects=True) as client:
+        d = await aget_capped(client, url, max_bytes=MAX_HTML_BYTES, kind_caps={"pdf": MAX_PDF_BYTES},
+                              accept=("html", "text", "json", "pdf"))
+        d.raise_for_status()
+    ct = d.headers.get("content-type", "")
+    if d.kind not in ("html", "text", "json", "pdf"):
+        raise ValueError(f"unsupported content: {ct or d.kind}")
+    if d.kind == "pdf":
+        if d.truncated:
+            raise ValueError(f"PDF larger than {MAX_PDF_BYTES} bytes")
+        ct = ct if "pdf" in ct.lower() else "application/pdf"
+    return extract_text(d.content, ct), ct
+
+def extract_text(content: bytes, ct: str) -> str:
+    """Текст из тела ответа с учётом content-type (pdf / html / plain)."""
+    if "pdf" in ct.lower():
+        return parse_pdf_bytes(content) or ""
+
+    if "html" in ct.lower() or b"<html" in content[:200].lower():
+        # один разбор lxml (tools/extract.py): скрипты/стили/скрытое выкинуты, блоки — отдельными строками
+        from backend.app.tools.extract import page_text
+        try:
+            src = content.decode("utf-8")
+        except UnicodeDecodeError:
+            src = content  # не utf-8 — пусть lxml возьмёт кодировку из <meta charset>
+        return _clean(page_text(src))
+
+    # как обычный текст
+    try:
+        text = content.decode("utf-8", errors="ignore")
+    except Exception:
+        text = content.decode("latin-1", errors="ignore")
+    return _clean(text)
+
+def parse_pdf_bytes(data: bytes) -> str | None:
+    try:
+        from .pdf import extract_text as pdf_text
+        return _clean(pdf_text(data, max_chars=MAX_CHARS * 2))
+    except Exception:
+        return None
+
+def synth_session_id(prefix: str, source_id: str) -> str:
+    h = hashlib.sha256(source_id.encode("utf-8")).hexdigest()[:10]
+    return f"{prefix}-{h}"
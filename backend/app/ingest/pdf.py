@@ -0,0 +1,231 @@
+# backend/app/ingest/pdf.py — единый PDF-движок (PyMuPDF): страницы лениво, диапазоны параллельно, кэш по digest
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+PdfSource = Union[str, Path, bytes]
+
+# параллелим только большие документы: на мелких старт пула дороже самой экстракции
+PDF_WORKERS = int(os.getenv("AIR4_PDF_WORKERS", str(os.cpu_count() or 2)))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("AIR4_PDF_PARALLEL_MIN_PAGES", "24"))
+PDF_BATCH_PAGES = int(os.getenv("AIR4_PDF_BATCH_PAGES", "8"))
+PDF_PAGE_CACHE = int(os.getenv("AIR4_PDF_PAGE_CACHE", "4096"))  # страниц в LRU
+
+_HEX64 = re.compile(r"^[0-9a-f]{64}$")
+
+
+# ---------------- digest ----------------
+
+def file_digest(path: Union[str, Path]) -> str:
+    """SHA-256 файла. Для файлов из store имя уже и есть digest — не перечитываем."""
+    p = Path(path)
+    stem = p.name.split(".", 1)[0]
+    if _HEX64.match(stem):
+        return stem
+    h = hashlib.sha256()
+    with p.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_digest(src: PdfSource) -> str:
+    if isinstance(src, (bytes, bytearray)):
+        return hashlib.sha256(src).hexdigest()
+    return file_digest(src)
+
+
+# ---------------- page cache ----------------
+
+class _PageCache:
+    """LRU: (digest, page_no) -> text. Общий на процесс."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._d: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._counts: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, digest: str, page: int) -> Optional[str]:
+        with self._lock:
+            v = self._d.get((digest, page))
+            if v is not None:
+                self._d.move_to_end((digest, page))
+            return v
+
+    def put(self, digest: str, page: int, text: str) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._d[(digest, page)] = text
+            self._d.move_to_end((digest, page))
+            while len(self._d) > self.maxsize:
+                self._d.popitem(last=False)
+
+    def count(self, digest: str) -> Optional[int]:
+        with self._lock:
+            return self._counts.get(digest)
+
+    def set_count(self, digest: str, n: int) -> None:
+        with self._lock:
+            self._counts[digest] = n
+
+
+PAGE_CACHE = _PageCache(PDF_PAGE_CACHE)
+
+
+# ---------------- workers ----------------
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn: в uvicorn уже есть потоки, fork с ними небезопасен
+            _POOL = ProcessPoolExecutor(max_workers=max(1, PDF_WORKERS),
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def shutdown_pool() -> None:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+            _POOL = None
+
+
+def _open(src: PdfSource) -> "fitz.Document":
+    if isinstance(src, (bytes, bytearray)):
+        return fitz.open(stream=bytes(src), filetype="pdf")
+    return fitz.open(str(src))
+
+
+def _extract_range(path: str, start: int, stop: int) -> List[str]:
+    """Выполняется в воркере: текст страниц [start, stop)."""
+    with fitz.open(path) as doc:
+        return [doc[i].get_text() for i in range(start, min(stop, doc.page_count))]
+
+
+# ---------------- API ----------------
+
+def page_count(src: PdfSource, digest: Optional[str] = None) -> int:
+    digest = digest or source_digest(src)
+    n = PAGE_CACHE.count(digest)
+    if n is None:
+        with _open(src) as doc:
+            n = doc.page_count
+        PAGE_CACHE.set_count(digest, n)
+    return n
+
+
+def iter_pages(
+    src: PdfSource,
+    start: int = 0,
+    stop: Optional[int] = None,
+    digest: Optional[str] = None,
+    parallel: Optional[bool] = None,
+) -> Iterator[str]:
+    """
+    Лениво отдаёт текст страниц [start, stop) по порядку.
+    Закэшированные страницы не парсятся; недостающие — пачками, для больших
+    файлов на диске — в пуле процессов (параллельно, но выдача по порядку).
+    """
+    digest = digest or source_digest(src)
+    total = page_count(src, digest)
+    stop = total if stop is None else min(stop, total)
+    start = max(0, start)
+    if start >= stop:
+        return
+
+    missing = [i for i in range(start, stop) if PAGE_CACHE.get(digest, i) is None]
+    if parallel is None:
+        parallel = (not isinstance(src, (bytes, bytearray))) and len(missing) >= PDF_PARALLEL_MIN_PAGES and PDF_WORKERS > 1
+
+    if not missing:
+        for i in range(start, stop):
+            yield PAGE_CACHE.get(digest, i) or ""
+        return
+
+    if parallel:
+        # пачки подряд идущих недостающих страниц -> futures; собираем по порядку
+        batches: List[Tuple[int, int]] = []
+        b0 = prev = missing[0]
+        for i in missing[1:]:
+            if i != prev + 1 or i - b0 >= PDF_BATCH_PAGES:
+                batches.append((b0, prev + 1))
+                b0 = i
+            prev = i
+        batches.append((b0, prev + 1))
+        pool = _pool()
+        futs = [(b, pool.submit(_extract_range, str(src), b[0], b[1])) for b in batches]
+        ready: dict = {}
+        bi = 0
+        try:
+            for i in range(start, stop):
+                t = ready.pop(i, None)
+                if t is None:
+                    t = PAGE_CACHE.get(digest, i)
+                if t is None and bi < len(futs) and futs[bi][0][0] <= i:
+                    # ждём только ту пачку, в которой лежит текущая страница
+                    (b0, _), fut = futs[bi]
+                    bi += 1
+                    try:
+                        texts = fut.result()
+                    except Exception:
+                        # пул недоступен (BrokenProcessPool и т.п.) — не роняем ingest, считаем сами
+                        texts = _extract_range(str(src), b0, futs[bi - 1][0][1])
+                    for off, text in enumerate(texts):
+                        PAGE_CACHE.put(digest, b0 + off, text)
+                        ready[b0 + off] = text
+                    t = ready.pop(i, None)
+                if t is None:
+                    # страницу вытеснили из LRU между проверкой и выдачей — дочитываем сами
+                    t = _extract_range(str(src), i, i + 1)[0]
+                    PAGE_CACHE.put(digest, i, t)
+                yield t
+        finally:
+            # генератор закрыли раньше (preview, max_chars) — лишние пачки не считаем
+            for _, f in futs[bi:]:
+                f.cancel()
+        return
+
+    with _open(src) as doc:
+        for i in range(start, stop):
+            t = PAGE_CACHE.get(digest, i)
+            if t is None:
+                t = doc[i].get_text()
+                PAGE_CACHE.put(digest, i, t)
+            yield t
+
+
+def extract_text(
+    src: PdfSource,
+    max_pages: Optional[int] = None,
+    max_chars: Optional[int] = None,
+    digest: Optional[str] = None,
+) -> str:
+    """Полный текст (страницы через '\\n'); останавливается, как только набрано max_chars."""
+    parts: List[str] = []
+    total = 0
+    for t in iter_pages(src, 0, max_pages, digest=digest,
+                        parallel=False if (max_chars or max_pages) else None):
+        parts.append(t)
+        total += len(t) + 1
+        if max_chars is not None and total >= max_chars:
+            break
+    text = "\n".join(parts)
+    return text[:max_chars] if max_chars is not None else text
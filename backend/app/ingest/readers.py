@@ -15,14 +15,15 @@ try:
 except Exception:
     pass
 
-import fitz  # PyMuPDF
+from . import sidecar as _sidecar  # PyMuPDF/python-docx -> lz4 sidecar по digest
 
 # ---- readers ----
 
 def read_pdf(path: str) -> str:
     try:
-        doc = fitz.open(path)
-        return "\n".join(page.get_text() for page in doc)
+        text, meta = _sidecar.get_document(path)
+        print(f"[read_pdf] Extracted text: {len(meta.get('pages') or [])} pages / {len(text)} chars")
+        return text
     except Exception as e:
         print(f"[read_pdf] Failed to read {path}: {e}")
         return ""
@@ -45,8 +46,7 @@ def read_md(path: str) -> str:
 def read_docx(path: str) -> str:
     if not _HAS_DOCX:
         raise RuntimeError("python-docx не установлен. Установи: pip install python-docx")
-    d = docx.Document(path)
-    return "\n".join(p.text for p in d.paragraphs)
+    return _sidecar.get_text(path)
 
 # ---- chunking ----
 
@@ -137,12 +137,3 @@ def ingest_path(
         return len(chunks)
 
     raise RuntimeError("Manager must provide add_texts(...), collection.add(...), or add_text(...)")
-def read_pdf(path: str) -> str:
-    try:
-        doc = fitz.open(path)
-        text = "\n".join(page.get_text() for page in doc)
-        print(f"[read_pdf] Extracted text: {doc.page_count} pages / {len(text)} chars")
-        return text
-    except Exception as e:
-        print(f"[read_pdf] Failed to read {path}: {e}")
-        return ""
@@ -0,0 +1,163 @@
+# backend/app/ingest/sidecar.py — извлечённый текст один раз: data/ingest/store/<digest>.text.lz4 (+ .text.json)
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+# ---- optional deps ----
+_HAS_LZ4 = False
+try:
+    import lz4.frame  # pip install lz4
+    _HAS_LZ4 = True
+except Exception:
+    pass
+
+from . import pdf as _pdf
+
+STORE_DIR = Path("data/ingest/store")
+
+# версия экстрактора по типу: поменялась логика извлечения — поднимаем, старые sidecar-ы пересоздадутся
+EXTRACTOR_VERSION: Dict[str, str] = {
+    ".pdf": "pymupdf-1",
+    ".docx": "python-docx-1",
+}
+
+# дешёвые форматы читаем напрямую — sidecar для них ничего не экономит
+CACHED_EXTS = tuple(EXTRACTOR_VERSION)
+
+
+def _ext(path: Path) -> str:
+    return path.suffix.lower()
+
+
+def sidecar_paths(digest: str, store: Path = STORE_DIR) -> Tuple[Path, Path]:
+    return store / f"{digest}.text.lz4", store / f"{digest}.text.json"
+
+
+def _in_store(path: Path, store: Path) -> bool:
+    try:
+        return path.resolve().parent == store.resolve()
+    except Exception:
+        return False
+
+
+# ---------------- extract ----------------
+
+def _extract_pdf(path: Path, digest: str) -> Tuple[str, List[int]]:
+    parts: List[str] = []
+    offsets: List[int] = []
+    pos = 0
+    for t in _pdf.iter_pages(path, digest=digest):
+        offsets.append(pos)
+        parts.append(t)
+        pos += len(t) + 1  # "\n" между страницами
+    return "\n".join(parts), offsets
+
+
+def _extract_docx(path: Path) -> Tuple[str, List[int]]:
+    import docx  # python-docx
+    d = docx.Document(str(path))
+    return "\n".join(p.text for p in d.paragraphs), [0]
+
+
+def _extract(path: Path, digest: str) -> Tuple[str, List[int]]:
+    ext = _ext(path)
+    if ext == ".pdf":
+        return _extract_pdf(path, digest)
+    if ext == ".docx":
+        return _extract_docx(path)
+    raise RuntimeError(f"Unsupported extension for sidecar: {ext}")
+
+
+# ---------------- load / save ----------------
+
+def load(digest: str, ext: str, store: Path = STORE_DIR) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """(text, meta) из sidecar-а, если он есть и версия экстрактора совпадает."""
+    if not _HAS_LZ4:
+        return None
+    data_p, meta_p = sidecar_paths(digest, store)
+    if not data_p.exists() or not meta_p.exists():
+        return None
+    try:
+        meta = json.loads(meta_p.read_text(encoding="utf-8"))
+        if meta.get("version") != EXTRACTOR_VERSION.get(ext):
+            return None
+        text = lz4.frame.decompress(data_p.read_bytes()).decode("utf-8")
+        return text, meta
+    except Exception:
+        return None
+
+
+def save(digest: str, ext: str, text: str, pages: List[int], source: str = "",
+         store: Path = STORE_DIR) -> Dict[str, Any]:
+    meta = {
+        "digest": digest,
+        "ext": ext,
+        "version": EXTRACTOR_VERSION.get(ext),
+        "chars": len(text),
+        "pages": pages,  # смещения начала страниц в text
+        "source": source,
+        "created_at": int(time.time()),
+    }
+    if not _HAS_LZ4:
+        return meta
+    data_p, meta_p = sidecar_paths(digest, store)
+    store.mkdir(parents=True, exist_ok=True)
+    # tmp свой у каждого воркера/потока: один и тот же PDF могут извлекать параллельно
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    # сначала данные, потом мета — мета без данных не появится
+    for path, blob in ((data_p, lz4.frame.compress(text.encode("utf-8"))),
+                       (meta_p, json.dumps(meta, ensure_ascii=False).encode("utf-8"))):
+        tmp = path.with_name(path.name + suffix)
+        try:
+            tmp.write_bytes(blob)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    return meta
+
+
+def get_document(path: Union[str, Path], store: Path = STORE_DIR) -> Tuple[str, Dict[str, Any]]:
+    """
+    Текст документа: из sidecar-а по digest или извлекаем и (для файлов из store) сохраняем.
+    Для неподдерживаемых расширений — RuntimeError.
+    """
+    p = Path(path)
+    ext = _ext(p)
+    if ext not in CACHED_EXTS:
+        raise RuntimeError(f"Unsupported extension for sidecar: {ext}")
+    digest = _pdf.file_digest(p)
+    hit = load(digest, ext, store)
+    if hit is not None:
+        return hit
+    text, pages = _extract(p, digest)
+    meta = None
+    if _in_store(p, store):
+        try:
+            meta = save(digest, ext, text, pages, source=p.name, store=store)
+        except Exception as e:  # текст уже извлечён — без кэша просто извлечём заново в следующий раз
+            print(f"[WARN] sidecar save failed for {p.name}: {e}")
+    if meta is None:
+        meta = {"digest": digest, "ext": ext, "version": EXTRACTOR_VERSION.get(ext),
+                "chars": len(text), "pages": pages, "source": p.name}
+    return text, meta
+
+
+def get_text(path: Union[str, Path], store: Path = STORE_DIR) -> str:
+    return get_document(path, store)[0]
+
+
+def page_slice(text: str, meta: Dict[str, Any], start: int = 0, stop: Optional[int] = None) -> str:
+    """Текст страниц [start, stop) по сохранённым смещениям."""
+    offs = list(meta.get("pages") or [0])
+    stop = len(offs) if stop is None else min(stop, len(offs))
+    if start >= stop:
+        return ""
+    a = offs[start]
+    b = offs[stop] - 1 if stop < len(offs) else len(text)
+    return text[a:b]
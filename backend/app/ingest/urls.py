@@ -0,0 +1,371 @@
+# backend/app/ingest/urls.py — URL ingest: очередь urls.txt -> async fetch pool -> чанки в память
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from backend.app.tools.download import Download, aget_capped
+
+from .fetch import MAX_HTML_BYTES, MAX_PDF_BYTES, extract_text
+from .readers import chunk_text, infer_title
+
+QUEUE_FILE = Path("data/ingest/inbox/urls.txt")
+STATE_FILE = Path("data/ingest/url_state.json")
+
+# лимиты: общий пул + на один хост (чтобы не долбить один сайт)
+URL_CONCURRENCY = int(os.getenv("AIR4_URL_CONCURRENCY", "16"))
+URL_PER_HOST = int(os.getenv("AIR4_URL_PER_HOST", "2"))
+URL_HOST_DELAY_SEC = float(os.getenv("AIR4_URL_HOST_DELAY_SEC", "0.5"))
+URL_MAX_ATTEMPTS = int(os.getenv("AIR4_URL_MAX_ATTEMPTS", "3"))
+URL_TIMEOUT = httpx.Timeout(15, read=30)
+
+UA = "AIR4Bot/1.0 (+local)"
+
+# ---- optional deps ----
+_HAS_FCNTL = False
+try:
+    import fcntl  # нет на Windows — там очередь защищена только внутри процесса
+    _HAS_FCNTL = True
+except Exception:
+    pass
+
+_QUEUE_LOCK = threading.Lock()
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+
+def _chunk_ids(url: str, n: int) -> List[str]:
+    h = _url_key(url)
+    return [f"url::{h}::chunk-{i}" for i in range(n)]
+
+
+def _load_state() -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads(STATE_FILE.read_text(encoding="utf-8")) if STATE_FILE.exists() else {}
+    except Exception:
+        return {}
+
+
+def _save_state(updates: Dict[str, Dict[str, Any]]) -> None:
+    """Мержим только затронутые URL — параллельный drain и /ingest/url не затирают друг друга."""
+    STATE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    state = _load_state()
+    state.update(updates)
+    tmp = STATE_FILE.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    os.replace(tmp, STATE_FILE)
+
+
+def read_queue() -> List[str]:
+    if not QUEUE_FILE.exists():
+        return []
+    seen, out = set(), []
+    for line in QUEUE_FILE.read_text(encoding="utf-8", errors="ignore").splitlines():
+        u = line.strip()
+        if u and not u.startswith("#") and u not in seen:
+            seen.add(u)
+            out.append(u)
+    return out
+
+
+@contextmanager
+def _queue_locked():
+    """enqueue и _drop_from_queue — под одной блокировкой (поток + flock между воркерами)."""
+    QUEUE_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with _QUEUE_LOCK:
+        if not _HAS_FCNTL:
+            yield
+            return
+        with open(str(QUEUE_FILE) + ".lock", "ab") as lf:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+
+def enqueue(urls: List[str]) -> None:
+    with _queue_locked():
+        with QUEUE_FILE.open("a", encoding="utf-8") as fh:
+            for u in urls:
+                if u.strip():
+                    fh.write(u.strip() + "\n")
+
+
+def _drop_from_queue(done: set) -> None:
+    """Убираем обработанные URL; строки, дописанные во время drain, сохраняются (enqueue ждёт блокировку)."""
+    with _queue_locked():
+        if not QUEUE_FILE.exists():
+            return
+        lines = QUEUE_FILE.read_text(encoding="utf-8", errors="ignore").splitlines()
+        keep = [ln for ln in lines if ln.strip() and ln.strip() not in done]
+        tmp = QUEUE_FILE.with_suffix(".txt.tmp")
+        tmp.write_text(("\n".join(keep) + "\n") if keep else "", encoding="utf-8")
+        os.replace(tmp, QUEUE_FILE)
+
+
+def _extract(d: Download) -> tuple[str, str]:
+    """
+    (title, text): HTML — основной блок (tools/extract.py), PDF — fetch.extract_text.
+    d.text уже декодирован по charset из Content-Type или <meta> (download.py), а не принудительно utf-8.
+    """
+    ct = d.headers.get("content-type", "")
+    if d.kind == "html":
+        try:
+            from backend.app.tools.extract import extract_readable
+            title, text = extract_readable(d.text)
+            if text.strip():
+                return title, text
+        except Exception:
+            pass
+    if d.kind == "pdf":
+        text = extract_text(d.content, ct if "pdf" in ct.lower() else "application/pdf")
+    elif d.kind == "html":
+        from backend.app.tools.extract import page_text
+        text = page_text(d.text)
+    else:
+        text = d.text
+    return (infer_title(text) or ""), text
+
+
+def _index(mgr: Any, url: str, title: str, text: str, prev_chunks: int, tag: str) -> int:
+    chunks = chunk_text(text)
+    ids = _chunk_ids(url, len(chunks))
+    col = getattr(mgr, "collection", None) or getattr(mgr, "col", None)
+
+    # старые чанки этого URL убираем (контент изменился / стало меньше)
+    if prev_chunks and col is not None and hasattr(col, "delete"):
+        try:
+            col.delete(ids=_chunk_ids(url, prev_chunks))
+        except Exception:
+            pass
+    if not chunks:
+        return 0
+
+    ts = int(time.time())
+    metas = []
+    for i, _ in enumerate(chunks):
+        metas.append({
+            "tag": tag,
+            "kind": "url",
+            "source": "url",
+            "ts": ts,
+            "filename": url,
+            "source_path": url,
+            "title": title or url,
+            "chunk": i,
+            "chunk_index": i,
+        })
+
+    if hasattr(mgr, "add_texts"):
+        mgr.add_texts(chunks, metas, ids=ids)
+    elif col is not None:
+        col.add(documents=chunks, metadatas=metas, ids=ids)
+    elif hasattr(mgr, "add_text"):
+        for ch in chunks:
+            try:
+                mgr.add_text(user_id="dev", text=ch, session_id=None, source="url")
+            except TypeError:
+                mgr.add_text("dev", ch, None, "url")
+    else:
+        raise RuntimeError("No supported add method on memory manager")
+    return len(chunks)
+
+
+class UrlIngestor:
+    """
+    Async fetch pool: глобальный семафор + семафор и минимальный интервал на хост.
+    Повторные прогоны шлют If-None-Match / If-Modified-Since; 304 и неизменный текст не переиндексируются.
+    """
+
+    def __init__(self, mgr: Any, tag: str = "url", concurrency: int = URL_CONCURRENCY,
+                 per_host: int = URL_PER_HOST, host_delay: float = URL_HOST_DELAY_SEC):
+        self.mgr = mgr
+        self.tag = tag
+        self.concurrency = max(1, concurrency)
+        self.per_host = max(1, per_host)
+        self.host_delay = max(0.0, host_delay)
+        self.state = _load_state()
+        self.stats = {"total": 0, "done": 0, "indexed": 0, "not_modified": 0, "unchanged": 0, "failed": 0}
+        self._cancel = False
+        self._global = asyncio.Semaphore(self.concurrency)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._host_next: Dict[str, float] = {}
+        self._index_lock = asyncio.Lock()
+        self._touched: set = set()
+
+    def cancel(self) -> None:
+        self._cancel = True
+
+    async def _host_slot(self, host: str) -> None:
+        # выдерживаем паузу между запросами к одному хосту
+        now = time.monotonic()
+        start = max(now, self._host_next.get(host, 0.0))
+        self._host_next[host] = start + self.host_delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    async def _one(self, client: httpx.AsyncClient, url: str) -> Dict[str, Any]:
+        host = urllib.parse.urlparse(url).netloc.lower()
+        st = self.state.get(url) or {}
+        if not host:
+            return {"url": url, "status": "failed", "error": "bad url"}
+        sem = self._hosts.setdefault(host, asyncio.Semaphore(self.per_host))
+
+        # сначала слот хоста, потом глобальный — иначе запросы к одному хосту займут весь пул ожиданием
+        async with sem:
+            if self._cancel:
+                return {"url": url, "status": "skipped"}
+            await self._host_slot(host)
+            headers = {"User-Agent": UA}
+            if st.get("etag"):
+                headers["If-None-Match"] = st["etag"]
+            if st.get("last_modified"):
+                headers["If-Modified-Since"] = st["last_modified"]
+            async with self._global:
+                try:
+                    # потоком и с потолком по байтам, как fetch.fetch_url_text; бинарь — обрыв сразу
+                    d = await aget_capped(client, url, headers=headers, max_bytes=MAX_HTML_BYTES,
+                                          kind_caps={"pdf": MAX_PDF_BYTES}, accept=("html", "text", "json", "pdf"))
+                    if d.status_code == 304:
+                        return {"url": url, "status": "not_modified"}
+                    d.raise_for_status()
+                    if d.kind not in ("html", "text", "json", "pdf"):
+                        raise ValueError(f"unsupported content: {d.headers.get('content-type') or d.kind}")
+                    if d.kind == "pdf" and d.truncated:
+                        raise ValueError(f"PDF larger than {MAX_PDF_BYTES} bytes")
+                except Exception as e:
+                    return {"url": url, "status": "failed", "error": str(e)}
+                ct = d.headers.get("content-type", "")
+                etag = d.headers.get("etag")
+                last_mod = d.headers.get("last-modified")
+
+        # извлечение (CPU) — вне семафоров, в потоке
+        try:
+            title, text = await asyncio.to_thread(_extract, d)
+        except Exception as e:
+            return {"url": url, "status": "failed", "error": f"extract: {e}"}
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        res: Dict[str, Any] = {"url": url, "etag": etag, "last_modified": last_mod,
+                               "content_type": ct, "text_hash": text_hash, "title": title}
+        if st.get("text_hash") == text_hash and st.get("chunks"):
+            res.update(status="unchanged", chunks=st.get("chunks", 0))
+            return res
+        # индексация в Chroma последовательно (один writer)
+        async with self._index_lock:
+            try:
+                n = await asyncio.to_thread(_index, self.mgr, url, title, text, int(st.get("chunks") or 0), self.tag)
+            except Exception as e:
+                return {"url": url, "status": "failed", "error": f"index: {e}"}
+        res.update(status="indexed", chunks=n)
+        return res
+
+    def _record(self, res: Dict[str, Any]) -> None:
+        url = res["url"]
+        st = dict(self.state.get(url) or {})
+        status = res["status"]
+        st["ts"] = int(time.time())
+        st["status"] = status
+        if status == "failed":
+            st["attempts"] = int(st.get("attempts") or 0) + 1
+            st["error"] = res.get("error")
+        elif status != "skipped":
+            st["attempts"] = 0
+            st.pop("error", None)
+            for k in ("etag", "last_modified", "content_type", "text_hash", "title", "chunks"):
+                if res.get(k) is not None:
+                    st[k] = res[k]
+        self.state[url] = st
+        self._touched.add(url)
+
+    async def _flush(self) -> None:
+        if self._touched:
+            updates = {u: self.state[u] for u in self._touched}
+            self._touched = set()
+            await asyncio.to_thread(_save_state, updates)
+
+    async def run(self, urls: List[str], on_result=None) -> List[Dict[str, Any]]:
+        self.stats["total"] = len(urls)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        results: List[Dict[str, Any]] = []
+        async with httpx.AsyncClient(timeout=URL_TIMEOUT, follow_redirects=True, limits=limits) as client:
+            for fut in asyncio.as_completed([self._one(client, u) for u in urls]):
+                res = await fut
+                self._record(res)
+                self.stats["done"] += 1
+                if res["status"] in self.stats:
+                    self.stats[res["status"]] += 1
+                results.append(res)
+                if on_result:
+                    on_result(res)
+                # на длинных ночных прогонах периодически сохраняем прогресс
+                if len(self._touched) >= 100:
+                    await self._flush()
+        await self._flush()
+        return results
+
+
+# ---------------- drain (фоновая задача) ----------------
+
+_DRAIN: Dict[str, Any] = {"task": None, "ingestor": None, "started_at": None, "finished_at": None}
+
+
+async def _drain(ing: UrlIngestor, urls: List[str]) -> None:
+    try:
+        results = await ing.run(urls)
+        done = {r["url"] for r in results if r["status"] != "skipped"
+                and (r["status"] != "failed" or int((ing.state.get(r["url"]) or {}).get("attempts") or 0) >= URL_MAX_ATTEMPTS)}
+        await asyncio.to_thread(_drop_from_queue, done)
+    finally:
+        _DRAIN["finished_at"] = int(time.time())
+
+
+def start_drain(mgr: Any, tag: str = "url") -> Dict[str, Any]:
+    """Запускает drain urls.txt в фоне (если ещё не идёт)."""
+    task = _DRAIN.get("task")
+    if task is not None and not task.done():
+        return drain_status()
+    urls = read_queue()
+    ing = UrlIngestor(mgr, tag=tag)
+    _DRAIN.update(ingestor=ing, started_at=int(time.time()), finished_at=None)
+    _DRAIN["task"] = asyncio.get_running_loop().create_task(_drain(ing, urls))
+    return drain_status()
+
+
+def cancel_drain() -> bool:
+    task, ing = _DRAIN.get("task"), _DRAIN.get("ingestor")
+    if task is None or task.done() or ing is None:
+        return False
+    ing.cancel()
+    return True
+
+
+def drain_status() -> Dict[str, Any]:
+    task, ing = _DRAIN.get("task"), _DRAIN.get("ingestor")
+    running = task is not None and not task.done()
+    return {
+        "running": running,
+        "started_at": _DRAIN.get("started_at"),
+        "finished_at": _DRAIN.get("finished_at"),
+        "stats": dict(ing.stats) if ing else {},
+        "queued": len(read_queue()),
+    }
+
+
+async def ingest_url_now(mgr: Any, url: str, tag: str = "url") -> Dict[str, Any]:
+    """Одиночный URL (POST /ingest/url): сразу качаем и индексируем, состояние общее с drain."""
+    ing = UrlIngestor(mgr, tag=tag)
+    res = (await ing.run([url]))[0]
+    return res
@@ -3,16 +3,18 @@ from __future__ import annotations
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
 import os
 import time
 import uuid
 from typing import Dict, Optional, List
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from urllib.parse import quote
 from pydantic import BaseModel, Field
 
 # Phase-9+: memory + chat modules
@@ -53,7 +55,7 @@ templates = Jinja2Templates(directory=TEMPLATES_DIR)
 _now = lambda: int(time.time())
 
 # -----------------------------------------------------------------------------
-# Sessions (in-memory dict; persisted messages live in Chroma via memory manager)
+# Sessions (shared store: memory | sqlite; persisted messages live in Chroma via memory manager)
 # -----------------------------------------------------------------------------
 class Session(BaseModel):
     id: str
@@ -61,22 +63,34 @@ class Session(BaseModel):
     created_at: int = Field(default_factory=_now)
     updated_at: int = Field(default_factory=_now)
     turns: int = 0  # quick stat for UI
+    version: int = 0  # версия хранилища на момент последней записи (для ?since=)
 
-_SESSIONS: Dict[str, Session] = {}
+from backend.app.session_store import decode_cursor, encode_cursor, get_session_store
+
+SESSIONS = get_session_store()
+
+
+def load_session(session_id: str) -> Optional[Session]:
+    rec = SESSIONS.get(session_id)
+    return Session(**rec) if rec is not None else None
+
+
+def save_session(sess: Session) -> None:
+    SESSIONS.put(sess.model_dump())
 
 
 def ensure_session(session_id: Optional[str]) -> Session:
-    if session_id and session_id in _SESSIONS:
-        return _SESSIONS[session_id]
+    if session_id:
+        sess = load_session(session_id)
+        if sess is not None:
+            return sess
     sid = session_id or uuid.uuid4().hex[:8]
-    sess = Session(id=sid)
-    _SESSIONS[sid] = sess
-    return sess
+    # create = insert-if-absent: два воркера с одним id получат одну и ту же сессию
+    return Session(**SESSIONS.create(Session(id=sid).model_dump()))
 
 # -----------------------------------------------------------------------------
 # Debug/Tools: simple memory search endpoint
 # -----------------------------------------------------------------------------
-from fastapi import Query
 import inspect
 
 def _mem_try_search(mem, q: str, k: int):
@@ -260,7 +274,8 @@ def _init_memory() -> None:
     if MEMORY is not None:
         return
 
-    persist_dir = os.getenv("AIR4_CHROMA_DIR", "./data/chroma")
+    from backend.app.memory.chroma_registry import CHROMA_DIR
+    persist_dir = CHROMA_DIR  # AIR4_CHROMA_DIR — общий каталог для всех коллекций
     collection = os.getenv("AIR4_CHROMA_COLLECTION", "air4")
     embed_model = os.getenv("AIR4_EMBED_MODEL_PATH") or os.getenv("AIR4_EMBED_MODEL", "all-MiniLM-L6-v2")
 
@@ -280,6 +295,51 @@ def _init_memory() -> None:
 @app.on_event("startup")
 def _startup() -> None:
     _init_memory()
+    try:
+        from backend.app.memory.manager import start_history_compactor
+        start_history_compactor()
+    except Exception as e:
+        print(f"[WARN] history compactor start failed: {e}")
+
+
+@app.on_event("shutdown")
+def _shutdown() -> None:
+    try:
+        from backend.app.memory.manager import stop_history_compactor
+        stop_history_compactor()
+    except Exception:
+        pass
+    try:
+        from backend.app.ingest.pdf import shutdown_pool
+        shutdown_pool()
+    except Exception:
+        pass
+    try:
+        from backend.app.tools.web import shutdown_extract_pool
+        shutdown_extract_pool()
+    except Exception:
+        pass
+
+
+# Фоновые сводки сессий (AIR4_SUMMARY_WORKER=1): батч ходов -> один delta-вызов LLM
+async def _summary_llm(prompt: str, **_kw) -> str:
+    return await chat_mod.call_ollama([{"role": "user", "content": prompt}], None)
+
+
+@app.on_event("startup")
+async def _start_summary_worker() -> None:
+    from backend.app.memory import summarizer as _sm
+    if _sm.SUMMARY_WORKER:
+        _sm.start_worker(_summary_llm)
+
+
+@app.on_event("shutdown")
+async def _stop_summary_worker() -> None:
+    try:
+        from backend.app.memory.summarizer import stop_worker
+        await stop_worker()
+    except Exception as e:
+        print(f"[WARN] summary worker stop failed: {e}")
 
 
 # -----------------------------------------------------------------------------
@@ -315,7 +375,7 @@ async def health() -> dict:
     return {
         "ok": True,
         "ts": _now(),
-        "sessions": len(_SESSIONS),
+        "sessions": SESSIONS.count(),
         "memory_backend": backend,
         "model": model,
         "offline": False,
@@ -335,10 +395,34 @@ async def ui_chat(request: Request):
     return templates.TemplateResponse("chat.html", {"request": request, "active": "chat"})
 
 
+SESSIONS_PAGE_SIZE = int(os.getenv("AIR4_SESSIONS_PAGE_SIZE", "50"))
+
+
+def _sessions_etag(kind: str, version: int, *parts: object) -> str:
+    # версия хранилища + параметры страницы: другая страница — другой ETag
+    key = ":".join(str(p) for p in parts if p is not None)
+    return f'W/"{kind}-{version}-{key}"'
+
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    inm = request.headers.get("if-none-match") or ""
+    if etag in [t.strip() for t in inm.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+
 @app.get("/ui/sessions", response_class=HTMLResponse)
-async def ui_sessions() -> HTMLResponse:
+async def ui_sessions(request: Request, cursor: Optional[str] = None,
+                      limit: int = Query(SESSIONS_PAGE_SIZE, ge=1, le=500)) -> Response:
     import datetime as _dt
 
+    # версию читаем до выборки: если кто-то запишет между ними, следующий опрос всё равно увидит новый ETag
+    version = SESSIONS.version()
+    etag = _sessions_etag("ui-sessions", version, cursor, limit)
+    nm = _not_modified(request, etag)
+    if nm is not None:
+        return nm
+
     def _label(ts: int) -> str:
         dt = _dt.datetime.fromtimestamp(ts)
         today = _dt.datetime.now().date()
@@ -348,8 +432,12 @@ async def ui_sessions() -> HTMLResponse:
             return "Yesterday"
         return dt.strftime("%b %d, %Y")
 
+    rows = SESSIONS.list(limit=limit + 1, after=decode_cursor(cursor))
+    more = len(rows) > limit
+    rows = rows[:limit]
+
     groups: Dict[str, List[Session]] = {}
-    for s in sorted(_SESSIONS.values(), key=lambda x: x.updated_at, reverse=True):
+    for s in (Session(**r) for r in rows):
         groups.setdefault(_label(s.updated_at), []).append(s)
 
     parts: List[str] = []
@@ -368,16 +456,56 @@ async def ui_sessions() -> HTMLResponse:
                 '</div>'
             )
         parts.append('</div>')
-    html = "\n".join(parts) if parts else '<div class="sb-section"><div class="sb-sub">No sessions yet</div></div>'
-    return HTMLResponse(content=html)
+    if more:
+        # следующая страница подгружается на место кнопки
+        nxt = quote(encode_cursor(rows[-1]))
+        parts.append(
+            f'<div class="sb-more" hx-get="/ui/sessions?cursor={nxt}&limit={limit}" '
+            'hx-trigger="click" hx-swap="outerHTML"><div class="sb-sub">More…</div></div>'
+        )
+    if parts:
+        html = "\n".join(parts)
+    elif cursor:
+        html = ""
+    else:
+        html = '<div class="sb-section"><div class="sb-sub">No sessions yet</div></div>'
+    return HTMLResponse(content=html, headers={
+        "ETag": etag, "Cache-Control": "no-cache", "X-Sessions-Version": str(version),
+    })
 
 
 # -----------------------------------------------------------------------------
 # Sessions endpoints (minimal set used by UI)
 # -----------------------------------------------------------------------------
 @app.get("/sessions")
-async def list_sessions() -> List[Session]:
-    return sorted(_SESSIONS.values(), key=lambda s: s.updated_at, reverse=True)
+async def list_sessions(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor предыдущей страницы"),
+    since: Optional[int] = Query(None, ge=0, description="только сессии, изменённые после этой версии"),
+) -> List[Session]:
+    """
+    Без параметров — весь список (как раньше). limit/cursor — страницы по updated_at DESC,
+    since — изменения после версии (X-Sessions-Version), по возрастанию версии.
+    """
+    version = SESSIONS.version()
+    etag = _sessions_etag("sessions", version, limit, cursor, since)
+    nm = _not_modified(request, etag)
+    if nm is not None:
+        return nm  # type: ignore[return-value]
+
+    if since is not None:
+        rows = SESSIONS.changed_since(since, limit=limit)
+    else:
+        rows = SESSIONS.list(limit=(limit + 1) if limit else None, after=decode_cursor(cursor))
+        if limit and len(rows) > limit:
+            rows = rows[:limit]
+            response.headers["X-Next-Cursor"] = encode_cursor(rows[-1])
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Sessions-Version"] = str(version)
+    return [Session(**r) for r in rows]
 
 
 @app.post("/sessions")
@@ -387,9 +515,28 @@ async def create_session() -> Session:
 
 @app.get("/sessions/{session_id}")
 async def get_session(session_id: str) -> Session:
-    if session_id not in _SESSIONS:
+    sess = load_session(session_id)
+    if sess is None:
         raise HTTPException(status_code=404, detail="No such session")
-    return _SESSIONS[session_id]
+    return sess
+
+
+@app.get("/sessions/{session_id}/messages")
+async def get_session_messages(
+    session_id: str,
+    before: Optional[int] = Query(None, ge=0, description="seq первого уже загруженного сообщения"),
+    limit: int = Query(50, ge=1, le=500),
+) -> dict:
+    """Последние сообщения (before не задан) или страница старше before — для подгрузки при прокрутке."""
+    from backend.app.memory.messages import MESSAGES
+    items = MESSAGES.page("dev", session_id, before=before, limit=limit)
+    first = items[0].seq if items else 0
+    return {
+        "session_id": session_id,
+        "items": [m.to_dict() for m in items],
+        # раньше first_seq — только архив (history compaction), страницами не отдаём
+        "next_before": first if first > MESSAGES.first_seq("dev", session_id) else None,
+    }
 
 
 # -----------------------------------------------------------------------------
@@ -403,6 +550,12 @@ async def send3(payload: Send3In) -> Send3Out:
     if not user_text:
         raise HTTPException(status_code=400, detail="text is empty")
 
+    from backend.app.memory.messages import MESSAGES
+    try:
+        MESSAGES.append("dev", sess.id, "user", user_text)
+    except Exception as e:
+        print(f"[WARN] message store append (user) failed: {e}")
+
     mem_ids: List[str] = []
     if MEMORY is not None and hasattr(MEMORY, 'add_text'):
         try:
@@ -444,6 +597,16 @@ async def send3(payload: Send3In) -> Send3Out:
         # last resort — readable fallback
         reply = f"Принял. {user_text}"
 
+    try:
+        MESSAGES.append("dev", sess.id, "assistant", reply)
+    except Exception as e:
+        print(f"[WARN] message store append (assistant) failed: {e}")
+
+    from backend.app.memory.summarizer import get_worker
+    worker = get_worker()
+    if worker is not None:
+        worker.enqueue("dev", sess.id, user_text, reply)  # сводка — в фоне, пачкой
+
     if MEMORY is not None and hasattr(MEMORY, 'add_text'):
         try:
             res2 = MEMORY.add_text(user_id="dev", text=reply, session_id=sess.id, source="assistant")
@@ -463,6 +626,7 @@ async def send3(payload: Send3In) -> Send3Out:
     if sess.title == "New session":
         t = user_text.replace("\n", " ")[:48].strip()
         sess.title = t or "New session"
+    save_session(sess)
 
     return Send3Out(
         session_id=sess.id,
@@ -528,7 +692,31 @@ async def ui_ingest_status():
 
 @app.post('/ui/ingest/commit-all', response_class=HTMLResponse)
 async def ui_ingest_commit_all():
-    return HTMLResponse('<pre>OK: committed (stub)</pre>')
+    # запускаем фоновую задачу и подписываемся на её SSE-прогресс
+    from backend.app.ingest.commit import start_commit_all
+    job = start_commit_all()
+    html = (
+        f'<span id="commit-{job.id}">⏳ commit-all запущен…</span> '
+        f'<button class="ing-pill" hx-delete="/ui/ingest/jobs/{job.id}" hx-swap="none">Отменить</button>\n'
+        '<script>(function(){'
+        f'var el=document.getElementById("commit-{job.id}");'
+        f'var es=new EventSource("/ingest/jobs/{job.id}/events");'
+        'function upd(e){var d=JSON.parse(e.data);'
+        'el.textContent="⏳ "+d.processed+"/"+d.total'
+        '+(d.file?" · "+d.file:"")+(d.err?" ✖ "+d.err:"");}'
+        'es.addEventListener("start",upd);es.addEventListener("file",upd);es.addEventListener("file_error",upd);'
+        'function fin(e){var d=JSON.parse(e.data);es.close();'
+        'el.textContent=(d.status==="done"?"✅ ":"⛔ ")+d.status+": moved="+d.moved+", dup="+d.duplicates+", errors="+d.errors;}'
+        'es.addEventListener("end",fin);'
+        '})();</script>'
+    )
+    return HTMLResponse(html)
+
+@app.delete('/ui/ingest/jobs/{job_id}', response_class=HTMLResponse)
+async def ui_ingest_job_cancel(job_id: str):
+    from backend.app.ingest.commit import get_job
+    job = get_job(job_id)
+    return HTMLResponse("" if job is None or not job.cancel() else "<pre>cancelling…</pre>")
 
 @app.delete('/ui/ingest/clear', response_class=HTMLResponse)
 async def ui_ingest_clear():
@@ -668,64 +856,60 @@ async def ingest_commit(name: str):
 
 @app.post('/ingest/commit-all')
 async def ingest_commit_all():
-    """Коммитит все файлы из data/ingest/inbox в data/ingest/store с SHA256-дедупликацией."""
-    import hashlib, json
-    from pathlib import Path
+    """Запускает фоновый commit-all (inbox -> store, SHA256-дедуп) и сразу возвращает job handle."""
+    from backend.app.ingest.commit import start_commit_all
 
-    inbox = Path("data/ingest/inbox"); inbox.mkdir(parents=True, exist_ok=True)
-    store = Path("data/ingest/store"); store.mkdir(parents=True, exist_ok=True)
-    index_path = store / "index.json"
+    job = start_commit_all()
+    return {
+        "ok": True,
+        "job_id": job.id,
+        "status": job.status,
+        "job": f"/ingest/jobs/{job.id}",
+        "events": f"/ingest/jobs/{job.id}/events",
+    }
 
-    # загрузим/инициализируем индекс
-    try:
-        idx = json.loads(index_path.read_text()) if index_path.exists() else {}
-    except Exception:
-        idx = {}
 
-    moved, duplicates, errors = [], [], []
+@app.get('/ingest/jobs')
+async def ingest_jobs():
+    from backend.app.ingest.commit import list_jobs
+    return {"ok": True, "jobs": list_jobs()}
 
-    for f in sorted(inbox.iterdir()):
-        if not f.is_file() or f.name == "urls.txt":
-            continue
-        try:
-            # sha256 по потоку
-            h = hashlib.sha256()
-            with f.open("rb") as fh:
-                for chunk in iter(lambda: fh.read(1024*1024), b""):
-                    h.update(chunk)
-            digest = h.hexdigest()
-
-            ext = "".join(f.suffixes) or ""
-            target = store / f"{digest}{ext}"
-
-            if target.exists():
-                try: f.unlink()
-                except Exception: pass
-                duplicates.append(f.name)
-                meta = idx.get(digest) or {"size": target.stat().st_size, "names": []}
-                if f.name not in meta["names"]:
-                    meta["names"].append(f.name)
-                meta["size"] = meta.get("size") or target.stat().st_size
-                idx[digest] = meta
-            else:
-                f.replace(target)
-                moved.append({"from": f.name, "to": target.name})
-                size = target.stat().st_size
-                meta = idx.get(digest) or {"size": size, "names": []}
-                if f.name not in meta["names"]:
-                    meta["names"].append(f.name)
-                meta["size"] = size
-                idx[digest] = meta
-        except Exception as e:
-            errors.append({"file": f.name, "err": str(e)})
 
-    # сохранить индекс
+@app.get('/ingest/jobs/{job_id}')
+async def ingest_job(job_id: str):
+    from backend.app.ingest.commit import get_job
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return {"ok": True, **job.snapshot()}
+
+
+@app.get('/ingest/jobs/{job_id}/events')
+async def ingest_job_events(job_id: str, request: Request):
+    """SSE-поток прогресса commit-all (поддерживает Last-Event-ID для переподключения)."""
+    from fastapi.responses import StreamingResponse
+    from backend.app.ingest.commit import get_job, sse_events
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job")
     try:
-        index_path.write_text(json.dumps(idx, ensure_ascii=False, indent=2))
-    except Exception as e:
-        errors.append({"index_write_error": str(e)})
+        start = int(request.headers.get("last-event-id", "-1")) + 1
+    except ValueError:
+        start = 0
+    return StreamingResponse(
+        sse_events(job, start),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 
-    return {"ok": True, "store": str(store.resolve()), "moved": moved, "duplicates": duplicates, "errors": errors}
+@app.delete('/ingest/jobs/{job_id}')
+async def ingest_job_cancel(job_id: str):
+    from backend.app.ingest.commit import get_job
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return {"ok": True, "cancelled": job.cancel(), "status": job.status}
 
 
 @app.delete('/ingest/clear')
@@ -802,17 +986,23 @@ async def ingest_preview(name: str):
         # PDF
         if ext == ".pdf":
             try:
-                from PyPDF2 import PdfReader
-                parts = []
-                with path.open("rb") as fh:
-                    reader = PdfReader(fh)
-                    pages = list(getattr(reader, "pages", []) or [])
-                    for page in pages[:5]:
-                        try:
-                            parts.append(page.extract_text() or "")
-                        except Exception:
-                            parts.append("")
-                text = "\n".join(parts).replace("\r", "").strip()
+                from backend.app.ingest import sidecar
+                from backend.app.ingest.pdf import extract_text as pdf_text, file_digest
+
+                def _preview_pdf() -> str:
+                    # sidecar-ы есть только у файлов из store, и там digest — это имя (без чтения файла);
+                    # для inbox хэш посчитает сам pdf_text — один раз
+                    digest = None
+                    if path.parent == store:
+                        digest = file_digest(path)
+                        hit = sidecar.load(digest, path.suffix.lower())
+                        if hit is not None:
+                            return sidecar.page_slice(hit[0], hit[1], 0, 5)[:limit + 1]
+                    # только первые страницы и только пока не набрали limit (+запас на strip)
+                    return pdf_text(path, max_pages=5, max_chars=limit + 1, digest=digest)
+
+                text = await asyncio.to_thread(_preview_pdf)  # хэш и PyMuPDF — не в event loop
+                text = text.replace("\r", "").strip()
                 note = ""
                 if len(text) > limit:
                     text, note = text[:limit] + "...[truncated]", f"truncated to {limit} chars"
@@ -824,9 +1014,8 @@ async def ingest_preview(name: str):
         # DOCX
         if ext == ".docx":
             try:
-                import docx
-                doc = docx.Document(str(path))
-                text = "\n".join(p.text for p in doc.paragraphs)
+                from backend.app.ingest.sidecar import get_text
+                text = get_text(path)
                 text = (text or "").replace("\r", "").strip()
                 note = ""
                 if len(text) > limit:
@@ -851,11 +1040,12 @@ def get_ingest_queue_partial(request: Request):
 
 @app.get("/ui/chat/stream", response_class=HTMLResponse)
 def get_chat_stream(request: Request):
-    from .main import _SESSIONS
-    if not _SESSIONS:
+    from backend.app.memory.messages import MESSAGES
+    latest = SESSIONS.list(limit=1)
+    if not latest:
         messages = []
     else:
-        messages = list(_SESSIONS.values())[-1].messages[-20:]
+        messages = MESSAGES.recent("dev", latest[0]["id"], 20)
     return templates.TemplateResponse("partials/chat_stream.html", {
         "request": request,
         "messages": messages
@@ -0,0 +1,89 @@
+# backend/app/memory/chroma_registry.py — один PersistentClient на каталог + общие настройки HNSW/кэша
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Dict, Optional
+
+import chromadb  # type: ignore
+from chromadb.config import Settings  # type: ignore
+
+# Единый каталог по умолчанию для всех коллекций (air4, longterm_v1, air4_summaries)
+CHROMA_DIR = os.getenv("AIR4_CHROMA_DIR", "./data/chroma")
+
+# Кэш сегментов: LRU с лимитом памяти (0 — без лимита, поведение Chroma по умолчанию)
+CHROMA_MEMORY_LIMIT_BYTES = int(os.getenv("AIR4_CHROMA_MEMORY_LIMIT_BYTES", "0"))
+CHROMA_ANON_TELEMETRY = os.getenv("AIR4_CHROMA_TELEMETRY", "0") == "1"
+
+# HNSW: пустое значение — не передаём, Chroma возьмёт свои дефолты
+_HNSW_ENV = {
+    "hnsw:M": "AIR4_CHROMA_HNSW_M",
+    "hnsw:construction_ef": "AIR4_CHROMA_HNSW_CONSTRUCTION_EF",
+    "hnsw:search_ef": "AIR4_CHROMA_HNSW_SEARCH_EF",
+}
+
+_CLIENTS: Dict[str, Any] = {}
+_LOCK = threading.Lock()
+
+
+def settings() -> Settings:
+    kw: Dict[str, Any] = {"allow_reset": False, "anonymized_telemetry": CHROMA_ANON_TELEMETRY}
+    if CHROMA_MEMORY_LIMIT_BYTES > 0:
+        kw["chroma_segment_cache_policy"] = "LRU"
+        kw["chroma_memory_limit_bytes"] = CHROMA_MEMORY_LIMIT_BYTES
+    return Settings(**kw)
+
+
+def hnsw_metadata(space: Optional[str] = "cosine") -> Dict[str, Any]:
+    md: Dict[str, Any] = {"hnsw:space": space} if space else {}
+    for key, env in _HNSW_ENV.items():
+        v = os.getenv(env, "")
+        if v:
+            md[key] = int(v)
+    return md
+
+
+def resolve_dir(legacy: str) -> str:
+    """
+    Каталог для менеджера, у которого раньше был свой путь по умолчанию (legacy).
+    Если в legacy уже есть данные, остаёмся на нём (и предупреждаем), иначе коллекции осиротели бы;
+    чтобы свести всё в один каталог — перенести данные и задать AIR4_CHROMA_DIR.
+    """
+    try:
+        has_data = os.path.isdir(legacy) and any(os.scandir(legacy))
+    except OSError:
+        has_data = False
+    if has_data and os.path.realpath(legacy) != os.path.realpath(CHROMA_DIR):
+        print(f"[WARN] chroma: using legacy directory {legacy} (has data); "
+              f"move it into {CHROMA_DIR} to share one client")
+        return legacy
+    return CHROMA_DIR
+
+
+def get_client(path: Optional[str] = None):
+    """Клиент на каталог: повторные вызовы (в т.ч. с другим написанием пути) отдают тот же объект."""
+    real = os.path.realpath(path or CHROMA_DIR)
+    with _LOCK:
+        cl = _CLIENTS.get(real)
+        if cl is None:
+            os.makedirs(real, exist_ok=True)
+            cl = chromadb.PersistentClient(path=real, settings=settings())
+            _CLIENTS[real] = cl
+        return cl
+
+
+def get_collection(name: str, path: Optional[str] = None, embedding_function: Any = None,
+                   space: Optional[str] = "cosine", metadata: Optional[Dict[str, Any]] = None):
+    """get_or_create_collection с общими HNSW-настройками (они применяются только при создании)."""
+    md = hnsw_metadata(space)
+    if metadata:
+        md.update(metadata)
+    kw: Dict[str, Any] = {"name": name, "metadata": md or None}
+    if embedding_function is not None:
+        kw["embedding_function"] = embedding_function
+    return get_client(path).get_or_create_collection(**kw)
+
+
+def open_paths() -> Dict[str, Any]:
+    with _LOCK:
+        return dict(_CLIENTS)
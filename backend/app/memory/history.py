@@ -0,0 +1,331 @@
+# backend/app/memory/history.py — история сессии: jsonl + индекс смещений строк (.idx), чтение хвоста за O(k)
+from __future__ import annotations
+
+import gzip
+import json
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# ---- optional deps ----
+_HAS_FCNTL = False
+try:
+    import fcntl  # нет на Windows — там блокировка только внутри процесса
+    _HAS_FCNTL = True
+except Exception:
+    pass
+
+# .idx — массив uint64 (little-endian): смещение начала каждой строки в .jsonl
+_OFF = struct.Struct("<Q")
+# .base — сколько строк уже ушло в archive/; seq записи = base + номер строки в живом файле,
+# поэтому курсоры (seq) клиентов переживают компакцию
+
+# фоновая компакция: AIR4_HISTORY_COMPACT_SEC=0 — выключена
+COMPACT_INTERVAL_SEC = float(os.getenv("AIR4_HISTORY_COMPACT_SEC", "0"))
+COMPACT_MAX_TURNS = int(os.getenv("AIR4_HISTORY_COMPACT_MAX_TURNS", "5000"))  # порог для компакции
+COMPACT_KEEP_TURNS = int(os.getenv("AIR4_HISTORY_COMPACT_KEEP_TURNS", "1000"))  # сколько остаётся в живом файле
+
+_TAIL_BLOCK = 64 * 1024
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(path: str) -> threading.Lock:
+    with _locks_guard:
+        lk = _locks.get(path)
+        if lk is None:
+            lk = _locks[path] = threading.Lock()
+        return lk
+
+
+@contextmanager
+def _locked(path: str):
+    """
+    Запись в .jsonl + .idx атомарна и между воркерами: поток — threading.Lock, процесс — flock.
+    Блокируем отдельный <file>.lock: .jsonl и .idx компакция подменяет через os.replace,
+    и flock на старом inode уже никого бы не останавливал.
+    """
+    with _lock(path):
+        if not _HAS_FCNTL:
+            yield
+            return
+        with open(path + ".lock", "ab") as lf:
+            fcntl.flock(lf.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+
+
+def _idx_path(path: str) -> str:
+    return path + ".idx"
+
+
+def _base_path(path: str) -> str:
+    return path + ".base"
+
+
+def first_seq(path: str) -> int:
+    """seq первой записи живого файла (0, пока компакции не было)."""
+    try:
+        with open(_base_path(path), "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def _write_base(path: str, value: int) -> None:
+    tmp = f"{_base_path(path)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(value))
+    os.replace(tmp, _base_path(path))
+
+
+def _archive_dir(path: str) -> str:
+    return os.path.join(os.path.dirname(path), "archive")
+
+
+# ---------------- index ----------------
+
+def _rebuild_index(path: str) -> None:
+    """Полный проход по файлу — только если .idx нет или он битый."""
+    offs = bytearray()
+    pos = 0
+    with open(path, "rb") as f:
+        for line in f:
+            offs += _OFF.pack(pos)
+            pos += len(line)
+    tmp = _idx_path(path) + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(offs)
+    os.replace(tmp, _idx_path(path))
+
+
+def _tail_offset(path: str, k: int, size: int) -> Optional[int]:
+    """Смещение k-й с конца строки по индексу; None — индекс непригоден."""
+    ip = _idx_path(path)
+    try:
+        isize = os.path.getsize(ip)
+    except OSError:
+        return None
+    n = isize // _OFF.size
+    if n == 0 or isize % _OFF.size:
+        return None
+    take = min(k, n)
+    with open(ip, "rb") as f:
+        f.seek((n - take) * _OFF.size)
+        first = _OFF.unpack(f.read(_OFF.size))[0]
+        f.seek((n - 1) * _OFF.size)
+        last = _OFF.unpack(f.read(_OFF.size))[0]
+    if last >= size or first > last:
+        return None  # файл урезали/переписали мимо индекса
+    return first
+
+
+# ---------------- read ----------------
+
+def _tail_scan(path: str, k: int, size: int) -> bytes:
+    """Без индекса: читаем блоками с конца, пока не наберём k переводов строки."""
+    with open(path, "rb") as f:
+        pos = size
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= k:
+            step = min(_TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    return buf
+
+
+def tail(path: str, k: int) -> List[Dict[str, Any]]:
+    """Последние k записей. С индексом — один seek; читается только хвост файла."""
+    if k <= 0 or not os.path.exists(path):
+        return []
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    off = _tail_offset(path, k, size)
+    if off is None:
+        try:
+            with _locked(path):
+                _rebuild_index(path)
+            off = _tail_offset(path, k, os.path.getsize(path))
+        except Exception as e:
+            print(f"[WARN] history index rebuild failed for {path}: {e}")
+    if off is None:
+        data = _tail_scan(path, k, size)
+    else:
+        with open(path, "rb") as f:
+            f.seek(off)
+            data = f.read()
+    rows: List[Dict[str, Any]] = []
+    # строки, дописанные после индекса (сбой между write и idx), тоже попадают в хвост — срезаем до k
+    for line in data.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except Exception:
+            continue  # первая строка при tail-scan может быть обрезана
+    return rows[-k:]
+
+
+def read_range(path: str, start: int, stop: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Записи с seq в [start, stop): два seek-а по индексу, читается только нужный кусок.
+    Ушедшее в архив не отдаётся — возвращает (seq первой отданной записи, записи).
+    """
+    if not os.path.exists(path):
+        return max(0, start), []
+    with _locked(path):  # base и .idx должны быть от одной и той же компакции
+        if not os.path.exists(_idx_path(path)):
+            _rebuild_index(path)
+        b0 = first_seq(path)
+        n = line_count(path)
+        start, stop = max(b0, start), min(stop, b0 + n)
+        if start >= stop:
+            return start, []
+        with open(_idx_path(path), "rb") as f:
+            f.seek((start - b0) * _OFF.size)
+            a = _OFF.unpack(f.read(_OFF.size))[0]
+            b = None
+            if stop - b0 < n:
+                f.seek((stop - b0) * _OFF.size)
+                b = _OFF.unpack(f.read(_OFF.size))[0]
+        with open(path, "rb") as f:
+            f.seek(a)
+            data = f.read() if b is None else f.read(b - a)
+    rows: List[Dict[str, Any]] = []
+    for line in data.split(b"\n"):
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except Exception:
+            continue
+    return start, rows[: stop - start]
+
+
+# ---------------- write ----------------
+
+def append(path: str, rec: Dict[str, Any]) -> int:
+    """Дописывает запись; возвращает её seq (base + номер строки в живом файле)."""
+    line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+    with _locked(path):
+        fresh = not os.path.exists(_idx_path(path)) and os.path.exists(path) and os.path.getsize(path) > 0
+        if fresh:
+            _rebuild_index(path)  # старый файл без индекса — один раз
+        with open(path, "ab") as f:
+            off = f.tell()
+            f.write(line)
+        with open(_idx_path(path), "ab") as f:
+            f.write(_OFF.pack(off))
+            return first_seq(path) + f.tell() // _OFF.size - 1
+
+
+# ---------------- compaction ----------------
+
+def line_count(path: str) -> int:
+    """Строк в живом файле (без ушедших в архив)."""
+    try:
+        return os.path.getsize(_idx_path(path)) // _OFF.size
+    except OSError:
+        return 0
+
+
+def next_seq(path: str) -> int:
+    """seq, который получит следующая запись."""
+    return first_seq(path) + line_count(path)
+
+
+def compact(path: str, keep: int = COMPACT_KEEP_TURNS) -> Optional[str]:
+    """
+    Переносит всё, кроме последних keep записей, в archive/<name>.<ts>.jsonl.gz.
+    Живой файл и индекс переписываются атомарно, base сдвигается на число ушедших строк.
+    Возвращает путь сегмента или None.
+    """
+    with _locked(path):
+        if not os.path.exists(path):
+            return None
+        if not os.path.exists(_idx_path(path)):
+            _rebuild_index(path)
+        n = line_count(path)
+        if n <= keep:
+            return None
+        with open(_idx_path(path), "rb") as f:
+            f.seek((n - keep) * _OFF.size)
+            cut = _OFF.unpack(f.read(_OFF.size))[0] if keep > 0 else os.path.getsize(path)
+
+        adir = _archive_dir(path)
+        os.makedirs(adir, exist_ok=True)
+        base = os.path.basename(path)[: -len(".jsonl")] if path.endswith(".jsonl") else os.path.basename(path)
+        seg = os.path.join(adir, f"{base}.{int(time.time() * 1000)}.jsonl.gz")
+        with open(path, "rb") as src:
+            with gzip.open(seg + ".tmp", "wb") as dst:
+                left = cut
+                while left > 0:
+                    chunk = src.read(min(_TAIL_BLOCK * 16, left))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    left -= len(chunk)
+            os.replace(seg + ".tmp", seg)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as dst:
+                for chunk in iter(lambda: src.read(_TAIL_BLOCK * 16), b""):
+                    dst.write(chunk)
+        os.replace(tmp, path)
+        _write_base(path, first_seq(path) + n - keep)
+        _rebuild_index(path)  # индекс живого файла теперь короткий — пересчёт дешёвый
+        return seg
+
+
+def compact_dir(history_dir: str, max_turns: int = COMPACT_MAX_TURNS, keep: int = COMPACT_KEEP_TURNS) -> List[str]:
+    out: List[str] = []
+    try:
+        names = [n for n in os.listdir(history_dir) if n.endswith(".jsonl")]
+    except OSError:
+        return out
+    for name in names:
+        p = os.path.join(history_dir, name)
+        try:
+            n = line_count(p) if os.path.exists(_idx_path(p)) else None
+            if n is None:
+                with _locked(p):
+                    _rebuild_index(p)
+                n = line_count(p)
+            if n > max_turns:
+                seg = compact(p, keep)
+                if seg:
+                    out.append(seg)
+        except Exception as e:
+            print(f"[WARN] history compaction failed for {p}: {e}")
+    return out
+
+
+_compactor: Optional[threading.Thread] = None
+_compactor_stop = threading.Event()
+
+
+def start_compactor(history_dir: str, interval: float = COMPACT_INTERVAL_SEC) -> bool:
+    """Фоновый поток компакции (daemon). interval<=0 — не запускаем."""
+    global _compactor
+    if interval <= 0 or (_compactor is not None and _compactor.is_alive()):
+        return False
+    _compactor_stop.clear()
+
+    def _loop() -> None:
+        while not _compactor_stop.wait(interval):
+            compact_dir(history_dir)
+
+    _compactor = threading.Thread(target=_loop, name="history-compactor", daemon=True)
+    _compactor.start()
+    return True
+
+
+def stop_compactor() -> None:
+    _compactor_stop.set()
@@ -1,42 +1,72 @@
 # backend/app/memory/manager.py
 from __future__ import annotations
-import os, json, hashlib, time
+import os, json, hashlib, time, threading
 from typing import List, Dict, Any, Optional
 
+from .sqlite_store import MemoryDB
+from . import history as _history
+
 # Принцип: истории хранятся как раньше.
-# Саммари/факты/туду — простым JSON + легкий дедуп. Если у тебя Chroma — оставь как есть и используй эти методы как фасад.
+# Саммари — простым JSON; факты/туду/rag_docs — SQLite (WAL) с UNIQUE(hash) и индексами. Если у тебя Chroma — оставь как есть и используй эти методы как фасад.
 
 _STORAGE = os.getenv("STORAGE_DIR", "storage")
 _SUM_DIR = os.path.join(_STORAGE, "summaries")
 _FACTS_FILE = os.path.join(_STORAGE, "facts.jsonl")
 _TODOS_FILE = os.path.join(_STORAGE, "todos.jsonl")
+_RAG_FILE = os.path.join(_STORAGE, "rag_docs.jsonl")
 _HISTORY_DIR = os.path.join(_STORAGE, "history")
+_DB_FILE = os.getenv("AIR4_MEMORY_DB", os.path.join(_STORAGE, "memory.sqlite3"))
 
 os.makedirs(_SUM_DIR, exist_ok=True)
 os.makedirs(_HISTORY_DIR, exist_ok=True)
 os.makedirs(_STORAGE, exist_ok=True)
 
+def start_history_compactor() -> bool:
+    """Компакция старых ходов в archive/ — только если задан AIR4_HISTORY_COMPACT_SEC. Зовётся из startup приложения."""
+    return _history.start_compactor(_HISTORY_DIR)
+
+def stop_history_compactor() -> None:
+    _history.stop_compactor()
+
 def _sid_file(session_id: str, user_id: str) -> str:
     return os.path.join(_SUM_DIR, f"{user_id}__{session_id}.json")
 
 def _hash(s: str) -> str:
     return hashlib.sha256(s.encode("utf-8")).hexdigest()[:16]
 
+_DB: Optional[MemoryDB] = None
+_DB_LOCK = threading.Lock()
+
+def _db() -> MemoryDB:
+    """Ленивая инициализация SQLite; старые facts/todos/rag_docs.jsonl импортируются один раз."""
+    global _DB
+    if _DB is None:
+        with _DB_LOCK:
+            if _DB is None:
+                db = MemoryDB(_DB_FILE)
+                for table, path in (("facts", _FACTS_FILE), ("todos", _TODOS_FILE), ("rag_docs", _RAG_FILE)):
+                    try:
+                        n = db.import_jsonl(table, path)
+                        if n:
+                            print(f"[INFO] memory: imported {n} rows from {path}")
+                    except Exception as e:
+                        print(f"[WARN] memory: import {path} failed: {e}")
+                _DB = db
+    return _DB
+
 class MemoryManager:
     # ==== История ====
     def fetch_history(self, user_id: str, session_id: Optional[str], k: int = 20) -> List[Dict[str, str]]:
         if not session_id: return []
         path = os.path.join(_HISTORY_DIR, f"{user_id}__{session_id}.jsonl")
-        if not os.path.exists(path): return []
-        lines = open(path, "r", encoding="utf-8").read().splitlines()
-        rows = [json.loads(x) for x in lines[-k:]]
+        # хвост по индексу смещений — O(k), а не весь файл
+        rows = _history.tail(path, k)
         return [{"role": r["role"], "content": r["content"]} for r in rows]
 
     def append_turn(self, user_id: str, session_id: Optional[str], role: str, content: str) -> None:
         if not session_id: return
         path = os.path.join(_HISTORY_DIR, f"{user_id}__{session_id}.jsonl")
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps({"ts": time.time(), "role": role, "content": content}, ensure_ascii=False) + "\n")
+        _history.append(path, {"ts": time.time(), "role": role, "content": content})
 
     # ==== Summary ====
     def save_summary(self, user_id: str, session_id: str, summary: Dict[str, Any]) -> None:
@@ -52,109 +82,40 @@ class MemoryManager:
         except Exception:
             return None
 
-    # ==== Facts / TODOs с дедупом по хэшу текста ====
-    def _dedup_append(self, path: str, payload: Dict[str, Any], key_text: str) -> None:
-        line_hash = _hash(key_text)
-        payload["hash"] = line_hash
-        payload["ts"] = time.time()
-        payload["text"] = key_text
-        # простейший дедуп: проверяем есть ли такой хэш в файле
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        if json.loads(line).get("hash") == line_hash:
-                            return
-                    except Exception:
-                        continue
-        with open(path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+    # ==== Facts / TODOs с дедупом по хэшу текста (SQLite, UNIQUE(hash)) ====
+    def _dedup_append(self, table: str, payload: Dict[str, Any], key_text: str) -> bool:
+        """INSERT OR IGNORE по хэшу текста — дедуп через индекс, без скана файла."""
+        h = _hash(key_text)
+        db = _db()
+        if table == "todos":
+            return db.insert_todo(h, payload.get("user_id"), payload.get("session_id"), key_text,
+                                  payload.get("tags") or [], time.time(), bool(payload.get("done")))
+        return db.insert_fact(h, payload.get("user_id"), payload.get("session_id"), key_text,
+                              payload.get("tags") or [], time.time())
 
     def add_facts(self, user_id: str, session_id: str, facts: List[str], tags: List[str], dedup: bool = True) -> None:
         for fact in facts:
-            self._dedup_append(_FACTS_FILE, {
+            self._dedup_append("facts", {
                 "user_id": user_id, "session_id": session_id, "tags": tags or []
             }, fact.strip())
 
     def add_todos(self, user_id: str, session_id: str, todos: List[str], tags: List[str], dedup: bool = True) -> None:
         for todo in todos:
-            self._dedup_append(_TODOS_FILE, {
+            self._dedup_append("todos", {
                 "user_id": user_id, "session_id": session_id, "done": False, "tags": tags or []
             }, todo.strip())
     # ==== TODOs: list/toggle/delete ====
     def list_todos(self, user_id: Optional[str] = None, session_id: Optional[str] = None,
                    done: Optional[bool] = None, limit: int = 200) -> List[Dict[str, Any]]:
-        rows: List[Dict[str, Any]] = []
-        if not os.path.exists(_TODOS_FILE):
-            return rows
-        with open(_TODOS_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                if user_id and obj.get("user_id") != user_id:
-                    continue
-                if session_id and obj.get("session_id") != session_id:
-                    continue
-                if done is not None and bool(obj.get("done")) != done:
-                    continue
-                rows.append(obj)
-        # свежие последними — отсортируем по времени
-        rows.sort(key=lambda x: x.get("ts", 0), reverse=True)
-        return rows[:limit]
-
-    def _rewrite_jsonl_without_hash(self, path: str, h: str) -> None:
-        if not os.path.exists(path):
-            return
-        tmp = path + ".tmp"
-        with open(path, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
-            for line in src:
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                if obj.get("hash") == h:
-                    continue
-                dst.write(json.dumps(obj, ensure_ascii=False) + "\n")
-        os.replace(tmp, path)
+        # свежие первыми; фильтры и LIMIT — по индексам (user_id|session_id, done, ts)
+        return _db().list_todos(user_id, session_id, done, limit)
 
     def set_todo_done(self, h: str, done: bool = True) -> bool:
         """Помечает одну задачу по hash. Возвращает True если найдено/изменено."""
-        if not os.path.exists(_TODOS_FILE):
-            return False
-        changed = False
-        tmp = _TODOS_FILE + ".tmp"
-        with open(_TODOS_FILE, "r", encoding="utf-8") as src, open(tmp, "w", encoding="utf-8") as dst:
-            for line in src:
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                if obj.get("hash") == h:
-                    obj["done"] = bool(done)
-                    changed = True
-                dst.write(json.dumps(obj, ensure_ascii=False) + "\n")
-        os.replace(tmp, _TODOS_FILE)
-        return changed
+        return _db().set_todo_done(h, bool(done))
 
     def delete_todo(self, h: str) -> bool:
-        if not os.path.exists(_TODOS_FILE):
-            return False
-        # проверим, что существовало
-        existed = False
-        with open(_TODOS_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    if json.loads(line).get("hash") == h:
-                        existed = True
-                        break
-                except Exception:
-                    continue
-        if not existed:
-            return False
-        self._rewrite_jsonl_without_hash(_TODOS_FILE, h)
-        return True
+        return _db().delete_todo(h)
     # ==== Ingest storage / RAG stub ====
     def save_ingest_raw(self, user_id: str, doc_id: str, text: str, meta: Dict[str, Any]) -> None:
         ingest_dir = os.path.join(_STORAGE, "ingest")
@@ -168,29 +129,13 @@ class MemoryManager:
 
     def add_rag_document(self, user_id: str, doc_id: str, text: str, meta: Dict[str, Any]) -> None:
         """
-        Задел под индексацию в RAG. Сейчас просто пишем в jsonl.
+        Задел под индексацию в RAG. Сейчас просто пишем в таблицу rag_docs.
         Позже можно заменить на добавление в Chroma.
         """
-        rag_file = os.path.join(_STORAGE, "rag_docs.jsonl")
-        rec = {"user_id": user_id, "doc_id": doc_id, "meta": meta, "text": text[:5000], "ts": time.time()}
-        with open(rag_file, "a", encoding="utf-8") as f:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        _db().add_rag_doc(user_id, doc_id, meta, text[:5000], time.time())
+
     def get_recent_ingest(self, user_id: str, limit: int = 3) -> List[Dict[str, Any]]:
-        rag_file = os.path.join(_STORAGE, "rag_docs.jsonl")
-        rows: List[Dict[str, Any]] = []
-        if not os.path.exists(rag_file):
-            return rows
-        with open(rag_file, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                if obj.get("user_id") != user_id:
-                    continue
-                rows.append(obj)
-        rows.sort(key=lambda x: x.get("ts", 0), reverse=True)
-        return rows[:limit]
+        return _db().recent_rag_docs(user_id, limit)
 memory = MemoryManager()
 memory = MemoryManager()
 memory = MemoryManager()
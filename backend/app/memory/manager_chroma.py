@@ -1,10 +1,10 @@
 # backend/app/memory/manager_chroma.py
 from __future__ import annotations
 from typing import List, Dict, Any, Optional
-import os, time, uuid
-import chromadb  # type: ignore
+import time, uuid
 from chromadb.utils import embedding_functions  # type: ignore
 
+from . import chroma_registry
 from .chunker import chunk_text
 from .embeddings_st import LocalSentenceTransformer
 
@@ -19,15 +19,11 @@ class _EF(embedding_functions.EmbeddingFunction):
 
 class ChromaMemoryManager:
     def __init__(self, persist_dir: str, collection: str, model_path: str) -> None:
-        os.makedirs(persist_dir, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=persist_dir)
+        # клиент общий на каталог (реестр), HNSW/кэш — из chroma_registry
+        self.client = chroma_registry.get_client(persist_dir)
         self.st = LocalSentenceTransformer(model_path)
         self.ef = _EF(self.st)
-        self.col = self.client.get_or_create_collection(
-            name=collection,
-            embedding_function=self.ef,
-            metadata={"hnsw:space": "cosine"},
-        )
+        self.col = chroma_registry.get_collection(collection, persist_dir, embedding_function=self.ef)
         self.collection = self.col  # совместимость с legacy-кодом
 
     # -------------------------
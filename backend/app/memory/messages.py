@@ -0,0 +1,136 @@
+# backend/app/memory/messages.py — сообщения сессии: последние N в памяти (кольцо), старые — страницами из history/*.jsonl
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional
+
+from . import history as _history
+
+_HISTORY_DIR = os.path.join(os.getenv("STORAGE_DIR", "storage"), "history")
+
+RING_SIZE = int(os.getenv("AIR4_MSG_RING_SIZE", "200"))          # сообщений на сессию в памяти
+RING_SESSIONS = int(os.getenv("AIR4_MSG_RING_SESSIONS", "256"))  # сколько сессий держим горячими
+PAGE_SIZE = int(os.getenv("AIR4_MSG_PAGE_SIZE", "50"))
+
+
+class Message:
+    """Компактная запись (без __dict__): seq — сквозной номер в сессии, компакция history его не сдвигает."""
+    __slots__ = ("seq", "ts", "role", "text")
+
+    def __init__(self, seq: int, ts: float, role: str, text: str):
+        self.seq = seq
+        self.ts = ts
+        self.role = role
+        self.text = text
+
+    # имена, которые ждут шаблоны
+    @property
+    def content(self) -> str:
+        return self.text
+
+    @property
+    def time(self) -> str:
+        return time.strftime("%H:%M", time.localtime(self.ts)) if self.ts else ""
+
+    def to_dict(self) -> dict:
+        return {"seq": self.seq, "ts": self.ts, "role": self.role, "content": self.text}
+
+
+class _Ring:
+    __slots__ = ("items", "next_seq")
+
+    def __init__(self, size: int):
+        self.items: Deque[Message] = deque(maxlen=size)
+        self.next_seq = 0  # seq следующего сообщения == history.next_seq(файла)
+
+
+class MessageStore:
+    """
+    Память ограничена: RING_SIZE сообщений × RING_SESSIONS сессий (LRU по сессиям).
+    Источник правды — history/<user>__<session>.jsonl (+ .idx), его же дописывает MemoryManager.append_turn.
+    """
+
+    def __init__(self, history_dir: str = _HISTORY_DIR, ring_size: int = RING_SIZE, max_sessions: int = RING_SESSIONS):
+        self.history_dir = history_dir
+        self.ring_size = ring_size
+        self.max_sessions = max_sessions
+        self._rings: "OrderedDict[str, _Ring]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(history_dir, exist_ok=True)
+
+    def _path(self, user_id: str, session_id: str) -> str:
+        return os.path.join(self.history_dir, f"{user_id}__{session_id}.jsonl")
+
+    @staticmethod
+    def _rows_to_messages(rows: List[dict], first_seq: int) -> List[Message]:
+        return [Message(first_seq + i, float(r.get("ts") or 0), r.get("role", ""), r.get("content", ""))
+                for i, r in enumerate(rows)]
+
+    def _ring(self, user_id: str, session_id: str) -> _Ring:
+        """Кольцо сессии; если файл дописал другой воркер (или кольца нет) — перечитываем хвост."""
+        key = f"{user_id}__{session_id}"
+        path = self._path(user_id, session_id)
+        n = _history.line_count(path) if os.path.exists(path) else 0
+        if n == 0 and os.path.exists(path) and os.path.getsize(path) > 0:
+            _history.tail(path, 1)  # старый файл без .idx — индекс строится один раз
+        n = _history.next_seq(path) if os.path.exists(path) else 0
+        with self._lock:
+            ring = self._rings.get(key)
+            if ring is not None and ring.next_seq == n:
+                self._rings.move_to_end(key)
+                return ring
+        ring = _Ring(self.ring_size)
+        start, rows = _history.read_range(path, n - self.ring_size, n)
+        ring.items.extend(self._rows_to_messages(rows, start))
+        ring.next_seq = n
+        with self._lock:
+            self._rings[key] = ring
+            self._rings.move_to_end(key)
+            while len(self._rings) > self.max_sessions:
+                self._rings.popitem(last=False)
+        return ring
+
+    def append(self, user_id: str, session_id: str, role: str, text: str) -> Message:
+        ring = self._ring(user_id, session_id)
+        ts = time.time()
+        seq = _history.append(self._path(user_id, session_id), {"ts": ts, "role": role, "content": text})
+        msg = Message(seq, ts, role, text)
+        with self._lock:
+            if seq == ring.next_seq:
+                ring.items.append(msg)
+                ring.next_seq = seq + 1
+            else:
+                ring.next_seq = -1  # параллельная запись мимо кольца — при следующем чтении перечитаем
+        return msg
+
+    def recent(self, user_id: str, session_id: str, limit: int = PAGE_SIZE) -> List[Message]:
+        ring = self._ring(user_id, session_id)
+        with self._lock:
+            items = list(ring.items)
+        return items[-limit:] if limit > 0 else []
+
+    def page(self, user_id: str, session_id: str, before: Optional[int] = None,
+             limit: int = PAGE_SIZE) -> List[Message]:
+        """Сообщения с seq < before (по возрастанию). Что есть в кольце — из памяти, остальное — с диска."""
+        if before is None:
+            return self.recent(user_id, session_id, limit)
+        start = max(0, before - limit)
+        if start >= before:
+            return []
+        ring = self._ring(user_id, session_id)
+        with self._lock:
+            first = ring.items[0].seq if ring.items else ring.next_seq
+            if start >= first:
+                return [m for m in ring.items if start <= m.seq < before]
+        start, rows = _history.read_range(self._path(user_id, session_id), start, before)
+        return self._rows_to_messages(rows, start)
+
+    def first_seq(self, user_id: str, session_id: str) -> int:
+        """seq самого старого сообщения, доступного постранично (более ранние ушли в archive/)."""
+        return _history.first_seq(self._path(user_id, session_id))
+
+
+MESSAGES = MessageStore()
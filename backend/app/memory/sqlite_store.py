@@ -0,0 +1,192 @@
+# backend/app/memory/sqlite_store.py — факты / TODO / rag_docs в SQLite (WAL) с индексами
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Соединение в режиме WAL: читатели не блокируют писателя, fsync реже (synchronous=NORMAL)."""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10.0, isolation_level=None)  # autocommit; транзакции — явно
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS facts (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    user_id TEXT,
+    session_id TEXT,
+    text TEXT NOT NULL,
+    tags TEXT NOT NULL DEFAULT '[]',
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_facts_user_ts ON facts(user_id, ts);
+CREATE INDEX IF NOT EXISTS idx_facts_session_ts ON facts(session_id, ts);
+
+CREATE TABLE IF NOT EXISTS todos (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    user_id TEXT,
+    session_id TEXT,
+    text TEXT NOT NULL,
+    tags TEXT NOT NULL DEFAULT '[]',
+    done INTEGER NOT NULL DEFAULT 0,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_todos_ts ON todos(ts);
+CREATE INDEX IF NOT EXISTS idx_todos_user_done_ts ON todos(user_id, done, ts);
+CREATE INDEX IF NOT EXISTS idx_todos_session_done_ts ON todos(session_id, done, ts);
+CREATE INDEX IF NOT EXISTS idx_todos_done_ts ON todos(done, ts);
+
+CREATE TABLE IF NOT EXISTS rag_docs (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT,
+    doc_id TEXT,
+    meta TEXT NOT NULL DEFAULT '{}',
+    text TEXT NOT NULL,
+    ts REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rag_docs_user_ts ON rag_docs(user_id, ts);
+
+CREATE TABLE IF NOT EXISTS kv (
+    k TEXT PRIMARY KEY,
+    v TEXT
+);
+"""
+
+
+class MemoryDB:
+    """
+    Одно SQLite-хранилище на процесс (соединение на поток).
+    insert-if-absent = INSERT OR IGNORE по UNIQUE(hash) — O(log n) вместо скана jsonl.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.conn.executescript(_SCHEMA)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = connect(self.path)
+            self._local.conn = c
+        return c
+
+    # ---- kv (флаги миграций и т.п.) ----
+    def kv_get(self, k: str) -> Optional[str]:
+        row = self.conn.execute("SELECT v FROM kv WHERE k=?", (k,)).fetchone()
+        return row["v"] if row else None
+
+    def kv_set(self, k: str, v: str) -> None:
+        self.conn.execute("INSERT OR REPLACE INTO kv(k, v) VALUES (?, ?)", (k, v))
+
+    # ---- facts / todos ----
+    def insert_fact(self, h: str, user_id: str, session_id: str, text: str, tags: List[str], ts: float) -> bool:
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO facts(hash, user_id, session_id, text, tags, ts) VALUES (?,?,?,?,?,?)",
+            (h, user_id, session_id, text, json.dumps(tags or [], ensure_ascii=False), ts),
+        )
+        return cur.rowcount > 0
+
+    def insert_todo(self, h: str, user_id: str, session_id: str, text: str, tags: List[str], ts: float,
+                    done: bool = False) -> bool:
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO todos(hash, user_id, session_id, text, tags, done, ts) VALUES (?,?,?,?,?,?,?)",
+            (h, user_id, session_id, text, json.dumps(tags or [], ensure_ascii=False), 1 if done else 0, ts),
+        )
+        return cur.rowcount > 0
+
+    def list_todos(self, user_id: Optional[str], session_id: Optional[str], done: Optional[bool],
+                   limit: int) -> List[Dict[str, Any]]:
+        where, args = [], []
+        if user_id:
+            where.append("user_id=?"); args.append(user_id)
+        if session_id:
+            where.append("session_id=?"); args.append(session_id)
+        if done is not None:
+            where.append("done=?"); args.append(1 if done else 0)
+        sql = "SELECT hash, user_id, session_id, text, tags, done, ts FROM todos"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC LIMIT ?"
+        args.append(int(limit))
+        out = []
+        for r in self.conn.execute(sql, args):
+            out.append({
+                "user_id": r["user_id"], "session_id": r["session_id"], "done": bool(r["done"]),
+                "tags": json.loads(r["tags"] or "[]"), "hash": r["hash"], "ts": r["ts"], "text": r["text"],
+            })
+        return out
+
+    def set_todo_done(self, h: str, done: bool) -> bool:
+        cur = self.conn.execute("UPDATE todos SET done=? WHERE hash=?", (1 if done else 0, h))
+        return cur.rowcount > 0
+
+    def delete_todo(self, h: str) -> bool:
+        cur = self.conn.execute("DELETE FROM todos WHERE hash=?", (h,))
+        return cur.rowcount > 0
+
+    # ---- rag_docs ----
+    def add_rag_doc(self, user_id: str, doc_id: str, meta: Dict[str, Any], text: str, ts: float) -> None:
+        self.conn.execute(
+            "INSERT INTO rag_docs(user_id, doc_id, meta, text, ts) VALUES (?,?,?,?,?)",
+            (user_id, doc_id, json.dumps(meta or {}, ensure_ascii=False), text, ts),
+        )
+
+    def recent_rag_docs(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT user_id, doc_id, meta, text, ts FROM rag_docs WHERE user_id=? ORDER BY ts DESC LIMIT ?",
+            (user_id, int(limit)),
+        )
+        return [{"user_id": r["user_id"], "doc_id": r["doc_id"], "meta": json.loads(r["meta"] or "{}"),
+                 "text": r["text"], "ts": r["ts"]} for r in rows]
+
+    # ---- миграция старых jsonl ----
+    def import_jsonl(self, table: str, path: str) -> int:
+        """Однократный импорт facts.jsonl / todos.jsonl / rag_docs.jsonl; файл переименовывается в *.migrated."""
+        flag = f"migrated:{table}"
+        if self.kv_get(flag) or not os.path.exists(path):
+            return 0
+        n = 0
+        c = self.conn
+        c.execute("BEGIN")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        o = json.loads(line)
+                    except Exception:
+                        continue
+                    if table == "facts" and o.get("hash"):
+                        n += self.insert_fact(o["hash"], o.get("user_id"), o.get("session_id"), o.get("text", ""),
+                                              o.get("tags") or [], float(o.get("ts") or 0))
+                    elif table == "todos" and o.get("hash"):
+                        n += self.insert_todo(o["hash"], o.get("user_id"), o.get("session_id"), o.get("text", ""),
+                                              o.get("tags") or [], float(o.get("ts") or 0), bool(o.get("done")))
+                    elif table == "rag_docs":
+                        self.add_rag_doc(o.get("user_id"), o.get("doc_id"), o.get("meta") or {}, o.get("text", ""),
+                                         float(o.get("ts") or 0))
+                        n += 1
+            self.kv_set(flag, "1")
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        try:
+            os.replace(path, path + ".migrated")
+        except Exception:
+            pass
+        return n
@@ -1,7 +1,7 @@
 # backend/app/memory/summarizer.py
 from __future__ import annotations
-from typing import Callable, Dict, Any, List, Optional
-import re, json, time
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import asyncio, os, re, json, time
 from .manager import MemoryManager
 
 _SUMMARY_PROMPT = """You are a concise analyst.
@@ -19,6 +19,21 @@ Assistant: {assistant_msg}
 Prior summary (may be empty JSON): {prior_summary}
 """
 
+_BATCH_SUMMARY_PROMPT = """You are a concise analyst.
+Given the latest turns of a session (user turns and assistant replies, oldest first), produce a compact delta rollup.
+
+Return strict JSON with keys:
+- "tldr": 1-3 short bullets (string with '•' bullets allowed)
+- "facts": list of atomic facts worth remembering (<=6 items, short, timeless)
+- "todos": list of actionable TODOs for the user (<=5)
+- "entities": list of important names/IDs (<=6)
+
+Avoid duplication with prior summary (if provided). If nothing new is worth keeping, return empty values.
+Turns:
+{turns}
+Prior summary (may be empty JSON): {prior_summary}
+"""
+
 _ROLLUP_PROMPT = """You will merge a prior JSON summary with a delta JSON summary.
 Deduplicate, keep it short, keep only durable facts/TODOs.
 Return strict JSON with the same keys: tldr, facts, todos, entities.
@@ -27,6 +42,20 @@ Prior: {prior}
 Delta: {delta}
 """
 
+_SUMMARY_KEYS = ("tldr", "facts", "todos", "entities")
+
+# фоновый воркер: сводка раз в N ходов или после T секунд тишины в сессии
+SUMMARY_WORKER = os.getenv("AIR4_SUMMARY_WORKER", "0") == "1"
+SUMMARY_EVERY_TURNS = int(os.getenv("AIR4_SUMMARY_EVERY_TURNS", "4"))
+SUMMARY_IDLE_SEC = float(os.getenv("AIR4_SUMMARY_IDLE_SEC", "30"))
+SUMMARY_MAX_BATCH = int(os.getenv("AIR4_SUMMARY_MAX_BATCH", "12"))   # ходов в одном delta-промпте
+SUMMARY_TURN_CHARS = int(os.getenv("AIR4_SUMMARY_TURN_CHARS", "1500"))  # обрезка каждой реплики
+
+
+def _is_empty(summary: Dict[str, Any]) -> bool:
+    return not any(summary.get(k) for k in _SUMMARY_KEYS)
+
+
 class Summarizer:
     def __init__(self, llm_fn: Callable[..., Any]):
         """
@@ -35,8 +64,10 @@ class Summarizer:
         """
         self.llm_fn = llm_fn
         self.memory = MemoryManager()
+        self.llm_calls = 0
 
     async def _ask(self, prompt: str) -> str:
+        self.llm_calls += 1
         resp = await self.llm_fn(prompt, history=None, system=None, model=None, stream=False)
         return resp.get("text") if isinstance(resp, dict) else str(resp)
 
@@ -51,32 +82,149 @@ class Summarizer:
 
     async def summarize_and_store(self, user_id: str, session_id: Optional[str],
                                   user_msg: str, assistant_msg: str) -> None:
-        if not session_id:
+        await self.summarize_turns(user_id, session_id, [(user_msg, assistant_msg)])
+
+    async def summarize_turns(self, user_id: str, session_id: Optional[str],
+                              turns: List[Tuple[str, str]]) -> Optional[Dict[str, Any]]:
+        """
+        Один delta-промпт на пачку ходов. Merge-вызов — только если есть прежняя сводка
+        и delta не пустая; иначе 1 LLM-вызов (или 0 — если и ходов нет).
+        """
+        if not session_id or not turns:
             # если нет session_id — не сохраняем сводку (безопасный выход)
-            return
+            return None
         prior = self.memory.get_summary(user_id=user_id, session_id=session_id) or {}
-        prompt = _SUMMARY_PROMPT.format(
-            user_msg=user_msg.strip(), assistant_msg=assistant_msg.strip(),
-            prior_summary=json.dumps(prior, ensure_ascii=False)
-        )
+        lines: List[str] = []
+        for i, (u, a) in enumerate(turns, 1):
+            lines.append(f"[{i}] User: {(u or '').strip()[:SUMMARY_TURN_CHARS]}")
+            lines.append(f"[{i}] Assistant: {(a or '').strip()[:SUMMARY_TURN_CHARS]}")
+        if len(turns) == 1:
+            prompt = _SUMMARY_PROMPT.format(
+                user_msg=turns[0][0].strip(), assistant_msg=turns[0][1].strip(),
+                prior_summary=json.dumps(prior, ensure_ascii=False)
+            )
+        else:
+            prompt = _BATCH_SUMMARY_PROMPT.format(
+                turns="\n".join(lines), prior_summary=json.dumps(prior, ensure_ascii=False)
+            )
         delta_json = self._safe_json(await self._ask(prompt))
 
+        if _is_empty(delta_json):
+            # нечего добавить — ни merge, ни перезаписи сводки
+            return prior or None
         if prior:
             merge_prompt = _ROLLUP_PROMPT.format(
                 prior=json.dumps(prior, ensure_ascii=False),
                 delta=json.dumps(delta_json, ensure_ascii=False),
             )
             merged = self._safe_json(await self._ask(merge_prompt))
+            if _is_empty(merged):
+                merged = prior  # merge не распарсился — не теряем старую сводку
         else:
             merged = delta_json
 
         # Сохраняем сводку
         self.memory.save_summary(user_id=user_id, session_id=session_id, summary=merged)
 
-        # Пишем факты/дела в память с дедупом
-        facts = merged.get("facts") or []
-        todos = merged.get("todos") or []
+        # Пишем факты/дела из delta (старые уже лежат; дедуп — по UNIQUE(hash))
+        facts = delta_json.get("facts") or []
+        todos = delta_json.get("todos") or []
         if facts:
             self.memory.add_facts(user_id=user_id, session_id=session_id, facts=facts, tags=["summary"], dedup=True)
         if todos:
             self.memory.add_todos(user_id=user_id, session_id=session_id, todos=todos, tags=["summary"], dedup=True)
+        return merged
+
+
+class SummaryWorker:
+    """
+    Дебаунс по сессии: ходы копятся, сводка — когда набралось every_turns
+    или сессия молчит idle_sec. Работает в event loop; LLM-вызовы — вне запроса.
+    """
+
+    def __init__(self, summarizer: Summarizer, every_turns: int = SUMMARY_EVERY_TURNS,
+                 idle_sec: float = SUMMARY_IDLE_SEC, max_batch: int = SUMMARY_MAX_BATCH):
+        self.summarizer = summarizer
+        self.every_turns = max(1, every_turns)
+        self.idle_sec = idle_sec
+        self.max_batch = max(1, max_batch)
+        self.turns = 0
+        self.batches = 0
+        self._pending: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        self._timers: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._tasks: set = set()
+
+    def enqueue(self, user_id: str, session_id: Optional[str], user_msg: str, assistant_msg: str) -> None:
+        if not session_id:
+            return
+        key = (user_id, session_id)
+        self._pending.setdefault(key, []).append((user_msg, assistant_msg))
+        self.turns += 1
+        t = self._timers.pop(key, None)
+        if t is not None:
+            t.cancel()
+        if len(self._pending[key]) >= self.every_turns:
+            self._spawn(key)
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.idle_sec, self._spawn, key)
+
+    def _spawn(self, key: Tuple[str, str]) -> None:
+        self._timers.pop(key, None)
+        task = asyncio.get_running_loop().create_task(self._flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, key: Tuple[str, str]) -> None:
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:  # сводки одной сессии — строго по очереди (prior -> merged)
+            turns = self._pending.pop(key, [])
+            for i in range(0, len(turns), self.max_batch):
+                try:
+                    await self.summarizer.summarize_turns(key[0], key[1], turns[i:i + self.max_batch])
+                    self.batches += 1
+                except Exception as e:
+                    print(f"[WARN] summary worker failed for {key[1]}: {e}")
+        if key not in self._pending:
+            self._locks.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.summarizer.llm_calls
+        return {
+            "turns": self.turns,
+            "batches": self.batches,
+            "llm_calls": calls,
+            "llm_calls_per_turn": round(calls / self.turns, 3) if self.turns else 0.0,
+            "pending_sessions": len(self._pending),
+        }
+
+    async def close(self) -> None:
+        """Досводить всё накопленное (shutdown)."""
+        for t in self._timers.values():
+            t.cancel()
+        self._timers.clear()
+        for key in list(self._pending):
+            self._spawn(key)
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+
+_WORKER: Optional[SummaryWorker] = None
+
+
+def start_worker(llm_fn: Callable[..., Any]) -> SummaryWorker:
+    global _WORKER
+    if _WORKER is None:
+        _WORKER = SummaryWorker(Summarizer(llm_fn))
+    return _WORKER
+
+
+def get_worker() -> Optional[SummaryWorker]:
+    return _WORKER
+
+
+async def stop_worker() -> None:
+    global _WORKER
+    if _WORKER is not None:
+        await _WORKER.close()
+        _WORKER = None
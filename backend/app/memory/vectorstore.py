@@ -1,16 +1,16 @@
 import os
 from typing import List, Dict, Any
-import chromadb
-from chromadb.config import Settings
 
-CHROMA_DIR = os.getenv("CHROMA_DIR", os.path.join(os.getcwd(), "storage", "chroma"))
+from . import chroma_registry
+
+# CHROMA_DIR (.env) — как раньше; без него — общий каталог реестра, если в старом storage/chroma нет данных
+CHROMA_DIR = os.getenv("CHROMA_DIR") or chroma_registry.resolve_dir(os.path.join(os.getcwd(), "storage", "chroma"))
 COLLECTION = os.getenv("CHROMA_COLLECTION", "longterm_v1")
 
 class VectorStore:
     def __init__(self):
-        os.makedirs(CHROMA_DIR, exist_ok=True)
-        self.client = chromadb.PersistentClient(path=CHROMA_DIR, settings=Settings(allow_reset=False))
-        self.col = self.client.get_or_create_collection(COLLECTION, metadata={"hnsw:space": "cosine"})
+        self.client = chroma_registry.get_client(CHROMA_DIR)
+        self.col = chroma_registry.get_collection(COLLECTION, CHROMA_DIR)
 
     def add(self, ids: List[str], texts: List[str], embeddings: List[List[float]], meta: List[Dict[str, Any]]):
         self.col.add(ids=ids, documents=texts, embeddings=embeddings, metadatas=meta)
@@ -4,7 +4,7 @@ from __future__ import annotations
 import os
 import tempfile
 import time
-from typing import Optional, Any
+from typing import Optional, Any, List
 
 from fastapi import APIRouter, UploadFile, File, Request
 from pydantic import BaseModel
@@ -60,23 +60,50 @@ class URLIn(BaseModel):
 
 @router.post("/url")
 async def ingest_url(request: Request, body: URLIn, tag: Optional[str] = "phase10"):
+    """Сразу качает URL (conditional GET), извлекает текст по content-type и индексирует чанками."""
+    from backend.app.ingest.urls import ingest_url_now
+
     mgr = _get_manager(request)
-    # простая заглушка: сохраняем URL как документ
-    text = f"URL: {body.url}"
-    meta = {
-        "tag": tag or "phase10",
-        "kind": "url",
-        "ts": int(time.time()),
-        "source": "url",
-        "filename": body.url,
-        "source_path": body.url,
-    }
-    _id = f"url::{int(time.time())}"
-    if hasattr(mgr, "add_texts"):
-        mgr.add_texts([text], [meta], ids=[_id])
-    else:
-        mgr.collection.add(documents=[text], metadatas=[meta], ids=[_id])
-    return {"ok": True, "saved": body.url}
+    res = await ingest_url_now(mgr, body.url.strip(), tag=tag or "phase10")
+    return {"ok": res.get("status") != "failed", "saved": body.url, **res}
+
+
+class URLsIn(BaseModel):
+    urls: List[str] = []
+    drain: bool = True
+
+
+@router.post("/urls")
+async def ingest_urls_enqueue(request: Request, body: URLsIn, tag: Optional[str] = "url"):
+    """Добавляет пачку URL в очередь (urls.txt) и, по умолчанию, запускает фоновый drain."""
+    from backend.app.ingest.urls import enqueue, start_drain, drain_status
+
+    enqueue(body.urls)
+    if body.drain:
+        return {"ok": True, "queued": len(body.urls), **start_drain(_get_manager(request), tag=tag or "url")}
+    return {"ok": True, "queued": len(body.urls), **drain_status()}
+
+
+@router.post("/urls/drain")
+async def ingest_urls_drain(request: Request, tag: Optional[str] = "url"):
+    """Фоновый drain очереди urls.txt: общий и per-host лимиты, ETag/Last-Modified."""
+    from backend.app.ingest.urls import start_drain
+
+    return {"ok": True, **start_drain(_get_manager(request), tag=tag or "url")}
+
+
+@router.get("/urls/status")
+async def ingest_urls_status():
+    from backend.app.ingest.urls import drain_status
+
+    return {"ok": True, **drain_status()}
+
+
+@router.delete("/urls/drain")
+async def ingest_urls_cancel():
+    from backend.app.ingest.urls import cancel_drain
+
+    return {"ok": True, "cancelled": cancel_drain()}
 
 # --- ingest: server-side process queue ---
 from typing import List, Dict, Any
@@ -110,22 +137,14 @@ async def ingest_process(request: Request) -> Dict[str, Any]:
                 except Exception: return p.read_text(errors="ignore")
             if ext == ".pdf":
                 try:
-                    from PyPDF2 import PdfReader  # type: ignore
-                    parts = []
-                    with p.open("rb") as fh:
-                        r = PdfReader(fh)
-                        pages = list(getattr(r, "pages", []) or [])
-                        for pg in pages[:5]:
-                            try: parts.append(pg.extract_text() or "")
-                            except Exception: parts.append("")
-                    return "\n".join(parts).strip()
+                    from backend.app.ingest.sidecar import get_text
+                    return get_text(p).strip()
                 except Exception as e:
                     return f"[pdf extract error: {e}]"
             if ext == ".docx":
                 try:
-                    import docx  # type: ignore
-                    d = docx.Document(str(p))
-                    return "\n".join(par.text for par in d.paragraphs).strip()
+                    from backend.app.ingest.sidecar import get_text
+                    return get_text(p).strip()
                 except Exception as e:
                     return f"[docx extract error: {e}]"
             try: return p.read_text(encoding="utf-8", errors="ignore")
@@ -1,6 +1,6 @@
 from __future__ import annotations
-import json, os
-from typing import Optional, Dict, Any, List
+import json, os, threading, time
+from typing import Optional, Dict, Any, List, Tuple
 from datetime import datetime
 from fastapi import APIRouter
 from pydantic import BaseModel, Field
@@ -31,20 +31,84 @@ class UserProfile(BaseModel):
     goals: List[Goal] = Field(default_factory=list)
     updated_at: Optional[str] = None
 
-def load_profile(user_id: str) -> UserProfile:
+# ---- кэш: user_id -> (mtime_ns файла, профиль, готовый USER_PROFILE-блок, когда проверяли mtime) ----
+# stat файла не чаще раза в PROFILE_STAT_SEC — в остальное время запрос стоит один dict lookup
+PROFILE_STAT_SEC = float(os.environ.get("AIR4_PROFILE_STAT_SEC", "2"))
+_CACHE: Dict[str, Tuple[int, UserProfile, str, float]] = {}
+_CACHE_LOCK = threading.Lock()
+
+def render_profile_block(prof: UserProfile) -> str:
+    prefs = prof.preferences or {}
+    facts = prof.facts or {}
+    goals = prof.goals or []
+
+    parts = []
+    if prof.name:
+        parts.append(f"name={prof.name}")
+    if prefs:
+        parts.append("prefs=" + ",".join([f"{k}:{v}" for k, v in list(prefs.items())[:5]]))
+    if facts:
+        parts.append("facts=" + ",".join([f"{k}:{v}" for k, v in list(facts.items())[:6]]))
+    if goals:
+        parts.append("goals=" + "; ".join([g.title or g.id for g in goals][:3]))
+
+    return "USER_PROFILE: " + " | ".join(parts) if parts else ""
+
+def _cache_put(key: str, mtime_ns: int, prof: UserProfile) -> Tuple[UserProfile, str]:
+    block = render_profile_block(prof)
+    with _CACHE_LOCK:
+        _CACHE[key] = (mtime_ns, prof, block, time.monotonic())
+    return prof, block
+
+def invalidate_profile(user_id: Optional[str] = None) -> None:
+    with _CACHE_LOCK:
+        if user_id is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(_safe_user_id(user_id), None)
+
+def _cached(user_id: str) -> Tuple[UserProfile, str]:
+    key = _safe_user_id(user_id)
+    now = time.monotonic()
+    with _CACHE_LOCK:
+        hit = _CACHE.get(key)
+    if hit is not None and now - hit[3] < PROFILE_STAT_SEC:
+        return hit[1], hit[2]
     p = _path(user_id)
-    if os.path.exists(p):
-        with open(p, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return UserProfile(**data)
-    prof = UserProfile(user_id=user_id, updated_at=datetime.utcnow().isoformat())
-    save_profile(prof)
-    return prof
+    try:
+        mtime_ns = os.stat(p).st_mtime_ns
+    except FileNotFoundError:
+        prof = UserProfile(user_id=user_id, updated_at=datetime.utcnow().isoformat())
+        save_profile(prof)  # положит в кэш
+        return _cached(user_id)
+    if hit is not None and hit[0] == mtime_ns:
+        with _CACHE_LOCK:
+            _CACHE[key] = (hit[0], hit[1], hit[2], now)
+        return hit[1], hit[2]
+    # файл изменился (другой воркер/руками) — перечитываем
+    with open(p, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return _cache_put(key, mtime_ns, UserProfile(**data))
+
+def load_profile(user_id: str) -> UserProfile:
+    # копия: вызывающие могут менять объект, кэш должен остаться как на диске
+    return _cached(user_id)[0].model_copy(deep=True)
+
+def profile_block(user_id: str) -> str:
+    """Готовая строка USER_PROFILE: ... для system-промпта (из кэша)."""
+    return _cached(user_id)[1]
 
 def save_profile(profile: UserProfile) -> None:
     profile.updated_at = datetime.utcnow().isoformat()
-    with open(_path(profile.user_id), "w", encoding="utf-8") as f:
+    p = _path(profile.user_id)
+    tmp = p + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(profile.model_dump(), f, ensure_ascii=False, indent=2)
+    os.replace(tmp, p)
+    try:
+        _cache_put(_safe_user_id(profile.user_id), os.stat(p).st_mtime_ns, profile.model_copy(deep=True))
+    except Exception:
+        invalidate_profile(profile.user_id)
 
 @router.get("", response_model=UserProfile)
 def get_profile(user_id: str = "dev"):
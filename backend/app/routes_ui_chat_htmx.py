@@ -1,15 +1,24 @@
+from typing import Optional
+
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
 from backend.app.shared_templates import templates
-from backend.app.main import _SESSIONS
+from backend.app.main import load_session
+from backend.app.memory.messages import MESSAGES, PAGE_SIZE
 
 router = APIRouter()
 
 @router.get("/ui/chat/{session_id}/messages", response_class=HTMLResponse)
-async def chat_messages_fragment(request: Request, session_id: str):
-    session = _SESSIONS.get(session_id)
+async def chat_messages_fragment(request: Request, session_id: str,
+                                 before: Optional[int] = None, limit: int = PAGE_SIZE):
+    # последние сообщения из кольца; before=<seq> — более старая страница (подгрузка при прокрутке вверх)
+    session = load_session(session_id)
+    messages = MESSAGES.page("dev", session_id, before=before, limit=max(1, min(limit, 500))) if session else []
+    older = messages[0].seq if messages and messages[0].seq > 0 else None
     return templates.TemplateResponse("fragments/messages.html", {
         "request": request,
         "session": session,
-        "messages": session.messages if session else []
+        "messages": messages,
+        "older": older,
+        "limit": limit,
     })
@@ -1,16 +1,32 @@
 # backend/app/security.py — Phase 5 (RBAC + Audit + Revocation)
+import atexit
+import base64
+import calendar
+import gzip
 import os
 import hmac
 import hashlib
 import json
+import queue
+import secrets
+import shutil
 import threading
 import time
 import uuid
+from contextlib import contextmanager
 from typing import Optional, Dict, Any, List
 
 from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+
+from backend.app.session_store import SessionStore, get_session_store
+
+# ---- optional deps ----
+_HAS_FCNTL = False
+try:
+    import fcntl  # нет на Windows — там ротация без межпроцессной блокировки
+    _HAS_FCNTL = True
+except Exception:
+    pass
 
 # ---------------- Settings ----------------
 
@@ -26,8 +42,13 @@ class Settings:
         self.DURESS_PASSWORD = _getenv("DURESS_PASSWORD", "9111")
         self.DURESS_PASSWORD_HASH = _getenv("DURESS_PASSWORD_HASH", "")
 
-        self.SECRET_KEY = _getenv("SECRET_KEY", "dev-secret-key")
+        # Ключ подписи токенов. Не задан — генерируется один раз и лежит в SECRET_KEY_FILE (0600),
+        # общий для всех воркеров; публичный "dev-secret-key" AuthManager не примет
+        self.SECRET_KEY = _getenv("SECRET_KEY", "")
+        self.SECRET_KEY_FILE = _getenv("SECRET_KEY_FILE", os.path.join(_getenv("STORAGE_DIR", "storage"), "secret_key"))
         self.TOKEN_TTL_SEC = int(_getenv("TOKEN_TTL_SEC", "86400") or "86400")
+        # как часто чистить список отозванных токенов от истёкших (0 — не чистить фоном)
+        self.TOKEN_SWEEP_SEC = int(_getenv("TOKEN_SWEEP_SEC", "600") or "600")
 
         # Путь до audit-лога
         self.AUDIT_LOG = _getenv("AUDIT_LOG", "storage/audit.log")
@@ -41,6 +62,32 @@ def constant_time_eq(a: str, b: str) -> bool:
     # безопасное сравнение
     return hmac.compare_digest(a, b)
 
+def load_or_create_secret(path: str) -> str:
+    """Ключ из файла; нет файла — создаём случайный (0600). Гонку воркеров решает os.link: выигрывает первый."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            key = f.read().strip()
+        if key:
+            return key
+    except FileNotFoundError:
+        pass
+    ensure_dir_for_file(path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(secrets.token_urlsafe(48))
+    try:
+        os.link(tmp, path)  # атомарно и не перезаписывает чужой ключ
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(path, "r", encoding="utf-8") as f:
+        key = f.read().strip()
+    if not key:
+        raise RuntimeError(f"empty secret key file: {path}")
+    return key
+
 def ensure_dir_for_file(path: str) -> None:
     d = os.path.dirname(path)
     if d and not os.path.exists(d):
@@ -58,15 +105,49 @@ def get_client_ip(request: Request) -> str:
 
 # ---------------- Audit ----------------
 
+# Параметры sink-а (env): очередь ограничена, при переполнении событие теряется и считается в dropped
+AUDIT_QUEUE_MAX = int(_getenv("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_FLUSH_SEC = float(_getenv("AUDIT_FLUSH_SEC", "0.5"))       # как часто писатель сбрасывает пачку
+AUDIT_FSYNC = _getenv("AUDIT_FSYNC", "interval")                  # always | interval | never
+AUDIT_FSYNC_SEC = float(_getenv("AUDIT_FSYNC_SEC", "5"))          # для interval
+AUDIT_MAX_BYTES = int(_getenv("AUDIT_MAX_BYTES", str(10 * 1024 * 1024)))  # 0 — без ротации по размеру
+AUDIT_ROTATE_SEC = int(_getenv("AUDIT_ROTATE_SEC", "86400"))      # 0 — без ротации по времени
+AUDIT_BACKUPS = int(_getenv("AUDIT_BACKUPS", "14"))               # сколько .gz держим
+
 class AuditLogger:
     """
     Пишет JSON-строки (одна строка = одно событие) в AUDIT_LOG.
     Поля: ts, event, ok, ip, ua, profile, + любые дополнительные.
+    log() только кладёт строку в очередь (не блокирует event loop); фоновый поток пишет пачками
+    в открытый файл, делает fsync по политике и ротирует (размер/время) в <log>.<stamp>.gz.
+    close() дописывает всё, что в очереди, — при штатной остановке ничего не теряется.
     """
-    def __init__(self, filepath: str):
+    def __init__(self, filepath: str, *, queue_max: int = AUDIT_QUEUE_MAX, flush_sec: float = AUDIT_FLUSH_SEC,
+                 fsync: str = AUDIT_FSYNC, fsync_sec: float = AUDIT_FSYNC_SEC, max_bytes: int = AUDIT_MAX_BYTES,
+                 rotate_sec: int = AUDIT_ROTATE_SEC, backups: int = AUDIT_BACKUPS):
         self.filepath = filepath
         ensure_dir_for_file(filepath)
+        self.flush_sec = flush_sec
+        self.fsync = fsync if fsync in ("always", "interval", "never") else "interval"
+        self.fsync_sec = fsync_sec
+        self.max_bytes = max_bytes
+        self.rotate_sec = rotate_sec
+        self.backups = backups
+        # в очереди: строка JSON | threading.Event (маркер flush) | None (стоп)
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_max))
         self._lock = threading.Lock()
+        self._closed = False
+        self.dropped = 0          # всего потеряно из-за переполнения очереди
+        self._drop_reported = 0   # сколько из них уже отмечено записью audit.overflow
+        self.written = 0
+        self.rotations = 0
+        self._f = None
+        self._lockf = None
+        self._opened_at = 0.0
+        self._synced_at = 0.0
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
 
     def log(self, event: str, request: Optional[Request], profile: Optional[str],
             ok: bool = True, **fields: Any) -> None:
@@ -80,35 +161,272 @@ class AuditLogger:
         }
         rec.update(fields)
         line = json.dumps(rec, ensure_ascii=False)
+        if self._closed:
+            try:
+                self._write_now([line])  # после close (atexit и т.п.) — синхронно, чтобы не потерять
+            except Exception as e:
+                print(f"[WARN] audit write failed after close: {e}")
+            return
+        try:
+            self._q.put_nowait(line)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    # ---- писатель ----
+    # Файл общий для всех воркеров uvicorn. Запись — под LOCK_SH на <log>.lock со сверкой inode
+    # (после чужой ротации переоткрываем), ротация — под LOCK_EX: в переименованный файл никто не пишет.
+    @contextmanager
+    def _flock(self, exclusive: bool):
+        if not _HAS_FCNTL:
+            yield
+            return
+        if self._lockf is None:
+            self._lockf = open(self.filepath + ".lock", "a")
+        fcntl.flock(self._lockf.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lockf.fileno(), fcntl.LOCK_UN)
+
+    def _same_file(self, f) -> bool:
+        try:
+            return os.stat(self.filepath).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _file_started(self) -> float:
+        """Когда начат текущий файл — по ts первой записи (mtime — это последняя запись, а не создание)."""
+        try:
+            with open(self.filepath, "r", encoding="utf-8") as f:
+                first = f.readline()
+            if first.strip():
+                return float(calendar.timegm(time.strptime(json.loads(first)["ts"], "%Y-%m-%dT%H:%M:%SZ")))
+        except Exception:
+            pass
+        return time.time()
+
+    def _ensure_open(self) -> None:
+        if self._f is not None:
+            if self._same_file(self._f):
+                return
+            self._f.close()  # другой воркер ротировал (или файл удалили) — пишем в новый
+            self._f = None
+        self._f = open(self.filepath, "a", encoding="utf-8")
+        self._opened_at = self._file_started()
+
+    def _write_now(self, lines: List[str]) -> None:
+        with self._lock:
+            with self._flock(False):
+                self._ensure_open()
+                if os.fstat(self._f.fileno()).st_size == 0:
+                    self._opened_at = time.time()
+                self._f.write("\n".join(lines) + "\n")
+                self._f.flush()
+                self.written += len(lines)
+                now = time.time()
+                if self.fsync == "always" or (self.fsync == "interval" and now - self._synced_at >= self.fsync_sec):
+                    os.fsync(self._f.fileno())
+                    self._synced_at = now
+            if self._should_rotate(now):
+                self._rotate()
+
+    def _should_rotate(self, now: float) -> bool:
+        if self.max_bytes > 0 and os.fstat(self._f.fileno()).st_size >= self.max_bytes:
+            return True
+        return self.rotate_sec > 0 and now - self._opened_at >= self.rotate_sec
+
+    def _rotate(self) -> None:
+        """Вызывается под self._lock."""
+        with self._flock(True):
+            f, self._f = self._f, None
+            if f is None:
+                return
+            try:
+                # пока ждали LOCK_EX, файл мог ротировать другой воркер или его удалили руками —
+                # тогда ротировать нечего, следующая запись откроет/создаст новый
+                if not self._same_file(f) or not self._needs_rotation(f):
+                    return
+                if self.fsync != "never":
+                    os.fsync(f.fileno())
+            finally:
+                f.close()
+            now = time.time()
+            # имя сортируется по времени: <log>.YYYYmmdd-HHMMSS-mmm[.n].gz
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+            rotated = f"{self.filepath}.{stamp}"
+            n = 1
+            while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+                rotated = f"{self.filepath}.{stamp}.{n}"
+                n += 1
+            try:
+                os.replace(self.filepath, rotated)
+            except FileNotFoundError:
+                return
+            self.rotations += 1
+        # сжатие — отдельным потоком, писатель не ждёт
+        threading.Thread(target=self._compress, args=(rotated,), name="audit-gzip", daemon=False).start()
+
+    def _needs_rotation(self, f) -> bool:
+        # решение принимал этот процесс по своим счётчикам; под LOCK_EX перепроверяем по самому файлу
+        if self.max_bytes > 0 and os.fstat(f.fileno()).st_size >= self.max_bytes:
+            return True
+        return self.rotate_sec > 0 and time.time() - self._file_started() >= self.rotate_sec
+
+    def _compress(self, path: str) -> None:
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(path + ".gz.tmp", path + ".gz")
+            os.remove(path)
+            base = os.path.basename(self.filepath) + "."
+            d = os.path.dirname(self.filepath) or "."
+            old = sorted(f for f in os.listdir(d) if f.startswith(base) and f.endswith(".gz"))
+            for f in old[:max(0, len(old) - self.backups)]:
+                os.remove(os.path.join(d, f))
+        except Exception as e:
+            print(f"[WARN] audit rotate/compress failed for {path}: {e}")
+
+    def _write_batch(self, items: List[Any]) -> None:
+        batch = [x for x in items if isinstance(x, str)]
         with self._lock:
-            with open(self.filepath, "a", encoding="utf-8") as f:
-                f.write(line + "\n")
+            dropped, self._drop_reported = self.dropped - self._drop_reported, self.dropped
+        if dropped:
+            batch.append(json.dumps({"ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                                     "event": "audit.overflow", "ok": False, "dropped": dropped}))
+        if batch:
+            try:
+                self._write_now(batch)
+            except Exception as e:
+                print(f"[WARN] audit write failed ({len(batch)} records): {e}")
+        elif self._f is not None:
+            # тишина — но ротацию по времени всё равно проверяем
+            with self._lock:
+                if self._f is not None and self._should_rotate(time.time()):
+                    self._rotate()
+
+    def _run(self) -> None:
+        # поток не должен умереть раньше стоп-сигнала: иначе очередь забьётся, а close() повиснет
+        while True:
+            items: List[Any] = []
+            try:
+                items.append(self._q.get(timeout=self.flush_sec))
+            except queue.Empty:
+                pass
+            while (not items or items[-1] is not None) and len(items) < 1000:
+                try:
+                    items.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(items)
+            except Exception as e:
+                print(f"[WARN] audit writer error: {e}")
+            for x in items:
+                if isinstance(x, threading.Event):
+                    x.set()
+            if (items and items[-1] is None) or (self._closed and self._q.empty()):
+                return
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Ждём, пока писатель запишет всё, что было в очереди на момент вызова."""
+        if self._closed:
+            return True
+        done = threading.Event()
+        try:
+            self._q.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"queued": self._q.qsize(), "written": self.written, "dropped": self.dropped,
+                "rotations": self.rotations, "fsync": self.fsync}
+
+    def close(self, timeout: float = 30.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._q.put(None, timeout=1)  # разбудить писателя; очередь полна — он и так выйдет, разобрав её
+        except queue.Full:
+            pass
+        if self._thread.is_alive():
+            self._thread.join(timeout=timeout)
+        if not self._thread.is_alive():
+            # писатель завершился — что осталось в очереди, дописываем сами
+            rest: List[Any] = []
+            while True:
+                try:
+                    rest.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(rest)
+            except Exception as e:
+                print(f"[WARN] audit close: {e}")
+            for x in rest:
+                if isinstance(x, threading.Event):
+                    x.set()
+        with self._lock:
+            if self._f is not None:
+                try:
+                    if self.fsync != "never":
+                        os.fsync(self._f.fileno())
+                    self._f.close()
+                except OSError as e:
+                    print(f"[WARN] audit close: {e}")
+                self._f = None
 
 # ---------------- Auth / Tokens ----------------
 
+def _b64e(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode("ascii")
+
+def _b64d(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
 class TokenInfo:
-    __slots__ = ("token", "profile", "created_at", "expires_at", "revoked")
-    def __init__(self, token: str, profile: str, ttl_sec: int):
-        now = int(time.time())
+    __slots__ = ("token", "profile", "created_at", "expires_at", "jti")
+    def __init__(self, token: str, profile: str, created_at: int, expires_at: int, jti: str):
         self.token = token
         self.profile = profile  # 'default' | 'duress'
-        self.created_at = now
-        self.expires_at = now + ttl_sec
-        self.revoked = False
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.jti = jti
+
+    @classmethod
+    def from_claims(cls, token: str, claims: Dict[str, Any]) -> "TokenInfo":
+        return cls(token, claims.get("p"), int(claims.get("iat") or 0), int(claims.get("exp") or 0),
+                   str(claims.get("jti") or ""))
 
 class AuthManager:
     """
-    Память токенов в памяти процесса (in‑memory).
+    Токен самодостаточный: base64url(claims).base64url(HMAC-SHA256(SECRET_KEY, claims)),
+    claims = {p: профиль, iat, exp, jti}. verify() проверяет подпись и срок без хранилища;
+    в общем SessionStore (memory | sqlite) — только отозванные jti до их exp (видят все воркеры).
     Логика:
-      - login(password) -> выдать токен (uuid4 hex), определить профиль
+      - login(password) -> выдать подписанный токен, определить профиль
       - verify(token) -> вернуть TokenInfo или 401
-      - revoke(token) -> пометить revoked=True (logout)
+      - revoke(token) -> добавить jti в отозванные (logout)
+    Фоновый поток раз в TOKEN_SWEEP_SEC выкидывает из отозванных то, что и так истекло.
     """
-    def __init__(self, settings: Settings, audit: AuditLogger):
+    def __init__(self, settings: Settings, audit: AuditLogger, store: Optional[SessionStore] = None,
+                 sweep_sec: Optional[int] = None):
         self.settings = settings
         self.audit = audit
-        self._tokens: Dict[str, TokenInfo] = {}
-        self._lock = threading.Lock()
+        self.store = store or get_session_store()
+        # токен — подпись над claims от клиента: известный ключ = любой может выписать себе профиль
+        if settings.SECRET_KEY == "dev-secret-key":
+            raise RuntimeError("SECRET_KEY is the public dev key; unset it (a random key is generated) or set your own")
+        key = settings.SECRET_KEY or load_or_create_secret(settings.SECRET_KEY_FILE)
+        self._key = key.encode("utf-8")
+        self.sweep_sec = settings.TOKEN_SWEEP_SEC if sweep_sec is None else sweep_sec
+        self._stop = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+        if self.sweep_sec > 0:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="token-sweep", daemon=True)
+            self._sweeper.start()
 
     def _password_matches(self, provided: str, plain: str, sha_hex: str) -> bool:
         # если задан *_HASH — сверяем sha256(provided) с ним; иначе сравниваем с plain
@@ -116,6 +434,30 @@ class AuthManager:
             return constant_time_eq(sha256_hex(provided), sha_hex.lower())
         return constant_time_eq(provided, plain)
 
+    def _sign(self, payload: str) -> bytes:
+        return _b64e(hmac.new(self._key, payload.encode("utf-8"), hashlib.sha256).digest()).encode("ascii")
+
+    def issue(self, profile: str, ttl_sec: Optional[int] = None) -> TokenInfo:
+        now = int(time.time())
+        ttl = self.settings.TOKEN_TTL_SEC if ttl_sec is None else ttl_sec
+        claims = {"p": profile, "iat": now, "exp": now + ttl, "jti": uuid.uuid4().hex}
+        payload = _b64e(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return TokenInfo.from_claims(f"{payload}.{self._sign(payload).decode('ascii')}", claims)
+
+    def decode(self, token: str) -> Optional[TokenInfo]:
+        """Подпись верна -> TokenInfo (срок и отзыв здесь не проверяются); иначе None."""
+        payload, dot, sig = token.partition(".")
+        # сравниваем байты: в заголовке может прийти что угодно, compare_digest(str) не любит не-ASCII
+        if not dot or not hmac.compare_digest(sig.encode("utf-8", "replace"), self._sign(payload)):
+            return None
+        try:
+            claims = json.loads(_b64d(payload))
+        except Exception:
+            return None
+        if not isinstance(claims, dict) or not claims.get("jti"):
+            return None
+        return TokenInfo.from_claims(token, claims)
+
     def login(self, password: str, request: Request) -> Dict[str, Any]:
         if self._password_matches(password, self.settings.DURESS_PASSWORD, self.settings.DURESS_PASSWORD_HASH):
             profile = "duress"
@@ -125,37 +467,46 @@ class AuthManager:
             self.audit.log("login", request, None, ok=False, reason="bad-password")
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
-        token = uuid.uuid4().hex
-        ti = TokenInfo(token, profile, self.settings.TOKEN_TTL_SEC)
-        with self._lock:
-            self._tokens[token] = ti
-
-        # В аудит не кладём полный токен
-        self.audit.log("login", request, profile, ok=True, token=token[:8])
-        return {"token": token, "profile": profile, "ttl_sec": self.settings.TOKEN_TTL_SEC}
+        ti = self.issue(profile)
+        # В аудит не кладём токен — только его id
+        self.audit.log("login", request, profile, ok=True, token=ti.jti[:8])
+        return {"token": ti.token, "profile": profile, "ttl_sec": self.settings.TOKEN_TTL_SEC}
 
     def verify(self, token: Optional[str]) -> TokenInfo:
         if not token:
             raise HTTPException(status_code=401, detail="Missing token")
-        with self._lock:
-            ti = self._tokens.get(token)
+        ti = self.decode(token)
         if ti is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        now = int(time.time())
-        if ti.revoked:
-            raise HTTPException(status_code=401, detail="Token revoked")
-        if now >= ti.expires_at:
+        if int(time.time()) >= ti.expires_at:
             raise HTTPException(status_code=401, detail="Token expired")
+        if self.store.is_revoked(ti.jti):
+            raise HTTPException(status_code=401, detail="Token revoked")
         return ti
 
     def revoke(self, token: str, request: Request) -> None:
-        with self._lock:
-            ti = self._tokens.get(token)
-            if ti is None:
-                self.audit.log("logout", request, None, ok=False, reason="unknown-token")
-                return
-            ti.revoked = True
-        self.audit.log("logout", request, ti.profile, ok=True, token=token[:8])
+        ti = self.decode(token)
+        if ti is None:
+            self.audit.log("logout", request, None, ok=False, reason="unknown-token")
+            return
+        if ti.expires_at > int(time.time()):  # истёкший отзывать незачем — он и так не пройдёт
+            self.store.revoke_token(ti.jti, ti.expires_at)
+        self.audit.log("logout", request, ti.profile, ok=True, token=ti.jti[:8])
+
+    def sweep(self) -> int:
+        """Убирает из отозванных истёкшие записи; вернёт сколько удалено."""
+        try:
+            return self.store.purge_revoked(int(time.time()))
+        except Exception as e:
+            print(f"[WARN] revoked token sweep failed: {e}")
+            return 0
+
+    def _sweep_loop(self) -> None:
+        while not self._stop.wait(self.sweep_sec):
+            self.sweep()
+
+    def close(self) -> None:
+        self._stop.set()
 
 # ---------------- Secure State (lock flag) ----------------
 
@@ -176,77 +527,105 @@ class SecureState:
             return self._locked
 
 # ---------------- RBAC Middleware ----------------
-
-class RBACMiddleware(BaseHTTPMiddleware):
+# Оба middleware — чистый ASGI: без BaseHTTPMiddleware (лишняя задача + memory stream на запрос
+# и буферизация StreamingResponse, что ломает SSE). Смотрим только scope/заголовки, тело не трогаем.
+
+def _bearer_token(scope) -> Optional[str]:
+    for k, v in scope.get("headers") or ():
+        if k == b"authorization":
+            val = v.decode("latin-1")
+            if val[:7].lower() == "bearer ":
+                return val[7:].strip() or None
+            return None
+    return None
+
+async def _send_json(send, status: int, payload: Dict[str, Any]) -> None:
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode("ascii"))]})
+    await send({"type": "http.response.body", "body": body})
+
+class RBACMiddleware:
     """
     Если токен с профилем 'duress' — разрешены только allowlist-префиксы.
     Остальные запросы получают 403.
     """
     def __init__(self, app, auth: AuthManager, allow_paths: Optional[List[str]] = None):
-        super().__init__(app)
+        self.app = app
         self.auth = auth
-        self.allow_paths = allow_paths or [
+        self.allow_paths = tuple(allow_paths or [
             "/health",
             "/auth/login",
             "/auth/logout",
             "/api/v0/secure/status",
             "/chat",
             "/memory/search",
-        ]
+        ])
 
-    async def dispatch(self, request: Request, call_next):
-        path = request.url.path
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope.get("path") or ""
 
         # Эти пути всегда допускаем без токена
-        if path.startswith("/health") or path.startswith("/auth/login"):
-            return await call_next(request)
+        if path.startswith(("/health", "/auth/login")):
+            return await self.app(scope, receive, send)
 
         # Иначе ждём Bearer токен
-        auth_header = request.headers.get("authorization") or request.headers.get("Authorization")
-        token = None
-        if auth_header and auth_header.lower().startswith("bearer "):
-            token = auth_header.split(" ", 1)[1].strip()
+        token = _bearer_token(scope)
         if not token:
-            return JSONResponse({"detail": "Missing token"}, status_code=401)
+            return await _send_json(send, 401, {"detail": "Missing token"})
 
         # Проверяем валидность
         try:
             ti = self.auth.verify(token)
         except HTTPException as exc:
-            return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+            return await _send_json(send, exc.status_code, {"detail": exc.detail})
 
         # Если duress — только allowlist
-        if ti.profile == "duress":
-            if not any(path.startswith(p) for p in self.allow_paths):
-                return JSONResponse({"detail": "RBAC: blocked in duress profile"}, status_code=403)
+        if ti.profile == "duress" and not path.startswith(self.allow_paths):
+            return await _send_json(send, 403, {"detail": "RBAC: blocked in duress profile"})
 
-        # Пробрасываем auth-инфо в request.state
-        request.state.auth = ti
-        return await call_next(request)
+        # Пробрасываем auth-инфо в request.state (Starlette держит state в scope["state"])
+        scope.setdefault("state", {})["auth"] = ti
+        return await self.app(scope, receive, send)
 
 # ---------------- Audit Events Middleware ----------------
 
-class AuditEventsMiddleware(BaseHTTPMiddleware):
+_AUDITED = (("/chat", "chat"), ("/memory/add", "memory.add"))
+
+class AuditEventsMiddleware:
     """
     Логируем бизнес-события (chat, memory.add) постфактум (по статусу ответа).
+    Статус ловим в обёртке send на http.response.start; тело идёт дальше как есть.
     """
     def __init__(self, app, audit: AuditLogger):
-        super().__init__(app)
+        self.app = app
         self.audit = audit
 
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") != "POST":
+            return await self.app(scope, receive, send)
+        path = scope.get("path") or ""
+        event = next((ev for prefix, ev in _AUDITED if path.startswith(prefix)), None)
+        if event is None:
+            return await self.app(scope, receive, send)
+
+        status = [500]  # приложение упало до ответа — считаем неуспехом
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
         try:
-            path = request.url.path
-            method = request.method.upper()
-            ti = getattr(getattr(request, "state", None), "auth", None)
-            profile = ti.profile if ti else None
-
-            if method == "POST" and path.startswith("/chat"):
-                self.audit.log("chat", request, profile, ok=(200 <= response.status_code < 400))
-            elif method == "POST" and path.startswith("/memory/add"):
-                self.audit.log("memory.add", request, profile, ok=(200 <= response.status_code < 400))
-        except Exception:
-            # Аудит не должен валить запросы
-            pass
-        return response
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            try:
+                ti = (scope.get("state") or {}).get("auth")
+                profile = ti.profile if ti else None
+                self.audit.log(event, Request(scope), profile, ok=(200 <= status[0] < 400))
+            except Exception:
+                # Аудит не должен валить запросы
+                pass
@@ -0,0 +1,326 @@
+# backend/app/session_store.py — общее хранилище сессий и токенов (memory | sqlite), чтобы работать в несколько воркеров
+from __future__ import annotations
+
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.app.memory.sqlite_store import connect
+
+# memory — как раньше, всё в процессе; sqlite — общий файл (WAL) для всех воркеров uvicorn и переживает рестарт
+SESSION_STORE = os.getenv("AIR4_SESSION_STORE", "sqlite").lower()
+SESSION_DB = os.getenv("AIR4_SESSION_DB", os.path.join(os.getenv("STORAGE_DIR", "storage"), "sessions.sqlite3"))
+
+
+Cursor = Tuple[int, str]  # (updated_at, id) последней отданной записи
+
+
+def encode_cursor(rec: Dict[str, Any]) -> str:
+    return f"{int(rec.get('updated_at') or 0)}:{rec['id']}"
+
+
+def decode_cursor(s: Optional[str]) -> Optional[Cursor]:
+    if not s:
+        return None
+    ts, _, sid = s.partition(":")
+    try:
+        return int(ts), sid
+    except ValueError:
+        return None
+
+
+class SessionStore(ABC):
+    """
+    Сессии — dict-записи с обязательными id и updated_at (остальные поля как есть).
+    Каждая запись сессии поднимает общий монотонный version; запись получает его в rec["version"].
+    Токены самоподписанные (security.AuthManager) и здесь не хранятся; храним только отозванные —
+    id токена (jti) до его истечения, после чего запись не нужна и вычищается purge_revoked().
+    """
+
+    # ---- sessions ----
+    @abstractmethod
+    def get(self, sid: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def put(self, rec: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    def create(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        """Вставка, если такой id ещё нет; возвращает запись из хранилища (выигрывает первый воркер)."""
+
+    @abstractmethod
+    def list(self, limit: Optional[int] = None, after: Optional[Cursor] = None) -> List[Dict[str, Any]]:
+        """Свежие первыми (updated_at DESC, id DESC); after — курсор, страница начинается после него."""
+
+    @abstractmethod
+    def changed_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Сессии с version > заданного, по возрастанию version."""
+
+    @abstractmethod
+    def version(self) -> int:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+    @abstractmethod
+    def delete(self, sid: str) -> bool:
+        ...
+
+    # ---- revoked tokens ----
+    @abstractmethod
+    def revoke_token(self, jti: str, expires_at: int) -> bool:
+        """Добавляет jti в отозванные; False — уже был отозван."""
+
+    @abstractmethod
+    def is_revoked(self, jti: str) -> bool:
+        ...
+
+    @abstractmethod
+    def purge_revoked(self, now: int) -> int:
+        """Удаляет записи об отзыве уже истёкших токенов; вернёт сколько удалено."""
+
+
+class MemorySessionStore(SessionStore):
+    def __init__(self) -> None:
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._revoked: Dict[str, int] = {}  # jti -> expires_at
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def _stamp(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        self._version += 1
+        rec = dict(rec)
+        rec["version"] = self._version
+        return rec
+
+    def get(self, sid: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            rec = self._sessions.get(sid)
+            return dict(rec) if rec is not None else None
+
+    def put(self, rec: Dict[str, Any]) -> None:
+        with self._lock:
+            self._sessions[rec["id"]] = self._stamp(rec)
+
+    def create(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            cur = self._sessions.get(rec["id"])
+            if cur is None:
+                cur = self._sessions[rec["id"]] = self._stamp(rec)
+            return dict(cur)
+
+    def list(self, limit: Optional[int] = None, after: Optional[Cursor] = None) -> List[Dict[str, Any]]:
+        key = lambda r: (int(r.get("updated_at") or 0), r["id"])
+        with self._lock:
+            rows = sorted(self._sessions.values(), key=key, reverse=True)
+        if after is not None:
+            rows = [r for r in rows if key(r) < after]
+        rows = rows[:limit] if limit is not None else rows
+        return [dict(r) for r in rows]
+
+    def changed_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = sorted((r for r in self._sessions.values() if r.get("version", 0) > version),
+                          key=lambda r: r["version"])
+        rows = rows[:limit] if limit is not None else rows
+        return [dict(r) for r in rows]
+
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def delete(self, sid: str) -> bool:
+        with self._lock:
+            if self._sessions.pop(sid, None) is None:
+                return False
+            self._version += 1
+            return True
+
+    def revoke_token(self, jti: str, expires_at: int) -> bool:
+        with self._lock:
+            if jti in self._revoked:
+                return False
+            self._revoked[jti] = int(expires_at)
+            return True
+
+    def is_revoked(self, jti: str) -> bool:
+        with self._lock:
+            return jti in self._revoked
+
+    def purge_revoked(self, now: int) -> int:
+        with self._lock:
+            dead = [k for k, exp in self._revoked.items() if exp <= now]
+            for k in dead:
+                del self._revoked[k]
+            return len(dead)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    updated_at INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    ver INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS kv (
+    k TEXT PRIMARY KEY,
+    v INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO kv(k, v) VALUES ('sessions_version', 0);
+
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    expires_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revoked_expires ON revoked_tokens(expires_at);
+"""
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite в режиме WAL: один файл на все воркеры, соединение на поток."""
+
+    def __init__(self, path: str = SESSION_DB):
+        self.path = path
+        self._local = threading.local()
+        c = self.conn
+        c.executescript(_SCHEMA)
+        # базы без колонки ver (до версионирования) — докатываем на месте
+        if "ver" not in {r["name"] for r in c.execute("PRAGMA table_info(sessions)")}:
+            c.execute("ALTER TABLE sessions ADD COLUMN ver INTEGER NOT NULL DEFAULT 0")
+        c.executescript("""
+            DROP INDEX IF EXISTS idx_sessions_updated;
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated_id ON sessions(updated_at, id);
+            CREATE INDEX IF NOT EXISTS idx_sessions_ver ON sessions(ver);
+            DROP TABLE IF EXISTS tokens;
+        """)  # tokens — выданные uuid-токены до перехода на подписанные, больше не нужны
+
+    @property
+    def conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = connect(self.path)
+            self._local.conn = c
+        return c
+
+    def get(self, sid: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT data FROM sessions WHERE id=?", (sid,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def _bump(self) -> int:
+        c = self.conn
+        c.execute("UPDATE kv SET v=v+1 WHERE k='sessions_version'")
+        return int(c.execute("SELECT v FROM kv WHERE k='sessions_version'").fetchone()[0])
+
+    def _write(self, rec: Dict[str, Any], upsert: bool) -> bool:
+        c = self.conn
+        c.execute("BEGIN IMMEDIATE")  # bump + запись атомарно и между воркерами
+        try:
+            if not upsert and c.execute("SELECT 1 FROM sessions WHERE id=?", (rec["id"],)).fetchone():
+                c.execute("COMMIT")
+                return False
+            rec = dict(rec)
+            rec["version"] = self._bump()
+            c.execute(
+                "INSERT INTO sessions(id, updated_at, data, ver) VALUES (?,?,?,?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at=excluded.updated_at, data=excluded.data, ver=excluded.ver",
+                (rec["id"], int(rec.get("updated_at") or 0), json.dumps(rec, ensure_ascii=False), rec["version"]),
+            )
+            c.execute("COMMIT")
+            return True
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+
+    def put(self, rec: Dict[str, Any]) -> None:
+        self._write(rec, upsert=True)
+
+    def create(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        self._write(rec, upsert=False)
+        return self.get(rec["id"]) or dict(rec)
+
+    def list(self, limit: Optional[int] = None, after: Optional[Cursor] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT data FROM sessions"
+        args: list = []
+        if after is not None:
+            sql += " WHERE (updated_at, id) < (?, ?)"
+            args += [int(after[0]), after[1]]
+        sql += " ORDER BY updated_at DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return [json.loads(r["data"]) for r in self.conn.execute(sql, args)]
+
+    def changed_since(self, version: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT data FROM sessions WHERE ver>? ORDER BY ver"
+        args: list = [int(version)]
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return [json.loads(r["data"]) for r in self.conn.execute(sql, args)]
+
+    def version(self) -> int:
+        return int(self.conn.execute("SELECT v FROM kv WHERE k='sessions_version'").fetchone()[0])
+
+    def count(self) -> int:
+        return int(self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0])
+
+    def delete(self, sid: str) -> bool:
+        c = self.conn
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            n = c.execute("DELETE FROM sessions WHERE id=?", (sid,)).rowcount
+            if n:
+                self._bump()
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return n > 0
+
+    def revoke_token(self, jti: str, expires_at: int) -> bool:
+        return self.conn.execute(
+            "INSERT OR IGNORE INTO revoked_tokens(jti, expires_at) VALUES (?,?)", (jti, int(expires_at))
+        ).rowcount > 0
+
+    def is_revoked(self, jti: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM revoked_tokens WHERE jti=?", (jti,)).fetchone() is not None
+
+    def purge_revoked(self, now: int) -> int:
+        return self.conn.execute("DELETE FROM revoked_tokens WHERE expires_at<=?", (int(now),)).rowcount
+
+
+_STORE: Optional[SessionStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def make_store(kind: str = SESSION_STORE) -> SessionStore:
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "sqlite":
+        return SqliteSessionStore()
+    raise RuntimeError(f"Unknown AIR4_SESSION_STORE: {kind}")
+
+
+def get_session_store() -> SessionStore:
+    """Процессный синглтон; если sqlite не открылся — деградируем в memory (как раньше)."""
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                try:
+                    _STORE = make_store()
+                except Exception as e:
+                    print(f"[WARN] session store '{SESSION_STORE}' unavailable, using memory: {e}")
+                    _STORE = MemorySessionStore()
+    return _STORE
@@ -1,9 +1,10 @@
 # backend/app/summarizer.py
 from __future__ import annotations
 from typing import List, Dict, Optional, Tuple
-import time, hashlib, re
+import os, time, hashlib, re, threading
 
-import chromadb
+from backend.app.memory import chroma_registry
+from backend.app.memory.sqlite_store import connect
 
 try:
     from FlagEmbedding import BGEM3FlagModel  # если есть из Фазы 2 — используем
@@ -24,6 +25,78 @@ def _clean(s: str) -> str:
     return s
 
 
+class _SummaryIndex:
+    """
+    Индекс свежих саммари: (user_id, session_id, created_at) -> id в Chroma.
+    recent() берёт отсюда limit id-шников и просит у Chroma только их.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS summaries (
+                id TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                session_id TEXT,
+                created_at INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_summaries_user_ts ON summaries(user_id, created_at);
+            CREATE INDEX IF NOT EXISTS idx_summaries_session_ts ON summaries(user_id, session_id, created_at);
+            CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v TEXT);
+        """)
+
+    @property
+    def conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = connect(self.path)
+            self._local.conn = c
+        return c
+
+    def add(self, doc_id: str, meta: Dict) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO summaries(id, user_id, session_id, created_at) VALUES (?,?,?,?)",
+            (doc_id, meta.get("user_id") or "default", meta.get("session_id"), int(meta.get("created_at") or 0)),
+        )
+
+    def latest(self, user_id: str, limit: int, session_id: Optional[str] = None) -> List[str]:
+        if session_id:
+            rows = self.conn.execute(
+                "SELECT id FROM summaries WHERE user_id=? AND session_id=? ORDER BY created_at DESC LIMIT ?",
+                (user_id, session_id, int(limit)),
+            )
+        else:
+            rows = self.conn.execute(
+                "SELECT id FROM summaries WHERE user_id=? ORDER BY created_at DESC LIMIT ?",
+                (user_id, int(limit)),
+            )
+        return [r["id"] for r in rows]
+
+    def drop(self, ids: List[str]) -> None:
+        self.conn.executemany("DELETE FROM summaries WHERE id=?", [(i,) for i in ids])
+
+    def backfill(self, col) -> int:
+        """Один раз: саммари, записанные до появления индекса (только метаданные, без текстов)."""
+        c = self.conn
+        if c.execute("SELECT v FROM kv WHERE k='backfilled'").fetchone():
+            return 0
+        n = 0
+        res = col.get(include=["metadatas"])
+        c.execute("BEGIN")
+        try:
+            for doc_id, md in zip(res.get("ids") or [], res.get("metadatas") or []):
+                if (md or {}).get("type", "summary") == "summary":
+                    self.add(doc_id, md or {})
+                    n += 1
+            c.execute("INSERT OR REPLACE INTO kv(k, v) VALUES ('backfilled', '1')")
+            c.execute("COMMIT")
+        except Exception:
+            c.execute("ROLLBACK")
+            raise
+        return n
+
+
 class AutoSummarizer:
     """
     Короткие конспекты сессий -> Chroma (коллекция 'air4_summaries').
@@ -32,18 +105,25 @@ class AutoSummarizer:
 
     def __init__(
         self,
-        chroma_dir: str = ".chroma",
+        chroma_dir: Optional[str] = None,
         collection: str = "air4_summaries",
         llm_call=None,
         bge_device: str = "cpu"
     ):
-        self.client = chromadb.PersistentClient(path=chroma_dir)
+        # клиент общий с остальными менеджерами (реестр); каталог по умолчанию — AIR4_CHROMA_DIR
+        chroma_dir = chroma_dir or chroma_registry.resolve_dir(".chroma")  # старый .chroma с данными — не бросаем
+        self.client = chroma_registry.get_client(chroma_dir)
         # Без явной embedding_function Chroma использует дефолтную (ок для старта)
-        self.col = self.client.get_or_create_collection(collection)
+        self.col = chroma_registry.get_collection(collection, chroma_dir, space=None)
         self.llm_call = llm_call
         self._embedder = (
             BGEM3FlagModel("BAAI/bge-m3", use_fp16=False, device=bge_device) if _HAS_BGE else None
         )
+        self._index = _SummaryIndex(os.path.join(chroma_dir, f"{collection}.index.sqlite3"))
+        try:
+            self._index.backfill(self.col)
+        except Exception as e:
+            print(f"[WARN] summaries index backfill failed: {e}")
 
     # ---- публичное ----
     def summarize_session(
@@ -71,20 +151,26 @@ class AutoSummarizer:
         else:
             # положим без эмбеддингов — коллекция сама сделает по умолчанию (достаточно для MVP)
             self.col.add(ids=[doc_id], documents=[summary], metadatas=[meta])
+        self._index.add(doc_id, meta)
 
         return {"id": doc_id, "summary": summary, "metadata": meta}
 
-    def recent(self, user_id: str = "default", limit: int = 3) -> List[Tuple[str, Dict]]:
+    def recent(self, user_id: str = "default", limit: int = 3,
+               session_id: Optional[str] = None) -> List[Tuple[str, Dict]]:
         """
-        Возвращает последние N саммари как [(text, metadata), ...], сортируя по created_at.
+        Возвращает последние N саммари как [(text, metadata), ...], свежие первыми.
+        id берём из индекса (O(limit)), из Chroma — только эти документы.
         """
-        res = self.col.get(where={"user_id": user_id})
-        rows = []
-        for i, text in enumerate(res.get("documents", [])):
-            md = res["metadatas"][i]
-            rows.append((text, md))
-        rows.sort(key=lambda x: x[1].get("created_at", 0), reverse=True)
-        return rows[:limit]
+        ids = self._index.latest(user_id, limit, session_id)
+        if not ids:
+            return []
+        res = self.col.get(ids=ids)
+        by_id = {i: (text, md) for i, text, md in zip(res.get("ids") or [], res.get("documents") or [],
+                                                        res.get("metadatas") or [])}
+        missing = [i for i in ids if i not in by_id]
+        if missing:
+            self._index.drop(missing)  # удалены из Chroma мимо нас
+        return [by_id[i] for i in ids if i in by_id]
 
     # ---- внутреннее ----
     def _llm_summary(self, text: str, max_bullets: int = 6) -> str:
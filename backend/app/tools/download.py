@@ -0,0 +1,179 @@
+# backend/app/tools/download.py — потоковая загрузка с лимитом байт: тип по первым байтам, ранний обрыв, инкрементальный декод
+from __future__ import annotations
+
+import codecs
+import json
+import os
+import re
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, Optional
+
+import httpx
+
+# жёсткий потолок для любого GET без своего лимита (searchindex.js docs.python.org — единицы МБ)
+MAX_BYTES = int(os.getenv("AIR4_WEB_MAX_BYTES", str(16 * 1024 * 1024)))
+
+_BINARY_MAGIC = (
+    b"PK\x03\x04", b"\x89PNG", b"GIF8", b"\xff\xd8\xff", b"\x1f\x8b", b"BZh", b"7z\xbc\xaf",
+    b"ID3", b"OggS", b"fLaC", b"RIFF", b"\x00\x00\x00\x18ftyp", b"\x00\x00\x00\x20ftyp", b"\x1aE\xdf\xa3",
+    b"\x7fELF", b"MZ",
+)
+# только заведомо бинарные типы: application/x-* и vnd.* бывают и текстом (x-yaml, x-javascript, vnd.api+json)
+_BINARY_CT = ("image/", "audio/", "video/", "font/", "application/octet-stream", "application/zip",
+              "application/gzip", "application/x-gzip", "application/x-tar", "application/x-7z-compressed",
+              "application/x-rar", "application/vnd.rar", "application/x-bzip", "application/x-xz",
+              "application/zstd", "application/wasm", "application/java-archive", "application/x-msdownload",
+              "application/x-executable", "application/x-sharedlib", "application/x-iso9660-image",
+              "application/x-apple-diskimage", "application/x-debian-package", "application/x-rpm",
+              "application/x-shockwave-flash", "application/msword", "application/vnd.ms-",
+              "application/vnd.openxmlformats-", "application/vnd.oasis.opendocument.",
+              "application/vnd.android.package-archive")
+# текстовые подтипы (после снятия "x-" и суффикса "+..."): json/js -> 'json', остальное -> 'text'
+_JSON_SUBTYPES = ("json", "ndjson", "javascript", "ecmascript")
+_TEXT_SUBTYPES = ("yaml", "xml", "toml", "csv")
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([A-Za-z0-9_.:-]+)""", re.I)
+
+
+def sniff(head: bytes, content_type: str = "") -> str:
+    """'html' | 'pdf' | 'json' | 'text' | 'binary' — по заголовку и первым байтам (заголовку не всегда верим)."""
+    ct = (content_type or "").lower()
+    if head.startswith(b"%PDF") or "pdf" in ct:
+        return "pdf"
+    low = head[:1024].lstrip().lower()
+    if low.startswith((b"<!doctype html", b"<html")) or b"<html" in low or "html" in ct:
+        return "html"
+    if any(head.startswith(m) for m in _BINARY_MAGIC):
+        return "binary"
+    mime = ct.split(";", 1)[0].strip()
+    sub = mime.partition("/")[2].rsplit("+", 1)[-1]  # vnd.api+json -> json
+    sub = sub[2:] if sub.startswith("x-") else sub
+    if sub in _JSON_SUBTYPES:
+        return "json"
+    if sub in _TEXT_SUBTYPES:
+        return "text"
+    if mime.startswith(_BINARY_CT):
+        return "binary"
+    if b"\x00" in head[:1024]:
+        return "binary"
+    return "text"
+
+
+class Download:
+    """Ответ, прочитанный не больше чем на max_bytes. Повторяет нужную часть httpx.Response."""
+    __slots__ = ("status_code", "headers", "url", "content", "text", "kind", "truncated", "encoding", "_resp")
+
+    def __init__(self, resp: httpx.Response, content: bytes, text: str, kind: str, truncated: bool, encoding: str):
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.url = resp.url
+        self.content = content
+        self.text = text
+        self.kind = kind
+        self.truncated = truncated
+        self.encoding = encoding
+        self._resp = resp
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def raise_for_status(self) -> "Download":
+        self._resp.raise_for_status()  # нужен только статус/запрос, тело не читается
+        return self
+
+
+class _Reader:
+    """
+    Кормим чанками; feed() -> False, когда пора рвать соединение:
+    тип не из accept (решается по первому чанку), набрали max_bytes или max_chars декодированного текста.
+    """
+
+    def __init__(self, resp: httpx.Response, max_bytes: Optional[int], max_chars: Optional[int],
+                 accept: Optional[Iterable[str]], kind_caps: Optional[Dict[str, int]] = None):
+        self.resp = resp
+        self.max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+        self.kind_caps = kind_caps or {}
+        self.max_chars = max_chars
+        self.accept = set(accept) if accept else None
+        self.buf = bytearray()
+        self.parts: list = []
+        self.chars = 0
+        self.kind: Optional[str] = None
+        self.encoding = ""
+        self.decoder = None
+        self.truncated = False
+
+    def _start(self, head: bytes) -> bool:
+        self.kind = sniff(head, self.resp.headers.get("content-type", ""))
+        if self.accept is not None and self.kind not in self.accept:
+            self.truncated = True
+            return False
+        if self.kind in self.kind_caps:
+            self.max_bytes = self.kind_caps[self.kind]
+        enc = self.resp.charset_encoding
+        if not enc and self.kind == "html":
+            m = _META_CHARSET.search(head[:4096])
+            enc = m.group(1).decode("ascii", "ignore") if m else None
+        try:
+            self.decoder = codecs.getincrementaldecoder(enc or "utf-8")(errors="replace")
+            self.encoding = enc or "utf-8"
+        except LookupError:
+            self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            self.encoding = "utf-8"
+        return True
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.kind is None and not self._start(chunk):
+            return False
+        room = self.max_bytes - len(self.buf) if self.max_bytes > 0 else len(chunk)
+        if len(chunk) > room:
+            chunk = chunk[:max(0, room)]
+            self.truncated = True
+        self.buf += chunk
+        if self.kind != "pdf" and self.kind != "binary":
+            s = self.decoder.decode(chunk)
+            self.parts.append(s)
+            self.chars += len(s)
+            if self.max_chars is not None and self.chars >= self.max_chars:
+                self.truncated = True
+        return not self.truncated
+
+    def result(self) -> Download:
+        if self.kind is None:  # пустое тело
+            self._start(b"")
+        text = ""
+        if self.decoder is not None and self.kind not in ("pdf", "binary"):
+            self.parts.append(self.decoder.decode(b"", final=not self.truncated))
+            text = "".join(self.parts)
+            if self.max_chars is not None:
+                text = text[:self.max_chars]
+        return Download(self.resp, bytes(self.buf), text, self.kind or "text", self.truncated, self.encoding)
+
+
+def read_capped(resp: httpx.Response, chunks: Iterator[bytes], *, max_bytes: Optional[int] = None,
+                max_chars: Optional[int] = None, accept: Optional[Iterable[str]] = None,
+                kind_caps: Optional[Dict[str, int]] = None) -> Download:
+    """kind_caps — свой лимит для типа ({'pdf': ...}): PDF нельзя обрезать, HTML — можно."""
+    rd = _Reader(resp, max_bytes, max_chars, accept, kind_caps)
+    for chunk in chunks:
+        if not rd.feed(chunk):
+            break  # выход из client.stream(...) закроет соединение, остаток тела не качаем
+    return rd.result()
+
+
+async def aread_capped(resp: httpx.Response, chunks: AsyncIterator[bytes], *, max_bytes: Optional[int] = None,
+                       max_chars: Optional[int] = None, accept: Optional[Iterable[str]] = None,
+                       kind_caps: Optional[Dict[str, int]] = None) -> Download:
+    rd = _Reader(resp, max_bytes, max_chars, accept, kind_caps)
+    async for chunk in chunks:
+        if not rd.feed(chunk):
+            break
+    return rd.result()
+
+
+def get_capped(client: httpx.Client, url: str, *, params=None, headers=None, **kw) -> Download:
+    with client.stream("GET", url, params=params, headers=headers) as resp:
+        return read_capped(resp, resp.iter_bytes(), **kw)
+
+
+async def aget_capped(client: httpx.AsyncClient, url: str, *, params=None, headers=None, **kw) -> Download:
+    async with client.stream("GET", url, params=params, headers=headers) as resp:
+        return await aread_capped(resp, resp.aiter_bytes(), **kw)
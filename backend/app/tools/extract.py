@@ -0,0 +1,265 @@
+# backend/app/tools/extract.py — HTML -> (title, text) за один разбор lxml: чистка, скоринг блоков (как Readability), текст прямо из дерева
+from __future__ import annotations
+
+import re
+from typing import Dict, List, Optional, Tuple, Union
+
+from lxml import etree, html as lxml_html
+
+# что выкидываем до скоринга (вместе с содержимым)
+_JUNK_TAGS = ("script", "style", "noscript", "template", "svg", "iframe", "object", "embed", "canvas",
+              "button", "select", "textarea", "input")
+# блоки, после которых в тексте нужен перевод строки
+_BLOCK_TAGS = frozenset((
+    "p", "div", "section", "article", "main", "header", "footer", "aside", "nav", "br", "hr", "li", "ul", "ol",
+    "dl", "dt", "dd", "h1", "h2", "h3", "h4", "h5", "h6", "pre", "blockquote", "table", "tr", "th", "td",
+    "figure", "figcaption", "caption", "address", "details", "summary",
+))
+_PARA_TAGS = ("p", "pre", "td", "blockquote", "dd", "li")
+
+_POSITIVE = re.compile(r"article|body|content|entry|hentry|h-entry|main|page|pagination|post|text|blog|story|"
+                       r"documentwrapper|bodywrapper|section", re.I)
+_NEGATIVE = re.compile(r"hidden|^hid$|banner|combx|comment|com-|contact|foot|footer|footnote|masthead|media|meta|"
+                       r"outbrain|promo|related|scroll|share|shoutbox|sidebar|skyscraper|sponsor|shopping|tags|"
+                       r"tool|widget|nav|menu|breadcrumb|cookie|popup|modal|social|signup|subscribe", re.I)
+_UNLIKELY = re.compile(r"combx|comment|community|disqus|extra|foot|header|menu|remark|rss|shoutbox|sidebar|"
+                       r"sponsor|ad-break|agegate|pagination|pager|popup|cookie|banner|breadcrumb|related|share", re.I)
+_MAYBE = re.compile(r"and|article|body|column|main|shadow|content", re.I)
+_TITLE_SEP = re.compile(r"\s[\|\-–—:»]\s")
+
+_TAG_BONUS: Dict[str, float] = {
+    "div": 5, "article": 10, "main": 10, "section": 3,
+    "pre": 3, "td": 3, "blockquote": 3,
+    "address": -3, "ol": -3, "ul": -3, "dl": -3, "dd": -3, "dt": -3, "li": -3, "form": -3,
+    "h1": -5, "h2": -5, "h3": -5, "h4": -5, "h5": -5, "h6": -5, "th": -5,
+}
+
+MIN_TEXT = 200  # короче — считаем, что скоринг промахнулся, и берём весь body
+
+
+def _clean(s: str) -> str:
+    return re.sub(r"\s+", " ", (s or "")).strip()
+
+
+def parse(src: Union[str, bytes]):
+    """Один разбор документа. bytes — lxml сам посмотрит <meta charset>."""
+    if isinstance(src, str):
+        # lxml не принимает str с XML-декларацией кодировки
+        src = re.sub(r"^\s*<\?xml[^>]*\?>", "", src, count=1)
+    if not src or not src.strip():
+        return None
+    try:
+        return lxml_html.document_fromstring(src)
+    except (etree.ParserError, ValueError):
+        return None
+
+
+def _strip_junk(root) -> None:
+    etree.strip_elements(root, etree.Comment, etree.ProcessingInstruction, *_JUNK_TAGS, with_tail=False)
+    hidden = [el for el in root.iter("*")
+              if el.get("hidden") is not None or el.get("aria-hidden") == "true"
+              or "display:none" in (el.get("style") or "").replace(" ", "")]
+    hidden += root.find_class("headerlink")  # якоря «¶» у заголовков Sphinx
+    for el in hidden:
+        el.drop_tree()  # tail остаётся в родителе
+
+
+def title_of(root) -> str:
+    """
+    Заголовок: h1, если он целиком есть в <title>; иначе <title> без последнего « | Site»
+    (если от него осталось хотя бы два слова); нет <title> — первый h1.
+    """
+    t = root.find(".//title")
+    title = _clean(t.text_content()) if t is not None else ""
+    h1 = root.find(".//h1")
+    h1_text = _clean(h1.text_content()).rstrip("¶").strip() if h1 is not None else ""
+    if not title:
+        return h1_text
+    if h1_text and len(h1_text.split()) >= 2 and h1_text.lower() in title.lower():
+        return h1_text
+    seps = list(_TITLE_SEP.finditer(title))
+    if seps:
+        head = title[:seps[-1].start()]
+        if len(head.split()) >= 2:
+            return _clean(head)
+    return title
+
+
+def _class_weight(el) -> float:
+    w = 0.0
+    for attr in (el.get("class"), el.get("id")):
+        if attr:
+            if _NEGATIVE.search(attr):
+                w -= 25
+            if _POSITIVE.search(attr):
+                w += 25
+    return w
+
+
+def _text_len(el) -> int:
+    return len(_clean(el.text_content()))
+
+
+def _link_density(el, total: Optional[int] = None) -> float:
+    total = _text_len(el) if total is None else total
+    if not total:
+        return 0.0
+    links = sum(len(_clean(a.text_content())) for a in el.iter("a"))
+    return links / total
+
+
+def _score(body) -> List[Tuple[float, object]]:
+    """Очки кандидатов: абзац отдаёт родителю всё, деду половину. Возвращает [(score, el)] по убыванию."""
+    scores: Dict[object, float] = {}
+
+    def init(el) -> None:
+        if el not in scores:
+            scores[el] = _TAG_BONUS.get(el.tag, 0) + _class_weight(el)
+
+    for p in body.iter(*_PARA_TAGS):
+        # явный мусор по class/id не считаем — но только если это не основной контейнер
+        marker = f"{p.get('class') or ''} {p.get('id') or ''}"
+        if marker.strip() and _UNLIKELY.search(marker) and not _MAYBE.search(marker):
+            continue
+        text = _clean(p.text_content())
+        if len(text) < 25:
+            continue
+        parent = p.getparent()
+        if parent is None:
+            continue
+        gp = parent.getparent()
+        s = 1 + text.count(",") + text.count("，") + min(len(text) // 100, 3)
+        init(parent)
+        scores[parent] += s
+        if gp is not None:
+            init(gp)
+            scores[gp] += s / 2
+
+    ranked = []
+    for el, s in scores.items():
+        ranked.append((s * (1 - _link_density(el)), el))
+    ranked.sort(key=lambda x: x[0], reverse=True)
+    return ranked
+
+
+def _lift(ranked):
+    """
+    Несколько почти равных кандидатов (ответы на форуме, карточки) — берём их общего предка,
+    а не один из них (как в Readability.js).
+    """
+    top_score, top = ranked[0]
+    alts = [el for s, el in ranked[1:6] if top_score > 0 and s >= top_score * 0.75]
+    if len(alts) < 2:
+        return top_score, top
+    need = min(3, len(alts))
+    anc = top.getparent()
+    while anc is not None and anc.tag not in ("body", "html"):
+        inside = sum(1 for el in alts if any(a is anc for a in el.iterancestors()))
+        if inside >= need:
+            return top_score, anc
+        anc = anc.getparent()
+    return top_score, top
+
+
+def _content_nodes(ranked) -> List[object]:
+    """Лучший кандидат + соседи с заметными очками или длинным текстом без ссылок (как в Readability)."""
+    top_score, top = _lift(ranked)
+    by_el = {el: s for s, el in ranked}
+    parent = top.getparent()
+    if parent is None:
+        return [top]
+    threshold = max(10.0, top_score * 0.2)
+    out = []
+    for sib in parent:
+        if not isinstance(sib.tag, str):
+            continue
+        if sib is top:
+            out.append(sib)
+            continue
+        # сосед-обёртка (вопрос рядом с блоком ответов) — по лучшему кандидату внутри
+        s = max((by_el.get(d, 0.0) for d in sib.iter()), default=0.0)
+        if s >= threshold:
+            out.append(sib)
+        elif sib.tag == "p":
+            n = _text_len(sib)
+            ld = _link_density(sib, n)
+            if (n > 80 and ld < 0.25) or (0 < n <= 80 and ld == 0 and re.search(r"\.( |$)", sib.text_content())):
+                out.append(sib)
+    return out
+
+
+def _drop_noise(el) -> None:
+    """Внутри выбранного блока: навигация/подвалы/списки ссылок по классам и плотности ссылок."""
+    for sub in list(el.iter("nav", "aside", "footer", "header", "div", "section", "ul", "ol", "table")):
+        if sub is el or sub.getparent() is None:
+            continue
+        marker = f"{sub.get('class') or ''} {sub.get('id') or ''}"
+        if sub.tag in ("nav", "aside", "footer"):
+            sub.drop_tree()
+        elif marker.strip() and _class_weight(sub) < 0 and not _POSITIVE.search(marker):
+            sub.drop_tree()
+        elif sub.tag in ("ul", "ol", "div", "section", "table"):
+            n = _text_len(sub)
+            if n and _link_density(sub, n) > 0.5 and n < 1000:
+                sub.drop_tree()
+
+
+def to_text(nodes) -> str:
+    """Текст из дерева без повторного разбора: переводы строк на границах блоков (обход без рекурсии)."""
+    out: List[str] = []
+    for n in nodes:
+        stack = [(n, False)]
+        while stack:
+            el, closing = stack.pop()
+            if closing:
+                if el.tag in _BLOCK_TAGS:
+                    out.append("\n")
+                if el is not n and el.tail:
+                    out.append(el.tail)
+                continue
+            if el.tag in _BLOCK_TAGS:
+                out.append("\n")
+            if el.text:
+                out.append(el.text)
+            stack.append((el, True))
+            stack.extend((child, False) for child in reversed(el))
+    lines = (re.sub(r"[ \t\r\f\v\xa0]+", " ", ln).strip() for ln in "".join(out).splitlines())
+    return "\n".join(ln for ln in lines if ln)
+
+
+def extract_readable(src: Union[str, bytes]) -> Tuple[str, str]:
+    """HTML -> (title, text): основной контент по скорингу, фоллбек — весь body. Один разбор на всё."""
+    root = parse(src)
+    if root is None:
+        return "", ""
+    title = title_of(root)
+    _strip_junk(root)
+    body = root.find("body")
+    if body is None:
+        body = root
+    ranked = _score(body)
+    if ranked:
+        nodes = _content_nodes(ranked)
+        for n in nodes:
+            _drop_noise(n)
+        text = to_text(nodes)
+        if len(text) >= MIN_TEXT:
+            return title, text
+    return title, to_text([body])
+
+
+def extract_capped(src: Union[str, bytes], max_chars: int) -> Tuple[str, str]:
+    """Для пула процессов (web.web_fetch_many): режем в воркере, чтобы не гонять лишний текст между процессами.
+    Живёт здесь, а не в web.py: spawn-воркер импортирует только этот модуль, без httpx/DDGS/кэшей."""
+    title, text = extract_readable(src)
+    return title, text[:max_chars]
+
+
+def page_text(src: Union[str, bytes]) -> str:
+    """Весь видимый текст страницы (без скриптов/стилей) — для ingest, где нужен не только основной блок."""
+    root = parse(src)
+    if root is None:
+        return ""
+    _strip_junk(root)
+    body = root.find("body")
+    return to_text([body if body is not None else root])
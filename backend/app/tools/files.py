@@ -6,13 +6,6 @@ def read_text(path: str, encoding: Optional[str] = "utf-8", max_chars: int = 200
     return p.read_text(encoding=encoding)[:max_chars]
 
 def read_pdf(path: str, max_chars: int = 20000) -> str:
-    from pypdf import PdfReader
+    from backend.app.ingest.pdf import extract_text
     p = Path(path).expanduser().resolve()
-    r = PdfReader(str(p))
-    out = []
-    for pg in r.pages:
-        out.append(pg.extract_text() or "")
-        if sum(len(x) for x in out) >= max_chars:
-            break
-    return "\n".join(out)[:max_chars]
-
+    return extract_text(p, max_chars=max_chars)
@@ -0,0 +1,167 @@
+# backend/app/tools/search_health.py — здоровье поисковых бэкендов: EWMA латентности/успеха, circuit breaker, cooldown на 429
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+HEALTH_FILE = os.getenv("AIR4_SEARCH_HEALTH_FILE", os.path.join("storage", "search_health.json"))
+EWMA_ALPHA = float(os.getenv("AIR4_SEARCH_EWMA_ALPHA", "0.3"))
+CB_FAILURES = int(os.getenv("AIR4_SEARCH_CB_FAILURES", "3"))        # подряд отказов -> размыкаем
+CB_OPEN_SEC = float(os.getenv("AIR4_SEARCH_CB_OPEN_SEC", "300"))     # первое размыкание; дальше x2
+CB_OPEN_MAX_SEC = float(os.getenv("AIR4_SEARCH_CB_OPEN_MAX_SEC", "3600"))
+RATE_LIMIT_COOLDOWN_SEC = float(os.getenv("AIR4_SEARCH_429_COOLDOWN_SEC", "60"))
+SAVE_EVERY_SEC = 10.0
+
+# априори для незнакомого бэкенда: порядок из конфига сохраняется (сортировка стабильная)
+_PRIOR_LATENCY = 1.0
+_PRIOR_SUCCESS = 0.8
+
+T = TypeVar("T")
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: Optional[float] = None):
+        super().__init__("rate limited")
+        self.retry_after = retry_after
+
+
+class BackendState:
+    __slots__ = ("latency", "success", "fails", "open_until", "open_sec", "cooldown_until", "calls", "last_ok")
+
+    def __init__(self) -> None:
+        self.latency = _PRIOR_LATENCY
+        self.success = _PRIOR_SUCCESS
+        self.fails = 0
+        self.open_until = 0.0
+        self.open_sec = 0.0
+        self.cooldown_until = 0.0
+        self.calls = 0
+        self.last_ok = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "BackendState":
+        st = cls()
+        for k in cls.__slots__:
+            if k in d:
+                setattr(st, k, type(getattr(st, k))(d[k]))
+        return st
+
+    def expected_cost(self) -> float:
+        """Ожидаемое время до успешного ответа: латентность / вероятность успеха."""
+        return self.latency / max(self.success, 0.05)
+
+
+class HealthTracker:
+    def __init__(self, path: str = HEALTH_FILE):
+        self.path = path
+        self._st: Dict[str, BackendState] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = 0.0
+        self._load()
+
+    # ---- persistence ----
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._st = {k: BackendState.from_dict(v) for k, v in (data or {}).items()}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[WARN] search health load failed: {e}")
+
+    def save(self, force: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            if not self._dirty or (not force and now - self._saved_at < SAVE_EVERY_SEC):
+                return
+            data = {k: v.to_dict() for k, v in self._st.items()}
+            self._dirty = False
+            self._saved_at = now
+        try:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"[WARN] search health save failed: {e}")
+
+    # ---- учёт ----
+    def _state(self, name: str) -> BackendState:
+        st = self._st.get(name)
+        if st is None:
+            st = self._st[name] = BackendState()
+        return st
+
+    def record(self, name: str, ok: bool, latency: float, rate_limited: bool = False,
+               retry_after: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            st = self._state(name)
+            st.calls += 1
+            st.success = (1 - EWMA_ALPHA) * st.success + EWMA_ALPHA * (1.0 if ok else 0.0)
+            if ok:
+                st.latency = (1 - EWMA_ALPHA) * st.latency + EWMA_ALPHA * latency
+                st.fails = 0
+                st.open_until = 0.0
+                st.open_sec = 0.0
+                st.last_ok = now
+            elif rate_limited:
+                # 429 — бэкенд жив, просто просит подождать: не ломаем circuit, ставим паузу
+                st.cooldown_until = now + (retry_after if retry_after else RATE_LIMIT_COOLDOWN_SEC)
+            else:
+                # таймауты тоже тянут латентность вверх — медленный инстанс уезжает в конец
+                st.latency = (1 - EWMA_ALPHA) * st.latency + EWMA_ALPHA * latency
+                st.fails += 1
+                if st.fails >= CB_FAILURES:
+                    st.open_sec = min(CB_OPEN_MAX_SEC, st.open_sec * 2 if st.open_sec else CB_OPEN_SEC)
+                    st.open_until = now + st.open_sec
+            self._dirty = True
+        self.save()
+
+    def available(self, name: str, now: Optional[float] = None) -> bool:
+        now = now or time.time()
+        with self._lock:
+            st = self._st.get(name)
+            return st is None or (st.open_until <= now and st.cooldown_until <= now)
+
+    def order(self, items: Sequence[Tuple[str, T]]) -> List[Tuple[str, T]]:
+        """
+        Доступные бэкенды по ожидаемой стоимости; разомкнутые/на паузе — пропускаем.
+        Если пропущены все — отдаём их все (лучше попытка, чем пустой поиск).
+        После истечения open_until бэкенд снова в списке (half-open): один неуспех — и он опять разомкнут.
+        """
+        now = time.time()
+        with self._lock:
+            cost = {n: (self._st[n].expected_cost() if n in self._st else _PRIOR_LATENCY / _PRIOR_SUCCESS)
+                    for n, _ in items}
+        live = [(i, it) for i, it in enumerate(items) if self.available(it[0], now)]
+        pool = live or list(enumerate(items))
+        pool.sort(key=lambda p: (cost[p[1][0]], p[0]))
+        return [it for _, it in pool]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            out = {}
+            for k, v in self._st.items():
+                d = v.to_dict()
+                d["state"] = "open" if v.open_until > now else ("cooldown" if v.cooldown_until > now else "closed")
+                d["expected_cost"] = round(v.expected_cost(), 3)
+                out[k] = d
+            return out
+
+
+HEALTH = HealthTracker()
+atexit.register(HEALTH.save, True)
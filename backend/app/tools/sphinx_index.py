@@ -0,0 +1,250 @@
+# backend/app/tools/sphinx_index.py — searchindex.js (Sphinx) один раз: разобранный индекс в памяти и на диске + триграммы для подстрок
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+# ---- optional deps ----
+_HAS_LZ4 = False
+try:
+    import lz4.frame  # pip install lz4
+    _HAS_LZ4 = True
+except Exception:
+    pass
+
+INDEX_DIR = os.getenv("AIR4_DOCS_INDEX_DIR", os.path.join("storage", "sphinx_index"))
+INDEX_TTL_SEC = int(os.getenv("AIR4_DOCS_INDEX_TTL_SEC", str(60 * 60 * 24)))  # потом — условный GET по ETag
+
+_GRAM = 3
+
+
+def _flatten_idxs(val) -> List[int]:
+    out = []
+    if isinstance(val, int):
+        out.append(val)
+    elif isinstance(val, list):
+        for x in val:
+            if isinstance(x, int):
+                out.append(x)
+            elif isinstance(x, list) and x:
+                out.append(x[0])
+    return out
+
+
+def _grams(s: str) -> Set[str]:
+    return {s[i:i + _GRAM] for i in range(len(s) - _GRAM + 1)}
+
+
+class SphinxIndex:
+    """
+    docnames/titles/terms из searchindex.js; terms уже «расплющены» в списки номеров документов.
+    Подстрочный поиск по терминам — через триграммный индекс (строится лениво, один раз).
+    """
+
+    def __init__(self, docnames: List[str], titles: List[str], terms: Dict[str, List[int]]):
+        self.docnames = docnames
+        self.titles = titles
+        self.terms = terms
+        self._term_list: List[str] = []
+        self._grams: Optional[Dict[str, List[int]]] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_searchindex_js(cls, text: str) -> Optional["SphinxIndex"]:
+        m = re.search(r"Search\.setIndex\((\{.*\})\);?\s*$", text, re.S)
+        if not m:
+            return None
+        data = json.loads(m.group(1))
+        terms = {k: _flatten_idxs(v) for k, v in (data.get("terms") or {}).items()}
+        return cls(list(data.get("docnames") or []), list(data.get("titles") or []), terms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"docnames": self.docnames, "titles": self.titles, "terms": self.terms}
+
+    def _gram_index(self) -> Dict[str, List[int]]:
+        with self._lock:
+            if self._grams is None:
+                self._term_list = list(self.terms)
+                grams: Dict[str, List[int]] = defaultdict(list)
+                for i, term in enumerate(self._term_list):
+                    for g in _grams(term):
+                        grams[g].append(i)
+                self._grams = dict(grams)
+            return self._grams
+
+    def terms_containing(self, tok: str) -> Iterable[str]:
+        if len(tok) < _GRAM:
+            return [k for k in self.terms if tok in k]  # 1–2 символа: триграммы не помогут
+        grams = self._gram_index()
+        postings = sorted((grams.get(g, []) for g in _grams(tok)), key=len)
+        if not postings or not postings[0]:
+            return []
+        cand = set(postings[0])
+        for p in postings[1:]:
+            cand.intersection_update(p)
+            if not cand:
+                return []
+        # триграммы дают надмножество — проверяем подстроку
+        return [self._term_list[i] for i in cand if tok in self._term_list[i]]
+
+    def docs_for(self, tokens: List[str]) -> Set[int]:
+        """Документы, где есть все токены (точный термин или, если его нет, термины с подстрокой)."""
+        sets = []
+        for tok in tokens:
+            if tok in self.terms:
+                idxs = set(self.terms[tok])
+            else:
+                idxs = set()
+                for k in self.terms_containing(tok):
+                    idxs.update(self.terms[k])
+            if idxs:
+                sets.append(idxs)
+        if sets:
+            return set.intersection(*sets) if len(sets) > 1 else sets[0]
+        return {i for i, name in enumerate(self.docnames) if all(t in name.lower() for t in tokens)}
+
+
+# ---------- кэш: память + диск ----------
+_MEM: Dict[str, tuple] = {}  # url -> (SphinxIndex, checked_at, (etag, last_modified) этой версии)
+_MEM_LOCK = threading.Lock()
+_URL_LOCKS: Dict[str, threading.Lock] = {}
+
+
+def _url_lock(url: str) -> threading.Lock:
+    with _MEM_LOCK:  # get-or-create под общим замком: иначе два потока создадут два разных lock-а
+        lk = _URL_LOCKS.get(url)
+        if lk is None:
+            lk = _URL_LOCKS[url] = threading.Lock()
+        return lk
+
+
+def _paths(url: str):
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", url.split("://", 1)[-1])
+    base = os.path.join(INDEX_DIR, name)
+    return base + (".json.lz4" if _HAS_LZ4 else ".json"), base + ".meta.json"
+
+
+def _load_meta(url: str) -> Dict[str, Any]:
+    try:
+        with open(_paths(url)[1], "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _validators(meta: Dict[str, Any]) -> tuple:
+    return meta.get("etag"), meta.get("last_modified")
+
+
+def _load_disk(url: str):
+    data_p, _ = _paths(url)
+    meta = _load_meta(url)
+    if not meta:
+        return None, {}
+    try:
+        with open(data_p, "rb") as f:
+            raw = f.read()
+        if _HAS_LZ4:
+            raw = lz4.frame.decompress(raw)
+        d = json.loads(raw.decode("utf-8"))
+        return SphinxIndex(d["docnames"], d["titles"], d["terms"]), meta
+    except FileNotFoundError:
+        return None, {}
+    except Exception as e:
+        print(f"[WARN] sphinx index cache broken ({url}): {e}")
+        return None, {}
+
+
+def _save_disk(url: str, idx: SphinxIndex, meta: Dict[str, Any]) -> None:
+    data_p, meta_p = _paths(url)
+    try:
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        raw = json.dumps(idx.to_dict(), ensure_ascii=False).encode("utf-8")
+        if _HAS_LZ4:
+            raw = lz4.frame.compress(raw)
+        for path, blob in ((data_p, raw), (meta_p, json.dumps(meta).encode("utf-8"))):
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, path)
+    except Exception as e:
+        print(f"[WARN] sphinx index cache save failed ({url}): {e}")
+
+
+def _save_meta(url: str, meta: Dict[str, Any]) -> None:
+    _, meta_p = _paths(url)
+    try:
+        with open(meta_p, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+    except Exception as e:
+        print(f"[WARN] sphinx index meta save failed ({url}): {e}")
+
+
+def get_index(url: str, fetch: Callable[..., Any], ttl_sec: int = INDEX_TTL_SEC) -> Optional[SphinxIndex]:
+    """
+    Индекс по URL searchindex.js. fetch(url, headers=...) -> httpx.Response (304 возвращается как есть).
+    Свежий (моложе ttl) — из памяти/диска без сети; старше — условный GET (If-None-Match/If-Modified-Since),
+    на 304 только продлеваем. Сеть недоступна — работаем со старым.
+    """
+    now = time.time()
+    with _MEM_LOCK:
+        hit = _MEM.get(url)
+    if hit and now - hit[1] < ttl_sec:
+        return hit[0]
+
+    with _url_lock(url):  # один скачивающий на URL, остальные ждут его результат
+        with _MEM_LOCK:
+            hit = _MEM.get(url)
+        if hit and time.time() - hit[1] < ttl_sec:
+            return hit[0]
+
+        idx, meta = None, {}
+        if hit:
+            meta = _load_meta(url)
+            if not meta or _validators(meta) == hit[2]:
+                # на диске та же версия (или меты нет) — разобранный индекс из памяти годится
+                idx = hit[0]
+                meta = meta or {"checked_at": hit[1], "etag": hit[2][0], "last_modified": hit[2][1]}
+        if idx is None:
+            # нет в памяти или другой воркер уже скачал новую версию: её ETag к нашему старому индексу не пара
+            idx, meta = _load_disk(url)
+            if idx is None and hit:  # новая версия не читается — остаёмся на своей, со своими валидаторами
+                idx, meta = hit[0], {"checked_at": hit[1], "etag": hit[2][0], "last_modified": hit[2][1]}
+        if idx is not None and now - float(meta.get("checked_at") or 0) < ttl_sec:
+            with _MEM_LOCK:
+                _MEM[url] = (idx, float(meta["checked_at"]), _validators(meta))
+            return idx
+
+        headers = {}
+        if idx is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            resp = fetch(url, headers=headers)
+            if resp.status_code == 304 and idx is not None:
+                meta["checked_at"] = now
+                _save_meta(url, meta)
+            else:
+                fresh = SphinxIndex.from_searchindex_js(resp.text)
+                if fresh is None:
+                    return idx
+                idx = fresh
+                meta = {"checked_at": now, "etag": resp.headers.get("ETag"),
+                        "last_modified": resp.headers.get("Last-Modified")}
+                _save_disk(url, idx, meta)
+        except Exception as e:
+            if idx is None:
+                raise
+            print(f"[WARN] sphinx index refresh failed ({url}), using cached: {e}")
+            meta["checked_at"] = now  # не долбим недоступный сервер на каждом запросе
+            _save_meta(url, meta)  # ни другие воркеры, ни следующий старт
+        with _MEM_LOCK:
+            _MEM[url] = (idx, now, _validators(meta))
+        return idx
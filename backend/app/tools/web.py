@@ -1,47 +1,36 @@
 # backend/app/tools/web.py
 from __future__ import annotations
 
-import os, json, time, hashlib
+import asyncio
+import os, time
+import multiprocessing
 import re
+import threading
 import urllib.parse
-from typing import List, Dict, Any, Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional, Tuple
 
 import httpx
 from bs4 import BeautifulSoup
-from readability import Document
 from duckduckgo_search import DDGS
 
+from . import extract as _extract
+from .download import aget_capped, get_capped
+from .search_health import HEALTH, HealthTracker, RateLimited
+from .sphinx_index import get_index as get_sphinx_index
+from .web_cache import SearchFailed, canonical_url, get_cache, get_results, search_key
+
 UA = "AIR4Bot/1.0 (+local)"
 TIMEOUT = 20
 
-# ---------- Дисковый кэш для web_fetch ----------
-CACHE_DIR = os.path.join("storage", "web_cache")
-os.makedirs(CACHE_DIR, exist_ok=True)
-
-def _cache_key(url: str) -> str:
-    return hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json"
-
-def _cache_path(url: str) -> str:
-    return os.path.join(CACHE_DIR, _cache_key(url))
-
-def _cache_get(url: str, ttl_sec: int) -> dict | None:
-    path = _cache_path(url)
-    if not os.path.exists(path):
-        return None
-    try:
-        if (time.time() - os.path.getmtime(path)) > ttl_sec:
-            return None
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
-
-def _cache_set(url: str, payload: dict) -> None:
-    try:
-        with open(_cache_path(url), "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False)
-    except Exception:
-        pass
+# ---------- Кэш для web_fetch (storage/web_cache.sqlite3, см. web_cache.py) ----------
+# Старше ttl, но моложе ttl + WEB_CACHE_STALE_SEC — отдаём сразу и обновляем в фоне (stale-while-revalidate).
+WEB_CACHE_STALE_SEC = int(os.getenv("AIR4_WEB_CACHE_STALE_SEC", str(60 * 60 * 24 * 7)))
+# HTML больше этого не качаем (обрыв соединения): Readability всё равно берёт основной блок
+WEB_FETCH_MAX_BYTES = int(os.getenv("AIR4_WEB_FETCH_MAX_BYTES", str(4 * 1024 * 1024)))
+_READABLE_KINDS = ("html", "text", "json")
+_REVALIDATING: set[str] = set()
+_REVALIDATING_LOCK = threading.Lock()
 
 # ---------- Вспомогательное ----------
 def _clean(s: str) -> str:
@@ -56,19 +45,24 @@ def _domain_matches(url: str, allowed: set[str]) -> bool:
         return False
     return any(netloc == d or netloc.endswith("." + d) for d in allowed)
 
-def _http_get(url: str, *, params=None, headers=None, timeout=TIMEOUT, tries: int = 3, backoff: float = 0.6):
+def _http_get(url: str, *, params=None, headers=None, timeout=TIMEOUT, tries: int = 3, backoff: float = 0.6,
+              max_bytes: Optional[int] = None, max_chars: Optional[int] = None, accept=None):
     """
     GET с ретраями по сетевым ошибкам, 429 и 5xx.
     backoff: 0.6 -> 1.2 -> 1.8 ... сек
+    Тело читается потоком и не больше max_bytes (по умолчанию AIR4_WEB_MAX_BYTES) / max_chars текста;
+    тип не из accept — обрыв после первого чанка (см. download.py). Возвращает download.Download.
     """
     last_exc = None
     for attempt in range(1, tries + 1):
         try:
             with httpx.Client(follow_redirects=True, headers=headers or {"User-Agent": UA}, timeout=timeout) as client:
-                resp = client.get(url, params=params)
+                resp = get_capped(client, url, params=params, max_bytes=max_bytes, max_chars=max_chars, accept=accept)
             if resp.status_code in (429, 502, 503, 504):
                 time.sleep(backoff * attempt)
                 continue
+            if resp.status_code == 304:
+                return resp  # условный запрос: не изменилось — решает вызывающий
             resp.raise_for_status()
             return resp
         except httpx.RequestError as e:
@@ -83,12 +77,208 @@ def _http_get(url: str, *, params=None, headers=None, timeout=TIMEOUT, tries: in
         raise last_exc
 
 # ---------- Поиск ----------
-def web_search(
+# Хедж-каскад: бэкенды стартуют лесенкой (каждые SEARCH_HEDGE_DELAY сек или сразу после отказа),
+# не больше SEARCH_PARALLEL одновременно; первый, кто дал max_results, выигрывает — остальные отменяются.
+# Порядок — по здоровью (search_health): быстрые и живые первыми, разомкнутые/на cooldown после 429 пропускаются.
+SEARCH_PARALLEL = int(os.getenv("AIR4_SEARCH_PARALLEL", "3"))
+SEARCH_HEDGE_DELAY = float(os.getenv("AIR4_SEARCH_HEDGE_DELAY", "0.4"))
+SEARCH_TIMEOUT = float(os.getenv("AIR4_SEARCH_TIMEOUT", "8"))     # на один запрос к бэкенду
+# DDGS синхронный — крутится в своём пуле потоков, а не в default executor: asyncio.run() при выходе
+# ждёт default executor, и проигравший гонку DDGS держал бы синхронный web_search до конца
+_DDGS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("AIR4_DDGS_WORKERS", "4")), thread_name_prefix="ddgs")
+SEARCH_DEADLINE = float(os.getenv("AIR4_SEARCH_DEADLINE", "15"))  # на весь каскад
+
+_DEFAULT_SEARX = [
+    "https://searx.be/search",
+    "https://searxng.site/search",
+    "https://search.bus-hit.me/search",
+    "https://search.ononoki.org/search",
+    "https://searx.tiekoetter.com/search",
+    "https://search.stinpriza.org/search",
+]
+
+_DDG_HTML_HEADERS = {
+    "User-Agent": UA,
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
+    "Cache-Control": "no-cache",
+    "Pragma": "no-cache",
+}
+
+Backend = Tuple[str, Callable[[], Awaitable[List[Dict[str, Any]]]]]
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    try:
+        return float(resp.headers.get("Retry-After", ""))
+    except ValueError:
+        return None  # HTTP-date не разбираем — возьмём cooldown по умолчанию
+
+
+def _searx_instances() -> List[str]:
+    searx_env = os.getenv("SEARX_INSTANCES", "")
+    if searx_env.strip():
+        return [u.strip() for u in searx_env.split(",") if u.strip()]
+    return list(_DEFAULT_SEARX)
+
+
+def _parse_searx(data: dict, allowed: set[str], max_results: int) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    for it in data.get("results", []) or []:
+        url = it.get("url")
+        title = _clean(it.get("title"))
+        snippet = _clean(it.get("content") or it.get("snippet") or "")
+        if not url or not title:
+            continue
+        if not _domain_matches(url, allowed):
+            continue
+        out.append({"title": title, "url": url, "snippet": snippet})
+        if len(out) >= max_results:
+            break
+    return out
+
+
+def _parse_ddg_html(html: str, allowed: set[str], max_results: int) -> List[Dict[str, Any]]:
+    out: List[Dict[str, Any]] = []
+    soup = BeautifulSoup(html, "lxml")
+    link_selectors = [
+        "td.result-link a[href]",         # lite
+        "div.result__body a.result__a",   # html
+        "a.result__a[href]",              # html fallback
+        "a[href^='/l/?']",                # редиректы
+    ]
+    seen = set()
+    for sel in link_selectors:
+        for a in soup.select(sel):
+            href = a.get("href")
+            title = _clean(a.get_text())
+            if not href or not title:
+                continue
+            if href.startswith("/l/?"):
+                qs = urllib.parse.parse_qs(urllib.parse.urlparse(href).query)
+                if "uddg" in qs:
+                    href = urllib.parse.unquote(qs["uddg"][0])
+            if not _domain_matches(href, allowed):
+                continue
+            key = (title, href)
+            if key in seen:
+                continue
+            seen.add(key)
+            out.append({"title": title, "url": href, "snippet": ""})
+            if len(out) >= max_results:
+                return out
+    return out
+
+
+async def _timed(name: str, fn: Callable[[], Awaitable[List[Dict[str, Any]]]],
+                 health: Optional[HealthTracker]) -> List[Dict[str, Any]]:
+    """Вызов бэкенда с записью исхода в трекер. Отмена (проиграл гонку) — не отказ, её не учитываем."""
+    t0 = time.monotonic()
+    try:
+        res = await fn()
+    except asyncio.CancelledError:
+        raise
+    except RateLimited as e:
+        if health:
+            health.record(name, False, time.monotonic() - t0, rate_limited=True, retry_after=e.retry_after)
+        raise
+    except Exception as e:
+        if health:
+            # duckduckgo_search бросает свой RatelimitException — узнаём по имени, чтобы не зависеть от версии
+            rl = "ratelimit" in type(e).__name__.lower()
+            health.record(name, False, time.monotonic() - t0, rate_limited=rl)
+        raise
+    if health:
+        health.record(name, True, time.monotonic() - t0)
+    return res
+
+
+async def _hedged(backends: List[Backend], want: int, parallel: int = SEARCH_PARALLEL,
+                  hedge_delay: float = SEARCH_HEDGE_DELAY, deadline: float = SEARCH_DEADLINE,
+                  health: Optional[HealthTracker] = HEALTH,
+                  stats: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
+    """
+    Гонка бэкендов: вернёт первый результат с want хитами (остальные задачи отменяются),
+    иначе — самый полный из полученных к концу/дедлайну.
+    С health порядок — по ожидаемой латентности, недоступные пропускаются, исходы пишутся обратно.
+    stats["ok"] — сколько бэкендов ответили без ошибки (пусто от них — «не нашлось», а не сбой).
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    queue = health.order(backends) if health else list(backends)
+    pending: Dict[asyncio.Task, str] = {}
+    best: List[Dict[str, Any]] = []
+
+    def _launch() -> None:
+        name, fn = queue.pop(0)
+        pending[asyncio.ensure_future(_timed(name, fn, health))] = name
+
+    try:
+        if queue:
+            _launch()
+        while pending:
+            left = end - loop.time()
+            if left <= 0:
+                break
+            can_hedge = bool(queue) and len(pending) < max(1, parallel)
+            done, _ = await asyncio.wait(
+                list(pending), timeout=min(hedge_delay, left) if can_hedge else left,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                if can_hedge:
+                    _launch()  # текущие медлят — подстраховываемся следующим бэкендом
+                continue
+            for t in done:
+                pending.pop(t, None)
+                try:
+                    res = t.result() or []
+                    if stats is not None:
+                        stats["ok"] = stats.get("ok", 0) + 1
+                except Exception:
+                    res = []
+                if len(res) >= want:
+                    return res[:want]
+                if len(res) > len(best):
+                    best = res
+                if queue:
+                    _launch()  # отказ/недобор освобождает слот сразу, без ожидания хеджа
+        return best
+    finally:
+        for t in pending:
+            t.cancel()
+
+
+async def web_search_async(
     query: str,
     max_results: int = 5,
     region: str = "wt-wt",
     safesearch: str = "moderate",  # "off" | "moderate" | "strict"
     timelimit: Optional[str] = None,  # "d","w","m","y"
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Поиск с кэшем результатов (web_cache.ResultCache): ключ — нормализованный запрос + параметры,
+    пустой ответ кэшируется ненадолго, одинаковые параллельные запросы делят один каскад.
+    """
+    async def run() -> List[Dict[str, Any]]:
+        return await _web_search_uncached(query, max_results, region, safesearch, timelimit)
+
+    if not use_cache:
+        try:
+            return await run()
+        except SearchFailed as e:
+            return e.hits
+    key = search_key("web", query, region=region, safesearch=safesearch, timelimit=timelimit, n=max_results)
+    return await get_results().call_async("web", key, run)
+
+
+async def _web_search_uncached(
+    query: str,
+    max_results: int,
+    region: str,
+    safesearch: str,
+    timelimit: Optional[str],
 ) -> List[Dict[str, Any]]:
     """
     Каскадный поиск (SearXNG -> DDG -> HTML):
@@ -97,10 +287,8 @@ def web_search(
       3) SearXNG JSON (несколько инстансов, из .env при наличии)
       4) duckduckgo_search.DDGS().text(...)
       5) HTML DuckDuckGo (lite/html)
-    + пост-фильтр по 'site:domain'
+    3–5 — одна хедж-гонка в этом порядке (см. _hedged); + пост-фильтр по 'site:domain'
     """
-    results: List[Dict[str, Any]] = []
-
     # домены из site:
     site_tokens = re.findall(r"site:([^\s]+)", query)
     allowed = {tok.strip().lstrip(".").lower() for tok in site_tokens if tok.strip()}
@@ -109,219 +297,141 @@ def web_search(
     if allowed and any(d == "docs.python.org" or d.endswith(".docs.python.org") for d in allowed):
         q_no_site = re.sub(r"\s*site:[^\s]+", "", query).strip() or query
         try:
-            return _search_docs_python_org(q_no_site, max_results=max_results)
+            hits = await asyncio.to_thread(docs_search, q_no_site, max_results)
+            if hits:
+                return hits
         except Exception:
             pass
+        # пусто (индекс недоступен или не нашлось) — общий каскад с фильтром site:
 
     # 2) fast-path для pypi.org
     if allowed and any(d == "pypi.org" or d.endswith(".pypi.org") for d in allowed):
         q_no_site = re.sub(r"\s*site:[^\s]+", "", query).strip() or query
         try:
-            hits = _search_pypi(q_no_site, max_results=max_results)
+            hits = await asyncio.to_thread(_search_pypi, q_no_site, max_results)
             if hits:
                 return hits
         except Exception:
             pass
         # если пусто — идём дальше по каскаду
 
-    # 3) SearXNG JSON (в первую очередь)
-    searx_env = os.getenv("SEARX_INSTANCES", "")
-    if searx_env.strip():
-        searx_instances = [u.strip() for u in searx_env.split(",") if u.strip()]
-    else:
-        searx_instances = [
-            "https://searx.be/search",
-            "https://searxng.site/search",
-            "https://search.bus-hit.me/search",
-            "https://search.ononoki.org/search",
-            "https://searx.tiekoetter.com/search",
-            "https://search.stinpriza.org/search",
-        ]
     params_base = {
-        "q": query,
         "format": "json",
         "language": "en",
         "safesearch": 1 if safesearch == "strict" else 0,
         "categories": "general",
     }
 
-    def _searx_query(q: str) -> List[Dict[str, Any]]:
-        out: List[Dict[str, Any]] = []
-        for endpoint in searx_instances:
-            try:
-                resp = _http_get(endpoint, params={**params_base, "q": q}, headers={"User-Agent": UA})
-                data = resp.json()
-                items = data.get("results", []) or []
-                for it in items:
-                    url = it.get("url")
-                    title = _clean(it.get("title"))
-                    snippet = _clean(it.get("content") or it.get("snippet") or "")
-                    if not url or not title:
-                        continue
-                    if not _domain_matches(url, allowed):
-                        continue
-                    out.append({"title": title, "url": url, "snippet": snippet})
-                    if len(out) >= max_results:
-                        return out
-            except Exception:
-                continue
-        return out
-
-    # сначала пробуем как есть
-    results = _searx_query(query)
-    # если пусто и нет site-фильтра — попробуем альтернативы
-    if not results and not allowed:
-        for alt in [
-            f"site:readthedocs.io {query}",
-            f"site:github.com {query}",
-        ]:
-            results = _searx_query(alt)
-            if results:
-                break
-    if results:
-        return results[:max_results]
+    async with httpx.AsyncClient(follow_redirects=True, timeout=SEARCH_TIMEOUT) as client:
+
+        def _searx(endpoint: str, q: str):
+            async def run() -> List[Dict[str, Any]]:
+                resp = await client.get(endpoint, params={**params_base, "q": q}, headers={"User-Agent": UA})
+                if resp.status_code == 429:
+                    raise RateLimited(_retry_after(resp))
+                resp.raise_for_status()
+                return _parse_searx(resp.json(), allowed, max_results)
+            return run
+
+        def _ddgs():
+            def run_sync() -> List[Dict[str, Any]]:
+                out: List[Dict[str, Any]] = []
+                oversample = max_results * 4 if allowed else max_results
+                with DDGS() as ddgs:
+                    for r in ddgs.text(query, region=region, safesearch=safesearch,
+                                       timelimit=timelimit, max_results=oversample):
+                        url = r.get("href")
+                        if not url or not _domain_matches(url, allowed):
+                            continue
+                        out.append({"title": r.get("title"), "url": url, "snippet": r.get("body")})
+                        if len(out) >= max_results:
+                            break
+                return out
+
+            async def run() -> List[Dict[str, Any]]:
+                # библиотека синхронная: поток не прервать, но ждать его после победы другого бэкенда не будем
+                return await asyncio.get_running_loop().run_in_executor(_DDGS_POOL, run_sync)
+            return run
+
+        def _ddg_html(base_url: str):
+            async def run() -> List[Dict[str, Any]]:
+                params = {"q": query, "kl": region, "kp": "-2", "kz": "-1"}
+                if safesearch == "strict":
+                    params["kp"] = "1"
+                resp = await client.get(base_url, params=params, headers=_DDG_HTML_HEADERS)
+                if resp.status_code == 429:
+                    raise RateLimited(_retry_after(resp))
+                resp.raise_for_status()
+                return _parse_ddg_html(resp.text, allowed, max_results)
+            return run
+
+        backends: List[Backend] = [(ep, _searx(ep, query)) for ep in _searx_instances()]
+        backends += [
+            ("ddgs", _ddgs()),
+            ("ddg-lite", _ddg_html("https://duckduckgo.com/lite/")),
+            ("ddg-html", _ddg_html("https://duckduckgo.com/html/")),
+        ]
+        stats: Dict[str, int] = {}
+        results = await _hedged(backends, max_results, stats=stats)
+        # если пусто и нет site-фильтра — попробуем альтернативы через SearXNG
+        if not results and not allowed:
+            for alt in [f"site:readthedocs.io {query}", f"site:github.com {query}"]:
+                results = await _hedged([(ep, _searx(ep, alt)) for ep in _searx_instances()], max_results,
+                                        stats=stats)
+                if results:
+                    break
 
-    # 4) библиотека DDGS
-    try:
-        oversample = max_results * 4 if allowed else max_results
-        with DDGS() as ddgs:
-            for r in ddgs.text(
-                query,
-                region=region,
-                safesearch=safesearch,
-                timelimit=timelimit,
-                max_results=oversample,
-            ):
-                url = r.get("href")
-                if not url:
-                    continue
-                if not _domain_matches(url, allowed):
-                    continue
-                results.append({"title": r.get("title"), "url": url, "snippet": r.get("body")})
-                if len(results) >= max_results:
-                    return results
-    except Exception:
-        pass
-
-    # 5) HTML-фоллбеки DDG
-    headers = {
-        "User-Agent": UA,
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.9,ru;q=0.8",
-        "Cache-Control": "no-cache",
-        "Pragma": "no-cache",
-    }
+    if not results and not stats.get("ok"):
+        raise SearchFailed(reason="all search backends failed")  # пусто из-за сбоя — не кэшировать
+    return results[:max_results]
 
-    def _parse_ddg_html(client: httpx.Client, base_url: str, q: str) -> List[Dict[str, Any]]:
-        out: List[Dict[str, Any]] = []
-        params = {"q": q, "kl": region, "kp": "-2", "kz": "-1"}
-        if safesearch == "strict":
-            params["kp"] = "1"
-        url = base_url + "?" + urllib.parse.urlencode(params)
-        resp = client.get(url)
-        if resp.status_code == 429:
-            return []
-        resp.raise_for_status()
-        soup = BeautifulSoup(resp.text, "lxml")
-        link_selectors = [
-            "td.result-link a[href]",         # lite
-            "div.result__body a.result__a",   # html
-            "a.result__a[href]",              # html fallback
-            "a[href^='/l/?']",                # редиректы
-        ]
-        seen = set()
-        for sel in link_selectors:
-            for a in soup.select(sel):
-                href = a.get("href")
-                title = _clean(a.get_text())
-                if not href or not title:
-                    continue
-                if href.startswith("/l/?"):
-                    qs = urllib.parse.parse_qs(urllib.parse.urlparse(href).query)
-                    if "uddg" in qs:
-                        href = urllib.parse.unquote(qs["uddg"][0])
-                if not _domain_matches(href, allowed):
-                    continue
-                key = (title, href)
-                if key in seen:
-                    continue
-                seen.add(key)
-                out.append({"title": title, "url": href, "snippet": ""})
-                if len(out) >= max_results:
-                    return out
-        return out
 
+def _run_sync(coro):
+    """Синхронный вызов корутины в своём loop-е. Внутри работающего loop-а — ошибка: блокировали бы его."""
     try:
-        with httpx.Client(follow_redirects=True, headers=headers, timeout=TIMEOUT) as client:
-            results = _parse_ddg_html(client, "https://duckduckgo.com/lite/", query)
-            if not results:
-                results = _parse_ddg_html(client, "https://duckduckgo.com/html/", query)
-            if results:
-                return results[:max_results]
-    except Exception:
-        pass
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    coro.close()
+    raise RuntimeError("sync web_search called from a running event loop; await web_search_async instead")
 
-    return results[:max_results]
+
+def web_search(
+    query: str,
+    max_results: int = 5,
+    region: str = "wt-wt",
+    safesearch: str = "moderate",
+    timelimit: Optional[str] = None,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """Синхронная обёртка над web_search_async (для инструментов/скриптов)."""
+    return _run_sync(web_search_async(query, max_results=max_results, region=region,
+                                      safesearch=safesearch, timelimit=timelimit, use_cache=use_cache))
 
 # ---------- Спец-поиски ----------
 def _search_docs_python_org(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
     """
     Поиск по индекс-файлу Sphinx: https://docs.python.org/<ver>/searchindex.js
     Без JS-рендеринга. Плюс ранжирование по совпадениям.
+    Индекс разбирается один раз и кэшируется (память + storage/sphinx_index, см. sphinx_index.py).
     """
-    import json as _json
-
-    headers = {"User-Agent": UA}
     versions = ["3.13", "3"]
     tokens = [t.lower() for t in re.findall(r"[A-Za-z0-9_.]+", query)]
 
-    def _flatten_idxs(val) -> List[int]:
-        out = []
-        if isinstance(val, int):
-            out.append(val)
-        elif isinstance(val, list):
-            for x in val:
-                if isinstance(x, int):
-                    out.append(x)
-                elif isinstance(x, list) and x:
-                    out.append(x[0])
-        return out
+    def _fetch(url: str, headers: Optional[Dict[str, str]] = None):
+        return _http_get(url, headers={"User-Agent": UA, **(headers or {})})
 
     results: List[Dict[str, Any]] = []
+    failed = 0
 
     for ver in versions:
         try:
-            url = f"https://docs.python.org/{ver}/searchindex.js"
-            r = _http_get(url, headers=headers)
-            text = r.text
-
-            m = re.search(r"Search\.setIndex\((\{.*\})\);?\s*$", text, re.S)
-            if not m:
+            idx = get_sphinx_index(f"https://docs.python.org/{ver}/searchindex.js", _fetch)
+            if idx is None:
                 continue
-            data = _json.loads(m.group(1))
-
-            docnames = data.get("docnames", [])
-            titles = data.get("titles", [])
-            terms = data.get("terms", {})
-
-            sets = []
-            for tok in tokens:
-                if tok in terms:
-                    idxs = set(_flatten_idxs(terms[tok]))
-                    if idxs:
-                        sets.append(idxs)
-                else:
-                    cand = set()
-                    for k, v in terms.items():
-                        if tok in k:
-                            cand.update(_flatten_idxs(v))
-                    if cand:
-                        sets.append(cand)
-
-            if sets:
-                docs = set.intersection(*sets) if len(sets) > 1 else sets[0]
-            else:
-                docs = {i for i, name in enumerate(docnames) if all(t in name.lower() for t in tokens)}
+            docnames = idx.docnames
+            titles = idx.titles
+            docs = idx.docs_for(tokens)
 
             def _score(i: int) -> int:
                 name = (docnames[i] if i < len(docnames) else "").lower()
@@ -358,11 +468,19 @@ def _search_docs_python_org(query: str, max_results: int = 5) -> List[Dict[str,
                 if len(results) >= max_results:
                     return results
         except Exception:
+            failed += 1
             continue
 
+    if not results and failed == len(versions):
+        raise SearchFailed(reason="docs.python.org index unavailable")  # сбой, а не «не нашлось»
     return results
 
 def _search_pypi(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+    """Поиск по PyPI через кэш результатов (см. _search_pypi_uncached)."""
+    key = search_key("pypi", query, n=max_results)
+    return get_results().call("pypi", key, lambda: _search_pypi_uncached(query, max_results))
+
+def _search_pypi_uncached(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
     """
     Поиск по PyPI:
       1) Если запрос — одно слово (имя пакета), пробуем JSON API: /pypi/<name>/json.
@@ -388,6 +506,7 @@ def _search_pypi(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
             pass  # молча падаем на фоллбек
 
     # 2) HTML фоллбек
+    html_failed = False
     try:
         params = {"q": q}
         resp = _http_get("https://pypi.org/search/", params=params, headers=headers)
@@ -408,20 +527,92 @@ def _search_pypi(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
                 if len(results) >= max_results:
                     break
     except Exception:
-        pass
+        html_failed = True
 
+    if not results and html_failed:
+        raise SearchFailed(reason="pypi search failed")  # пустой от сбоя не кэшируем
     return results[:max_results]
 
 # ---------- Публичные обёртки ----------
 def docs_search(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
-    """Прямой поиск по Python Docs (индекс Sphinx)."""
-    return _search_docs_python_org(query, max_results=max_results)
+    """Прямой поиск по Python Docs (индекс Sphinx), через кэш результатов."""
+    key = search_key("docs", query, n=max_results)
+    return get_results().call("docs", key, lambda: _search_docs_python_org(query, max_results=max_results))
 
 def http_get(url: str, max_chars: int = 2000, timeout: int = TIMEOUT) -> Dict[str, Any]:
-    """Простой GET: вернёт статус, длину и первые max_chars HTML."""
-    resp = _http_get(url, headers={"User-Agent": UA}, timeout=timeout)
-    text = resp.text if isinstance(resp.text, str) else str(resp.text)
-    return {"status": resp.status_code, "length": len(text), "preview": text[:max_chars]}
+    """
+    Простой GET: вернёт статус, длину и первые max_chars HTML.
+    Качаем только то, что попадёт в preview; length — из Content-Length, если сервер его дал.
+    """
+    resp = _http_get(url, headers={"User-Agent": UA}, timeout=timeout, max_chars=max_chars)
+    text = resp.text
+    try:
+        length = int(resp.headers.get("Content-Length", ""))
+    except ValueError:
+        length = len(resp.content) if resp.truncated else len(text)
+    return {"status": resp.status_code, "length": length, "preview": text[:max_chars],
+            "truncated": resp.truncated, "kind": resp.kind}
+
+def extract_readable(html: str) -> tuple[str, str]:
+    """HTML -> (title, text): основной контент по скорингу блоков, фоллбек — весь текст страницы (см. extract.py)."""
+    return _extract.extract_readable(html)
+
+def _fetch_and_cache(url: str, max_chars: int, timeout: int,
+                     prev: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Скачать, выжать текст, положить в кэш. prev — устаревшая запись кэша: её ETag/Last-Modified
+    уходят как If-None-Match/If-Modified-Since, и на 304 только продлеваем TTL, без Readability.
+    """
+    headers = {"User-Agent": UA}
+    if prev:
+        if prev.get("etag"):
+            headers["If-None-Match"] = prev["etag"]
+        if prev.get("last_modified"):
+            headers["If-Modified-Since"] = prev["last_modified"]
+    resp = _http_get(url, headers=headers, timeout=timeout, tries=3, backoff=0.7,
+                     max_bytes=WEB_FETCH_MAX_BYTES, accept=_READABLE_KINDS)
+    if resp.status_code == 304 and prev:
+        try:
+            get_cache().touch(url)
+        except Exception as e:
+            print(f"[WARN] web cache touch failed: {e}")
+        return prev
+    if resp.kind not in _READABLE_KINDS:
+        raise ValueError(f"unsupported content ({resp.kind}): {resp.headers.get('content-type', '')}")
+    title, text = extract_readable(resp.text)
+    if len(text) > max_chars:
+        text = text[:max_chars]
+    payload = {"title": title, "text": text}
+    if resp.headers.get("ETag"):
+        payload["etag"] = resp.headers["ETag"]
+    if resp.headers.get("Last-Modified"):
+        payload["last_modified"] = resp.headers["Last-Modified"]
+    try:
+        get_cache().put(url, payload)
+    except Exception as e:
+        print(f"[WARN] web cache put failed: {e}")
+    return payload
+
+
+def _revalidate_bg(url: str, max_chars: int, timeout: int, prev: Optional[Dict[str, Any]] = None) -> None:
+    """Фоновое обновление устаревшей записи; одна задача на канонический URL."""
+    key = canonical_url(url)
+    with _REVALIDATING_LOCK:
+        if key in _REVALIDATING:
+            return
+        _REVALIDATING.add(key)
+
+    def run() -> None:
+        try:
+            _fetch_and_cache(url, max_chars, timeout, prev)
+        except Exception as e:
+            print(f"[WARN] web cache revalidate failed for {url}: {e}")
+        finally:
+            with _REVALIDATING_LOCK:
+                _REVALIDATING.discard(key)
+
+    threading.Thread(target=run, name="web-cache-revalidate", daemon=True).start()
+
 
 def web_fetch(
     url: str,
@@ -431,44 +622,149 @@ def web_fetch(
     ttl_sec: int = int(os.getenv("WEB_CACHE_TTL_SEC", str(60 * 60 * 24 * 3)))  # из .env или 3 дня
 ) -> Dict[str, Any]:
     """
-    Забирает страницу и выжимает читаемый текст (Readability -> BeautifulSoup).
-    Кэширует результат (storage/web_cache) на ttl_sec.
-    Возвращает: {title, url, text, cached: bool}
+    Забирает страницу и выжимает читаемый текст (extract.py: один разбор lxml).
+    Кэширует результат (storage/web_cache.sqlite3) на ttl_sec; устаревший, но не старше
+    ttl_sec + WEB_CACHE_STALE_SEC — отдаётся сразу (stale: True) и обновляется в фоне.
+    Обновление — условным запросом (ETag/Last-Modified): на 304 текст не перепарсивается.
+    Возвращает: {title, url, text, cached: bool[, stale: bool]}
     """
+    prev = None
     if use_cache:
-        hit = _cache_get(url, ttl_sec=ttl_sec)
+        try:
+            hit = get_cache().get(url)
+        except Exception as e:
+            print(f"[WARN] web cache get failed: {e}")
+            hit = None
         if hit:
-            txt = hit.get("text", "")
-            if len(txt) > max_chars:
-                txt = txt[:max_chars]
-            return {"title": hit.get("title", ""), "url": url, "text": txt, "cached": True}
+            payload, age = hit
+            if age <= ttl_sec + WEB_CACHE_STALE_SEC:
+                txt = payload.get("text", "")
+                if len(txt) > max_chars:
+                    txt = txt[:max_chars]
+                out = {"title": payload.get("title", ""), "url": url, "text": txt, "cached": True}
+                if age > ttl_sec:
+                    _revalidate_bg(url, max_chars, timeout, payload)
+                    out["stale"] = True
+                return out
+            prev = payload  # совсем старая запись — всё равно годится для условного запроса
 
-    resp = _http_get(url, headers={"User-Agent": UA}, timeout=timeout, tries=3, backoff=0.7)
-    html = resp.text
+    # всегда обновляем кэш, чтобы следующий вызов был быстрым
+    fresh = _fetch_and_cache(url, max_chars, timeout, prev)
+    return {"title": fresh.get("title", ""), "url": url, "text": fresh.get("text", "")[:max_chars], "cached": False}
 
-    # основной контент через Readability
-    try:
-        doc = Document(html)
-        title = _clean(doc.short_title())
-        summary_html = doc.summary(html_partial=True)
-        soup = BeautifulSoup(summary_html, "lxml")
-        for tag in soup(["script", "style", "noscript"]):
-            tag.decompose()
-        text = soup.get_text(separator="\n")
-    except Exception:
-        # фоллбек: целый текст страницы
-        soup = BeautifulSoup(html, "lxml")
-        for tag in soup(["script", "style", "noscript"]):
-            tag.decompose()
-        title = _clean(soup.title.get_text() if soup.title else "")
-        text = soup.get_text(separator="\n")
-
-    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
-    if len(text) > max_chars:
-        text = text[:max_chars]
 
-    # всегда обновляем кэш, чтобы следующий вызов был быстрым
-    _cache_set(url, {"title": title, "text": text})
+# ---------- Пакетная загрузка ----------
+# Сеть — один AsyncClient (общий пул соединений), не больше WEB_FETCH_PER_HOST запросов на хост;
+# Readability/lxml — в пуле процессов (CPU, GIL), результаты отдаются по мере готовности.
+WEB_FETCH_CONCURRENCY = int(os.getenv("AIR4_WEB_FETCH_CONCURRENCY", "8"))
+WEB_FETCH_PER_HOST = int(os.getenv("AIR4_WEB_FETCH_PER_HOST", "2"))
+WEB_EXTRACT_WORKERS = int(os.getenv("AIR4_WEB_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_EXTRACT_POOL: Optional[ProcessPoolExecutor] = None
+_EXTRACT_POOL_LOCK = threading.Lock()
+
+
+def _extract_pool() -> ProcessPoolExecutor:
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        if _EXTRACT_POOL is None:
+            # spawn: в uvicorn уже есть потоки, fork с ними небезопасен
+            _EXTRACT_POOL = ProcessPoolExecutor(max_workers=max(1, WEB_EXTRACT_WORKERS),
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _EXTRACT_POOL
+
 
-    return {"title": title, "url": url, "text": text, "cached": False}
+def shutdown_extract_pool() -> None:
+    global _EXTRACT_POOL
+    with _EXTRACT_POOL_LOCK:
+        if _EXTRACT_POOL is not None:
+            _EXTRACT_POOL.shutdown(wait=False, cancel_futures=True)
+            _EXTRACT_POOL = None
 
+
+async def _extract_async(html: str, max_chars: int) -> tuple[str, str]:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_extract_pool(), _extract.extract_capped, html, max_chars)
+    except Exception as e:
+        if "BrokenProcessPool" not in type(e).__name__:
+            raise
+        # пул упал — не роняем пачку, считаем в потоке
+        shutdown_extract_pool()
+        return await asyncio.to_thread(_extract.extract_capped, html, max_chars)
+
+
+async def web_fetch_many(
+    urls: List[str],
+    max_chars: int = 20000,
+    timeout: int = TIMEOUT,
+    use_cache: bool = True,
+    ttl_sec: int = int(os.getenv("WEB_CACHE_TTL_SEC", str(60 * 60 * 24 * 3))),
+    concurrency: int = WEB_FETCH_CONCURRENCY,
+    per_host: int = WEB_FETCH_PER_HOST,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Асинхронный web_fetch для списка URL: async-генератор, элементы — по мере готовности (не в порядке urls).
+    Элемент: {title, url, text, cached[, stale]} как у web_fetch, либо {url, error}.
+    Кэш тот же (свежее — из кэша, устаревшее — условным запросом, 304 только продлевает TTL).
+    """
+    hosts: Dict[str, asyncio.Semaphore] = {}
+    # общий предел — семафором: ждать своей очереди не должно считаться таймаутом (pool=None ниже)
+    in_flight = asyncio.Semaphore(max(1, concurrency))
+    limits = httpx.Limits(max_connections=max(1, concurrency), max_keepalive_connections=max(1, concurrency))
+
+    async def one(client: httpx.AsyncClient, url: str) -> Dict[str, Any]:
+        prev = None
+        if use_cache:
+            try:
+                hit = await asyncio.to_thread(get_cache().get, url)
+            except Exception:
+                hit = None
+            if hit:
+                payload, age = hit
+                if age <= ttl_sec:
+                    return {"title": payload.get("title", ""), "url": url,
+                            "text": payload.get("text", "")[:max_chars], "cached": True}
+                prev = payload
+        headers = {"User-Agent": UA}
+        if prev and prev.get("etag"):
+            headers["If-None-Match"] = prev["etag"]
+        if prev and prev.get("last_modified"):
+            headers["If-Modified-Since"] = prev["last_modified"]
+        host = urllib.parse.urlparse(url).netloc.lower()
+        sem = hosts.setdefault(host, asyncio.Semaphore(max(1, per_host)))
+        try:
+            # сначала слот хоста, потом общий (как в ingest/urls.py): ждущие одного хоста не занимают общий пул
+            async with sem, in_flight:
+                resp = await aget_capped(client, url, headers=headers,
+                                         max_bytes=WEB_FETCH_MAX_BYTES, accept=_READABLE_KINDS)
+            if resp.status_code == 304 and prev:
+                await asyncio.to_thread(get_cache().touch, url)
+                return {"title": prev.get("title", ""), "url": url,
+                        "text": prev.get("text", "")[:max_chars], "cached": True}
+            resp.raise_for_status()
+            if resp.kind not in _READABLE_KINDS:
+                raise ValueError(f"unsupported content ({resp.kind}): {resp.headers.get('content-type', '')}")
+            title, text = await _extract_async(resp.text, max_chars)
+        except Exception as e:
+            return {"url": url, "error": str(e) or type(e).__name__}
+        payload = {"title": title, "text": text}
+        if resp.headers.get("ETag"):
+            payload["etag"] = resp.headers["ETag"]
+        if resp.headers.get("Last-Modified"):
+            payload["last_modified"] = resp.headers["Last-Modified"]
+        try:
+            await asyncio.to_thread(get_cache().put, url, payload)
+        except Exception as e:
+            print(f"[WARN] web cache put failed: {e}")
+        return {"title": title, "url": url, "text": text, "cached": False}
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=httpx.Timeout(timeout, pool=None),
+                                 limits=limits) as client:
+        tasks = [asyncio.ensure_future(one(client, u)) for u in dict.fromkeys(urls)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:
+                t.cancel()  # потребитель вышел раньше — незачем докачивать остальное
@@ -0,0 +1,352 @@
+# backend/app/tools/web_cache.py — кэш web_fetch (один SQLite-файл, lz4, LRU по размеру, канонические URL) и кэш результатов поиска
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from backend.app.memory.sqlite_store import connect
+
+# ---- optional deps ----
+_HAS_LZ4 = False
+try:
+    import lz4.frame  # pip install lz4
+    _HAS_LZ4 = True
+except Exception:
+    pass
+
+CACHE_DB = os.getenv("AIR4_WEB_CACHE_DB", os.path.join("storage", "web_cache.sqlite3"))
+MAX_BYTES = int(float(os.getenv("AIR4_WEB_CACHE_MAX_MB", "256")) * 1024 * 1024)
+TOUCH_EVERY_SEC = 60.0  # accessed_at обновляем не чаще — чтение не должно превращаться в запись
+SEARCH_TTL_SEC = int(os.getenv("AIR4_SEARCH_CACHE_TTL_SEC", str(60 * 60)))
+SEARCH_NEG_TTL_SEC = int(os.getenv("AIR4_SEARCH_CACHE_NEG_TTL_SEC", "120"))  # пустой ответ: часто сбой сети
+
+# трекинговые параметры: на содержимое страницы не влияют, а ключи размножают
+_TRACKING_PREFIXES = ("utm_",)
+_TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_hsenc", "_hsmi", "ref_src"}
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url: str) -> str:
+    """
+    Ключ кэша: схема/хост в нижнем регистре, без порта по умолчанию, без #fragment,
+    без utm_*/fbclid/..., параметры отсортированы, хвостовой '/' у пути срезан.
+    """
+    try:
+        p = urllib.parse.urlsplit(url.strip())
+    except Exception:
+        return url
+    scheme = (p.scheme or "http").lower()
+    host = (p.hostname or "").lower()
+    if p.port and p.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{p.port}"
+    path = p.path or "/"
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/") or "/"
+    query = [
+        (k, v) for k, v in urllib.parse.parse_qsl(p.query, keep_blank_values=True)
+        if not k.lower().startswith(_TRACKING_PREFIXES) and k.lower() not in _TRACKING_PARAMS
+    ]
+    query.sort()
+    return urllib.parse.urlunsplit((scheme, host, path, urllib.parse.urlencode(query), ""))
+
+
+def _key(url: str) -> str:
+    return hashlib.sha1(canonical_url(url).encode("utf-8")).hexdigest()
+
+
+def _pack(payload: Dict[str, Any]) -> Tuple[str, bytes]:
+    raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    if _HAS_LZ4:
+        return "lz4", lz4.frame.compress(raw)
+    return "raw", raw
+
+
+def _unpack(codec: str, body: bytes) -> Dict[str, Any]:
+    if codec == "lz4":
+        body = lz4.frame.decompress(body)
+    return json.loads(body.decode("utf-8"))
+
+
+class WebCache:
+    """
+    pages(key, url, fetched_at, accessed_at, size, codec, body).
+    fetched_at — для TTL/stale-while-revalidate, accessed_at — для LRU-вытеснения при превышении max_bytes.
+    """
+
+    def __init__(self, path: str = CACHE_DB, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                size INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                body BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages(accessed_at);
+        """)
+        self._total = self._sum_size()
+
+    @property
+    def conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = connect(self.path)
+            self._local.conn = c
+        return c
+
+    def _sum_size(self) -> int:
+        row = self.conn.execute("SELECT COALESCE(SUM(size), 0) AS n FROM pages").fetchone()
+        return int(row["n"])
+
+    def get(self, url: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """(payload, age_sec) или None. TTL решает вызывающий — ему нужен и устаревший ответ."""
+        key = _key(url)
+        row = self.conn.execute(
+            "SELECT fetched_at, accessed_at, codec, body FROM pages WHERE key=?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            payload = _unpack(row["codec"], row["body"])
+        except Exception:
+            self.delete(url)
+            return None
+        now = time.time()
+        if now - row["accessed_at"] > TOUCH_EVERY_SEC:
+            try:
+                self.conn.execute("UPDATE pages SET accessed_at=? WHERE key=?", (now, key))
+            except Exception:
+                pass
+        return payload, now - row["fetched_at"]
+
+    def put(self, url: str, payload: Dict[str, Any], fetched_at: Optional[float] = None) -> None:
+        key = _key(url)
+        codec, body = _pack(payload)
+        now = time.time()
+        c = self.conn
+        with self._lock:
+            old = c.execute("SELECT size FROM pages WHERE key=?", (key,)).fetchone()
+            c.execute(
+                "INSERT OR REPLACE INTO pages(key, url, fetched_at, accessed_at, size, codec, body) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (key, canonical_url(url), fetched_at or now, now, len(body), codec, body),
+            )
+            self._total += len(body) - (old["size"] if old else 0)
+            if self.max_bytes > 0 and self._total > self.max_bytes:
+                self._evict()
+
+    def touch(self, url: str) -> None:
+        """Запись снова свежая (ответ 304): тело то же, fetched_at = сейчас."""
+        now = time.time()
+        self.conn.execute("UPDATE pages SET fetched_at=?, accessed_at=? WHERE key=?", (now, now, _key(url)))
+
+    def delete(self, url: str) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM pages WHERE key=?", (_key(url),))
+            self._total = self._sum_size()
+
+    def _evict(self) -> None:
+        """Самые давно читанные — до 90% лимита (с запасом, чтобы не вытеснять на каждом put)."""
+        c = self.conn
+        self._total = self._sum_size()  # другие процессы тоже пишут в файл
+        target = int(self.max_bytes * 0.9)
+        if self._total <= target:
+            return
+        freed, keys = 0, []
+        for row in c.execute("SELECT key, size FROM pages ORDER BY accessed_at ASC"):
+            keys.append((row["key"],))
+            freed += row["size"]
+            if self._total - freed <= target:
+                break
+        c.executemany("DELETE FROM pages WHERE key=?", keys)
+        self._total -= freed
+
+    def stats(self) -> Dict[str, Any]:
+        row = self.conn.execute("SELECT COUNT(*) AS n, COALESCE(SUM(size), 0) AS b FROM pages").fetchone()
+        return {"entries": int(row["n"]), "bytes": int(row["b"]), "max_bytes": self.max_bytes,
+                "codec": "lz4" if _HAS_LZ4 else "raw"}
+
+
+# ---------- Кэш результатов поиска ----------
+Hits = List[Dict[str, Any]]
+
+
+def search_key(kind: str, query: str, **params: Any) -> str:
+    """
+    Ключ: вид поиска + нормализованный запрос (регистр, пробелы; site:-фильтры отдельно и отсортированы)
+    + параметры (region, safesearch, timelimit, max_results ...).
+    """
+    q = (query or "").lower()
+    sites = sorted({t.lstrip(".") for t in re.findall(r"site:([^\s]+)", q)})
+    q = " ".join(re.sub(r"\s*site:[^\s]+", " ", q).split())
+    raw = json.dumps([kind, q, sites, sorted(params.items())], ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SearchFailed(Exception):
+    """
+    Апстрим не ответил (а не «ничего не нашлось»). fn бросает это вместо пустого списка:
+    ResultCache отдаёт hits вызывающим как обычно, но в кэш (даже негативный) не пишет.
+    """
+
+    def __init__(self, hits: Optional[Hits] = None, reason: str = ""):
+        super().__init__(reason or "search backends failed")
+        self.hits = hits or []
+
+
+class ResultCache:
+    """
+    results(key, kind, expires_at, codec, body) в том же файле, что и страницы.
+    Пустой ответ тоже кэшируется (neg_ttl покороче) — но не если он от сбоя (SearchFailed);
+    одинаковые запросы, пришедшие одновременно, ждут один вызов апстрима (single-flight) —
+    и из потоков, и из корутин.
+    """
+
+    def __init__(self, path: str = CACHE_DB):
+        self.path = path
+        self._local = threading.local()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                codec TEXT NOT NULL,
+                body BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_results_expires ON results(expires_at);
+        """)
+
+    @property
+    def conn(self):
+        c = getattr(self._local, "conn", None)
+        if c is None:
+            c = connect(self.path)
+            self._local.conn = c
+        return c
+
+    def get(self, key: str) -> Optional[Hits]:
+        row = self.conn.execute("SELECT expires_at, codec, body FROM results WHERE key=?", (key,)).fetchone()
+        if row is None or row["expires_at"] < time.time():
+            return None
+        try:
+            return _unpack(row["codec"], row["body"])["hits"]
+        except Exception:
+            return None
+
+    def put(self, key: str, kind: str, hits: Hits, ttl: int = SEARCH_TTL_SEC,
+            neg_ttl: int = SEARCH_NEG_TTL_SEC) -> None:
+        codec, body = _pack({"hits": hits})
+        now = time.time()
+        c = self.conn
+        c.execute(
+            "INSERT OR REPLACE INTO results(key, kind, expires_at, codec, body) VALUES (?,?,?,?,?)",
+            (key, kind, now + (ttl if hits else neg_ttl), codec, body),
+        )
+        self._puts += 1
+        if self._puts % 256 == 0:
+            c.execute("DELETE FROM results WHERE expires_at < ?", (now,))  # изредка подметаем протухшее
+
+    def _claim(self, key: str) -> Tuple[Future, bool]:
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut, False
+            fut = self._inflight[key] = Future()
+            return fut, True
+
+    def _settle(self, key: str, fut: Future, kind: str, hits: Optional[Hits],
+                exc: Optional[BaseException], ttl: int, neg_ttl: int, store: bool = True) -> None:
+        if exc is None and store:
+            try:
+                self.put(key, kind, hits or [], ttl, neg_ttl)
+            except Exception as e:
+                print(f"[WARN] search cache put failed: {e}")
+        with self._lock:
+            self._inflight.pop(key, None)
+        if exc is None:
+            fut.set_result(hits or [])
+        else:
+            fut.set_exception(exc)  # ошибки не кэшируем — только отдаём тем, кто ждал этот же вызов
+
+    def _lookup(self, key: str) -> Optional[Hits]:
+        try:
+            return self.get(key)
+        except Exception as e:
+            print(f"[WARN] search cache get failed: {e}")
+            return None
+
+    def call(self, kind: str, key: str, fn: Callable[[], Hits],
+             ttl: int = SEARCH_TTL_SEC, neg_ttl: int = SEARCH_NEG_TTL_SEC) -> Hits:
+        hits = self._lookup(key)
+        if hits is not None:
+            return hits
+        fut, leader = self._claim(key)
+        if not leader:
+            return [dict(h) for h in fut.result()]
+        try:
+            hits = fn()
+        except SearchFailed as e:
+            self._settle(key, fut, kind, e.hits, None, ttl, neg_ttl, store=False)
+            return e.hits
+        except BaseException as e:
+            self._settle(key, fut, kind, None, e, ttl, neg_ttl)
+            raise
+        self._settle(key, fut, kind, hits, None, ttl, neg_ttl)
+        return hits
+
+    async def call_async(self, kind: str, key: str, fn: Callable[[], Awaitable[Hits]],
+                         ttl: int = SEARCH_TTL_SEC, neg_ttl: int = SEARCH_NEG_TTL_SEC) -> Hits:
+        hits = await asyncio.to_thread(self._lookup, key)
+        if hits is not None:
+            return hits
+        fut, leader = self._claim(key)
+        if not leader:
+            return [dict(h) for h in await asyncio.wrap_future(fut)]
+        try:
+            hits = await fn()
+        except SearchFailed as e:
+            self._settle(key, fut, kind, e.hits, None, ttl, neg_ttl, store=False)
+            return e.hits
+        except BaseException as e:
+            self._settle(key, fut, kind, None, e, ttl, neg_ttl)
+            raise
+        await asyncio.to_thread(self._settle, key, fut, kind, hits, None, ttl, neg_ttl)
+        return hits
+
+
+_CACHE: Optional[WebCache] = None
+_RESULTS: Optional[ResultCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> WebCache:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = WebCache()
+        return _CACHE
+
+
+def get_results() -> ResultCache:
+    global _RESULTS
+    with _CACHE_LOCK:
+        if _RESULTS is None:
+            _RESULTS = ResultCache()
+        return _RESULTS
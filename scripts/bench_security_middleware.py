@@ -0,0 +1,170 @@
+# scripts/bench_security_middleware.py — RBAC + Audit: старый стек (BaseHTTPMiddleware) vs чистый ASGI
+# Запуск из корня репозитория:  python scripts/bench_security_middleware.py --n 5000
+import argparse, asyncio, os, statistics, sys, tempfile, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import HTTPException, Request
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from backend.app.security import (AuditEventsMiddleware, AuditLogger, AuthManager, RBACMiddleware, Settings)
+from backend.app.session_store import MemorySessionStore
+
+
+# ---- прежние реализации (до перехода на чистый ASGI), для сравнения ----
+class LegacyRBAC(BaseHTTPMiddleware):
+    def __init__(self, app, auth, allow_paths=None):
+        super().__init__(app)
+        self.auth = auth
+        self.allow_paths = allow_paths or ["/health", "/auth/login", "/auth/logout", "/api/v0/secure/status",
+                                           "/chat", "/memory/search"]
+
+    async def dispatch(self, request, call_next):
+        path = request.url.path
+        if path.startswith("/health") or path.startswith("/auth/login"):
+            return await call_next(request)
+        auth_header = request.headers.get("authorization")
+        token = None
+        if auth_header and auth_header.lower().startswith("bearer "):
+            token = auth_header.split(" ", 1)[1].strip()
+        if not token:
+            return JSONResponse({"detail": "Missing token"}, status_code=401)
+        try:
+            ti = self.auth.verify(token)
+        except HTTPException as exc:
+            return JSONResponse({"detail": exc.detail}, status_code=exc.status_code)
+        if ti.profile == "duress" and not any(path.startswith(p) for p in self.allow_paths):
+            return JSONResponse({"detail": "RBAC: blocked in duress profile"}, status_code=403)
+        request.state.auth = ti
+        return await call_next(request)
+
+
+class LegacyAudit(BaseHTTPMiddleware):
+    def __init__(self, app, audit):
+        super().__init__(app)
+        self.audit = audit
+
+    async def dispatch(self, request, call_next):
+        response = await call_next(request)
+        try:
+            ti = getattr(request.state, "auth", None)
+            if request.method == "POST" and request.url.path.startswith("/chat"):
+                self.audit.log("chat", request, ti.profile if ti else None, ok=(200 <= response.status_code < 400))
+        except Exception:
+            pass
+        return response
+
+
+# ---- приложение ----
+STREAM_CHUNKS = 20
+STREAM_DELAY = 0.002
+
+
+async def ping(request):
+    return JSONResponse({"ok": True})
+
+
+async def chat(request):
+    await request.body()
+    return JSONResponse({"reply": "ok", "profile": request.state.auth.profile})
+
+
+async def stream(request):
+    async def gen():
+        for i in range(STREAM_CHUNKS):
+            yield f"data: {i}\n\n".encode()
+            await asyncio.sleep(STREAM_DELAY)
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+def build(kind: str, auth: AuthManager, audit: AuditLogger):
+    app = Starlette(routes=[Route("/ping", ping), Route("/chat", chat, methods=["POST"]), Route("/stream", stream)])
+    if kind == "legacy":
+        app.add_middleware(LegacyAudit, audit=audit)
+        app.add_middleware(LegacyRBAC, auth=auth)
+    else:
+        app.add_middleware(AuditEventsMiddleware, audit=audit)
+        app.add_middleware(RBACMiddleware, auth=auth)
+    return app
+
+
+# ---- минимальный ASGI-клиент: без сети и httpx, чтобы мерить сами middleware ----
+async def call(app, method: str, path: str, token: str, body: bytes = b""):
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode()),
+                         (b"content-length", str(len(body)).encode())],
+             "client": ("127.0.0.1", 5000), "server": ("bench", 80)}
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    t0 = time.perf_counter()
+    first = None
+    status = 0
+
+    async def send(msg):
+        nonlocal first, status
+        if msg["type"] == "http.response.start":
+            status = msg["status"]
+        elif msg["type"] == "http.response.body" and msg.get("body") and first is None:
+            first = time.perf_counter() - t0
+
+    await app(scope, receive, send)
+    return status, first, time.perf_counter() - t0
+
+
+async def run(app, method, path, token, n, body=b""):
+    lat = []
+    firsts = []
+    t0 = time.perf_counter()
+    for _ in range(n):
+        status, first, dt = await call(app, method, path, token, body)
+        assert status == 200, status
+        lat.append(dt)
+        firsts.append(first or dt)
+    total = time.perf_counter() - t0
+    lat.sort()
+    return n / total, lat[len(lat) // 2] * 1e6, lat[int(len(lat) * 0.99)] * 1e6, statistics.median(firsts) * 1e3
+
+
+async def main_async(args):
+    tmp = tempfile.mkdtemp(prefix="bench_mw_")
+    audit = AuditLogger(os.path.join(tmp, "audit.log"))
+    settings = Settings()
+    settings.SECRET_KEY = "bench-only-key"  # не трогаем storage/secret_key
+    auth = AuthManager(settings, audit, store=MemorySessionStore(), sweep_sec=0)
+    token = auth.login("0000", None)["token"]
+
+    print(f"{'stack':7} {'route':8} {'req/s':>9} {'p50 us':>9} {'p99 us':>9} {'1st chunk ms':>13}")
+    for kind in ("legacy", "asgi"):
+        app = build(kind, auth, audit)
+        await run(app, "GET", "/ping", token, 200)  # прогрев
+        for label, method, path, n, body in (("GET ping", "GET", "/ping", args.n, b""),
+                                             ("POST chat", "POST", "/chat", args.n, b'{"q":"hi"}'),
+                                             ("SSE", "GET", "/stream", args.n_stream, b"")):
+            rps, p50, p99, first = await run(app, method, path, token, n, body)
+            print(f"{kind:7} {label:9} {rps:9.0f} {p50:9.0f} {p99:9.0f} {first:13.2f}")
+    audit.close()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=5000, help="запросов на обычный маршрут")
+    ap.add_argument("--n-stream", type=int, default=50, help="запросов на SSE-маршрут")
+    asyncio.run(main_async(ap.parse_args()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
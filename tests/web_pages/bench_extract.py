@@ -0,0 +1,90 @@
+# tests/web_pages/bench_extract.py — пропускная способность извлечения текста: старый путь (Readability + BS4) vs tools/extract.py
+import argparse, re, sys, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT))
+
+from bs4 import BeautifulSoup
+from readability import Document
+
+from backend.app.tools.extract import extract_readable as extract_new
+
+
+def _clean(s: str) -> str:
+    return re.sub(r"\s+", " ", (s or "")).strip()
+
+
+def extract_legacy(html: str):
+    """Прежний web.extract_readable: Readability разбирает страницу, BS4 — ещё раз summary (и ещё раз всё при ошибке)."""
+    try:
+        doc = Document(html)
+        title = _clean(doc.short_title())
+        soup = BeautifulSoup(doc.summary(html_partial=True), "lxml")
+        for tag in soup(["script", "style", "noscript"]):
+            tag.decompose()
+        text = soup.get_text(separator="\n")
+    except Exception:
+        soup = BeautifulSoup(html, "lxml")
+        for tag in soup(["script", "style", "noscript"]):
+            tag.decompose()
+        title = _clean(soup.title.get_text() if soup.title else "")
+        text = soup.get_text(separator="\n")
+    text = "\n".join(line.strip() for line in text.splitlines() if line.strip())
+    return title, text
+
+
+def load_pages(d: Path):
+    pages = []
+    for p in sorted(d.glob("*.html")):
+        raw = p.read_bytes()
+        m = re.search(rb"charset=[\"']?([A-Za-z0-9_-]+)", raw[:2048])
+        enc = m.group(1).decode() if m else "utf-8"
+        pages.append((p.name, raw.decode(enc, errors="replace")))
+    return pages
+
+
+def bench(fn, pages, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for _, html in pages:
+            fn(html)
+    return time.perf_counter() - t0
+
+
+def overlap(a: str, b: str) -> float:
+    """Доля слов старого результата, найденных в новом (грубая проверка, что вытащили то же самое)."""
+    wa, wb = set(a.lower().split()), set(b.lower().split())
+    return len(wa & wb) / max(1, len(wa))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", default=str(Path(__file__).parent / "pages"), help="каталог с сохранёнными *.html")
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    pages = load_pages(Path(args.pages))
+    if not pages:
+        print("no pages")
+        return 1
+    total_mb = sum(len(h.encode("utf-8")) for _, h in pages) / 1e6
+
+    print(f"{'page':28} {'legacy chars':>12} {'new chars':>10} {'overlap':>8}  title (new)")
+    for name, html in pages:
+        t_old, x_old = extract_legacy(html)
+        t_new, x_new = extract_new(html)
+        print(f"{name:28} {len(x_old):12d} {len(x_new):10d} {overlap(x_old, x_new):8.2f}  {t_new[:50]}")
+
+    # прогрев (импорты, кэши регэкспов)
+    bench(extract_legacy, pages, 1)
+    bench(extract_new, pages, 1)
+    n = len(pages) * args.repeat
+    for label, fn in (("legacy", extract_legacy), ("new", extract_new)):
+        dt = bench(fn, pages, args.repeat)
+        print(f"{label:7} {n / dt:8.1f} pages/s  {total_mb * args.repeat / dt:6.2f} MB/s  ({dt * 1000 / n:.2f} ms/page)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())